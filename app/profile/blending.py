@@ -0,0 +1,76 @@
+"""
+Module for benchmarking the per-frame cost of each seam blending mode.
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import argparse
+import time
+import numpy as np
+import cv2
+
+from app.stitcher.core.blending import BLENDERS, set_blender
+from app.stitcher.core.warp import build_warp_plan
+from app.util.textformatter import TextFormatter
+
+def main():
+    """
+    Responsible for benchmarking every blending mode on a pair of synthetic frames.
+    """
+    args = parse_args()
+    frame1, frame2, homography = make_frames(args.width, args.height, args.overlap)
+
+    TextFormatter.print_heading("Blending of two %dx%d frames overlapping by %d%%" % (
+        args.width, args.height, 100 * args.overlap))
+    for name in [None] + sorted(BLENDERS):
+        benchmark_blender(name, frame1, frame2, homography, args.repeat)
+
+def make_frames(width, height, overlap):
+    """
+    Returns two textured frames of a scene, the second one brighter and seen from a camera
+    turned to the right, along with the homography from the first frame to the second.
+    """
+    state = np.random.RandomState(0)
+    offset = int(width * (1 - overlap))
+    scene = cv2.resize(state.randint(0, 256, (height // 16, (width + offset) // 16, 3))
+                       .astype(np.uint8), (width + offset, height),
+                       interpolation=cv2.INTER_CUBIC)
+    frame1 = scene[:, :width].copy()
+    frame2 = cv2.add(scene[:, offset:offset + width], (20, 20, 20, 0))
+    homography = np.array([[1, 0, -offset], [0, 1, 0], [0, 0, 1]], dtype=np.float64)
+    return frame1, frame2, homography
+
+def benchmark_blender(name, frame1, frame2, homography, repeat):
+    """
+    Prints the time to prepare the blender and the average time to render a frame with it.
+    """
+    start_time = time.time()
+    plan = set_blender(build_warp_plan(frame2.shape, frame1.shape, homography), name)
+    prepare_time = time.time() - start_time
+
+    plan.render([frame1, frame2])
+    start_time = time.time()
+    for _ in range(repeat):
+        plan.render([frame1, frame2])
+    render_time = (time.time() - start_time) / repeat
+
+    TextFormatter.print_pair(name or "none", "%.1f ms per frame, %.0f ms to prepare" % (
+        1000 * render_time, 1000 * prepare_time))
+
+def parse_args():
+    """
+    Returns parsed arguments
+    """
+    parser = argparse.ArgumentParser(description="Seam blending benchmark")
+    parser.add_argument('--width', dest='width', type=int, default=1920,
+                        help='Width of the blended frames.')
+    parser.add_argument('--height', dest='height', type=int, default=1080,
+                        help='Height of the blended frames.')
+    parser.add_argument('--overlap', dest='overlap', type=float, default=0.3,
+                        help='Overlap of the frames as a fraction of their width.')
+    parser.add_argument('--repeat', dest='repeat', type=int, default=20,
+                        help='Number of timed frames per blending mode.')
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    main()
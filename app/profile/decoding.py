@@ -0,0 +1,121 @@
+"""
+Module for benchmarking the rate at which frames of a video are decoded and delivered.
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+import numpy as np
+import cv2
+
+from app.util.feed import VideoFeed
+from app.util.textformatter import TextFormatter
+
+def main():
+    """
+    Responsible for benchmarking the delivery of the frames of a video by the former
+    has_next/get_next loop and by iterating over a feed.
+    """
+    args = parse_args()
+    directory = None
+    path = args.path
+    if path is None:
+        directory = tempfile.mkdtemp()
+        path = os.path.join(directory, "sample.mp4")
+        make_video(path, args.width, args.height, args.frames)
+
+    try:
+        TextFormatter.print_heading("Decoding of %s" % path)
+        legacy_rate = benchmark(path, deliver_legacy)
+        TextFormatter.print_pair("legacy", "%.0f frames per second" % legacy_rate)
+        rate = benchmark(path, deliver_once)
+        TextFormatter.print_pair("single", "%.0f frames per second, %.2fx" % (
+            rate, rate / legacy_rate))
+        feed_rate = benchmark(path, deliver_feed)
+        TextFormatter.print_pair("feed", "%.0f frames per second, corrected" % (
+            feed_rate))
+    finally:
+        if directory is not None:
+            shutil.rmtree(directory)
+
+def make_video(path, width, height, count):
+    """
+    Writes a sample MP4 of count frames of a scene panning to the right.
+    """
+    state = np.random.RandomState(0)
+    scene = cv2.resize(state.randint(0, 256, (height // 8, (width + count * 4) // 8, 3))
+                       .astype(np.uint8), (width + count * 4, height),
+                       interpolation=cv2.INTER_CUBIC)
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc('m', 'p', '4', 'v'), 30.0,
+                             (width, height))
+    for index in range(count):
+        writer.write(scene[:, index * 4:index * 4 + width])
+    writer.release()
+
+def deliver_legacy(path):
+    """
+    Delivers the frames of the video as the has_next/get_next loop used to, grabbing
+    a frame to check for it and reading another one. Returns the number of delivered frames.
+    """
+    capture = cv2.VideoCapture(path)
+    count = 0
+    while capture.grab():
+        found, _ = capture.read()
+        if not found:
+            break
+        count += 1
+    capture.release()
+    return count
+
+def deliver_once(path):
+    """
+    Delivers the frames of the video, grabbing and decoding each once.
+    Returns the number of delivered frames.
+    """
+    capture = cv2.VideoCapture(path)
+    count = 0
+    while capture.grab():
+        capture.retrieve()
+        count += 1
+    capture.release()
+    return count
+
+def deliver_feed(path):
+    """
+    Delivers the corrected frames of the video by iterating over a feed.
+    Returns the number of delivered frames.
+    """
+    feed = VideoFeed(path)
+    count = sum(1 for _ in feed)
+    feed.close()
+    return count
+
+def benchmark(path, deliver):
+    """
+    Returns the number of frames per second the delivery function delivers.
+    """
+    start_time = time.time()
+    count = deliver(path)
+    return count / (time.time() - start_time)
+
+def parse_args():
+    """
+    Returns parsed arguments
+    """
+    parser = argparse.ArgumentParser(description="Video decoding benchmark")
+    parser.add_argument('--path', dest='path', default=None,
+                        help='Video to decode. A sample MP4 is generated if not provided.')
+    parser.add_argument('--width', dest='width', type=int, default=1280,
+                        help='Width of the generated sample.')
+    parser.add_argument('--height', dest='height', type=int, default=720,
+                        help='Height of the generated sample.')
+    parser.add_argument('--frames', dest='frames', type=int, default=300,
+                        help='Number of frames of the generated sample.')
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""
+Module for benchmarking the feature detector and matcher backends.
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import argparse
+import time
+import imutils
+import numpy as np
+import cv2
+
+from app.stitcher.core.features import (DEFAULT_MATCHERS, get_available_detectors,
+                                        get_backend)
+from app.stitcher.core.stitcher import compute_matches, match_points
+from app.util.textformatter import TextFormatter
+
+IMAGE_PATHS = ["app/storage/stitch_tester/yard%d.jpg" % index for index in range(1, 5)]
+
+def main():
+    """
+    Responsible for benchmarking every available backend on the stitch tester images.
+    """
+    args = parse_args()
+    images = [imutils.resize(cv2.imread(path), args.width) for path in IMAGE_PATHS]
+    pairs = list(zip(images[:-1], images[1:]))
+
+    TextFormatter.print_heading("Feature backends on %d image pairs" % len(pairs))
+    for detector_name in get_available_detectors():
+        benchmark_backend(get_backend(detector_name), pairs, args.repeat)
+    for detector_name in sorted(set(DEFAULT_MATCHERS) - set(get_available_detectors())):
+        TextFormatter.print_error("%s is not available in this OpenCV build." % detector_name)
+
+def benchmark_backend(backend, pairs, repeat):
+    """
+    Prints the average match time and the match and inlier counts of the backend.
+    """
+    match_times = []
+    good_counts = []
+    inlier_counts = []
+    for frame1, frame2 in pairs:
+        for _ in range(repeat):
+            start_time = time.time()
+            matches, keypoints1, keypoints2 = compute_matches(frame1, frame2, backend)
+            src_pts, dst_pts = match_points(matches, keypoints1, keypoints2)
+            match_times.append(time.time() - start_time)
+
+        good_counts.append(len(src_pts))
+        inlier_counts.append(count_inliers(src_pts, dst_pts))
+
+    TextFormatter.print_pair(backend.name, "%.1f ms per pair, %d good matches, %d inliers" % (
+        1000 * np.mean(match_times), np.sum(good_counts), np.sum(inlier_counts)))
+
+def count_inliers(src_pts, dst_pts):
+    """
+    Returns the number of RANSAC homography inliers among the matched points.
+    """
+    if len(src_pts) < 4:
+        return 0
+    _, mask = cv2.findHomography(src_pts, dst_pts, cv2.RANSAC, 5.0)
+    return 0 if mask is None else int(mask.sum())
+
+def parse_args():
+    """
+    Returns parsed arguments
+    """
+    parser = argparse.ArgumentParser(description="Feature backend benchmark")
+    parser.add_argument('--width', dest='width', type=int, default=400,
+                        help='Width the stitch tester images are resized to.')
+    parser.add_argument('--repeat', dest='repeat', type=int, default=5,
+                        help='Number of timed matches per image pair.')
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    main()
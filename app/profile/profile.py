@@ -9,6 +9,7 @@ import cProfile
 
 from app.util.feed import CameraFeed
 from app.util.feed import VideoFeed
+from app.stitcher.core.batch import stitch_batch
 from app.stitcher.core.feedhandler import MultiFeedHandler
 from app.util.configure import get_configuration
 
@@ -21,6 +22,8 @@ def main():
     pr.enable()
     if args.profile_single_stitch:
         stitch_single()
+    elif args.profile_batch_stitch:
+        stitch_double_batch()
     else:
         stitch_double()
     pr.disable()
@@ -49,6 +52,16 @@ def stitch_double():
     handler = MultiFeedHandler([left_feed, right_feed])
     handler.stitch_feeds()
 
+def stitch_double_batch():
+    """
+    Responsible for handling headless batch stitch of two videos.
+    Only the parent process is profiled, so segments show as time waiting on the pool.
+    """
+    config = get_configuration("config/profiles/twovideostitch.yml")
+    stitch_batch([config['left-video-path'], config['right-video-path']],
+                 config['output-path'], config['width'], config['height'],
+                 config.get('batch-processes'), config.get('batch-segments'))
+
 def parse_args():
     """
     Returns parsed arguments
@@ -58,6 +71,8 @@ def parse_args():
                         action='store_true', default=False)
     parser.add_argument('--double', dest='profile_double_stitch',
                         action='store_true', default=False)
+    parser.add_argument('--batch', dest='profile_batch_stitch',
+                        action='store_true', default=False)
     return parser.parse_args()
 
 if __name__ == "__main__":
@@ -0,0 +1,96 @@
+"""
+Module for benchmarking the speedup of warping panoramas in a pool of threads.
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import argparse
+from multiprocessing.pool import ThreadPool
+import time
+import numpy as np
+import cv2
+
+from app.stitcher.core.warp import build_composite_plan
+from app.util.textformatter import TextFormatter
+
+def main():
+    """
+    Responsible for benchmarking the rendering of a synthetic rig for every thread count.
+    """
+    args = parse_args()
+    if args.opencv_threads is not None:
+        cv2.setNumThreads(args.opencv_threads)
+    frames, homographies = make_frames(args.cameras, args.width, args.height, args.overlap)
+    plan = build_composite_plan([frame.shape for frame in frames], homographies)
+
+    TextFormatter.print_heading("Warping of %d %dx%d frames into a %dx%d canvas, %d cores" % (
+        args.cameras, args.width, args.height, plan.size[0], plan.size[1],
+        cv2.getNumberOfCPUs()))
+    serial_time = benchmark_render(plan, frames, None, args.repeat)
+    TextFormatter.print_pair("serial", "%.1f ms per frame" % (1000 * serial_time))
+    for threads in get_thread_counts(args.max_threads or cv2.getNumberOfCPUs()):
+        pool = ThreadPool(threads)
+        render_time = benchmark_render(plan, frames, pool, args.repeat)
+        pool.close()
+        pool.join()
+        TextFormatter.print_pair("%d threads" % threads, "%.1f ms per frame, %.2fx speedup" % (
+            1000 * render_time, serial_time / render_time))
+
+def make_frames(count, width, height, overlap):
+    """
+    Returns a row of textured frames of a scene seen from cameras slightly rotated
+    from each other, along with the homographies from each frame to the next.
+    """
+    state = np.random.RandomState(0)
+    offset = int(width * (1 - overlap))
+    scene_width = width + offset * (count - 1)
+    scene = cv2.resize(state.randint(0, 256, (height // 16, scene_width // 16, 3))
+                       .astype(np.uint8), (scene_width, height), interpolation=cv2.INTER_CUBIC)
+    frames = [scene[:, index * offset:index * offset + width].copy() for index in range(count)]
+    homography = np.array([[1, 0.01, -offset], [0.005, 1, 0], [1e-6, 0, 1]], dtype=np.float64)
+    return frames, [homography] * (count - 1)
+
+def benchmark_render(plan, frames, pool, repeat):
+    """
+    Returns the average time to render the frames through the plan with the thread pool.
+    """
+    plan.render(frames, pool)
+    start_time = time.time()
+    for _ in range(repeat):
+        plan.render(frames, pool)
+    return (time.time() - start_time) / repeat
+
+def get_thread_counts(max_threads):
+    """
+    Returns the powers of two up to the maximum number of threads, and the maximum itself.
+    """
+    counts = [1]
+    while counts[-1] * 2 < max_threads:
+        counts.append(counts[-1] * 2)
+    if counts[-1] != max_threads:
+        counts.append(max_threads)
+    return counts
+
+def parse_args():
+    """
+    Returns parsed arguments
+    """
+    parser = argparse.ArgumentParser(description="Parallel warping benchmark")
+    parser.add_argument('--cameras', dest='cameras', type=int, default=3,
+                        help='Number of warped frames.')
+    parser.add_argument('--width', dest='width', type=int, default=1920,
+                        help='Width of the warped frames.')
+    parser.add_argument('--height', dest='height', type=int, default=1080,
+                        help='Height of the warped frames.')
+    parser.add_argument('--overlap', dest='overlap', type=float, default=0.3,
+                        help='Overlap of neighbouring frames as a fraction of their width.')
+    parser.add_argument('--max-threads', dest='max_threads', type=int, default=None,
+                        help='Largest thread count benchmarked. Defaults to the core count.')
+    parser.add_argument('--opencv-threads', dest='opencv_threads', type=int, default=None,
+                        help='Number of threads OpenCV parallelizes each warp over.')
+    parser.add_argument('--repeat', dest='repeat', type=int, default=20,
+                        help='Number of timed frames per thread count.')
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    main()
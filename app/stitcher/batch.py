@@ -0,0 +1,105 @@
+"""
+Module for stitching synced recordings offline, as fast as the machine allows.
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import argparse
+
+from app.util.configure import get_configuration
+from app.util.textformatter import TextFormatter
+
+from .core.batch import get_recording_key, stitch_batch
+from .core.blending import BLENDERS
+from .core.features import DETECTORS, MATCHERS, get_backend
+from .core.homographystore import HomographyStore
+from .core.projection import PROJECTIONS, is_valid_size
+
+def main():
+    """
+    Responsible for handling batch stitch calls from the command line.
+    """
+    opts = parse_args()
+
+    if opts.config_profile:
+        config = get_configuration(opts.config_profile)
+        paths = [config['left-video-path'], config['right-video-path']]
+        dest = config['output-path']
+        width = config['width']
+        height = config['height']
+        processes = config.get('batch-processes')
+        segments = config.get('batch-segments')
+    else:
+        paths = opts.paths
+        dest = opts.output_path
+        width = opts.width
+        height = opts.height
+        processes = opts.processes
+        segments = opts.segments
+
+    if opts.projection and not is_valid_size(opts.projection, (width, height)):
+        TextFormatter.print_error("Equirectangular panoramas must be twice as wide as high, "
+                                  "not %dx%d." % (width, height))
+        return
+
+    homography_store = HomographyStore()
+    if opts.recompute:
+        # Drops the stored homographies of the recordings so they are recomputed from
+        # their first frames, keeping those of other rigs.
+        homography_store.invalidate(get_recording_key(paths))
+
+    result = stitch_batch(paths, dest, width, height, processes, segments, homography_store,
+                          get_backend(opts.feature_backend, opts.feature_matcher),
+                          opts.projection, opts.blend)
+    if result is None:
+        TextFormatter.print_error("The recordings do not overlap enough to be stitched.")
+        return
+    frames, elapsed = result
+    TextFormatter.print_info("Stitched %d frames into %s in %.1f s, %.1f frames per second."
+                             % (frames, dest, elapsed, frames / elapsed))
+
+def parse_args():
+    """
+    Returns parsed arguments from command line.
+    """
+    parser = argparse.ArgumentParser(description="Stitches synced recordings offline.")
+    parser.add_argument('paths', nargs='*',
+                        help='Synced recordings to stitch, ordered left to right.')
+    parser.add_argument('-f', action='store', default='out.avi', type=str,
+                        dest='output_path',
+                        help='File path of the stitched video.')
+    parser.add_argument('--width', action='store', default=640, type=int, dest='width',
+                        help='Width dimension of output video')
+    parser.add_argument('--height', action='store', default=480, type=int, dest='height',
+                        help='Height dimension of output video')
+    parser.add_argument('--processes', action='store', type=int, dest='processes',
+                        default=None,
+                        help='Number of processes stitching segments. One per CPU by default.')
+    parser.add_argument('--segments', action='store', type=int, dest='segments',
+                        default=None,
+                        help='Number of segments the timeline is split into. One per process '
+                        'by default.')
+    parser.add_argument('--profile', action='store', dest="config_profile",
+                        help='File path of configuration profile to use.')
+    parser.add_argument('--features', action='store', type=str, dest='feature_backend',
+                        default=None, choices=sorted(DETECTORS),
+                        help='Feature detector used to compute homographies.')
+    parser.add_argument('--matcher', action='store', type=str, dest='feature_matcher',
+                        default=None, choices=sorted(MATCHERS),
+                        help='Feature matcher used to compute homographies.')
+    parser.add_argument('--projection', action='store', type=str, dest='projection',
+                        default=None, choices=PROJECTIONS,
+                        help='Projection of the panorama. Planar if not provided. Equirectangular '
+                        'panoramas must be twice as wide as high.')
+    parser.add_argument('--blend', action='store', type=str, dest='blend',
+                        default=None, choices=sorted(BLENDERS),
+                        help='Blending of the seams. Frames are pasted if not provided.')
+    parser.add_argument('--recompute', action='store_true',
+                        default=False, dest='recompute',
+                        help='Invalidate the stored homographies of the recordings and '
+                        'recompute them.')
+
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+"""
+This module stitches synced recordings offline, splitting their timeline into segments
+stitched concurrently by a pool of processes.
+"""
+from __future__ import absolute_import, division, print_function
+
+import multiprocessing
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+import cv2
+
+from app.util.feed import VideoFeed
+from .compositor import Compositor
+from .feedhandler import open_writer
+
+# Number of leading frame sets tried when estimating the homographies shared by all
+# segments, before giving up on the recordings overlapping.
+ESTIMATE_FRAMES = 30
+
+# Minimum number of frames of a segment. Shorter recordings are split into fewer segments.
+MIN_SEGMENT_FRAMES = 30
+
+# Frame rate of the stitched video when the recordings do not report theirs.
+DEFAULT_FPS = 30.0
+
+def stitch_batch(paths, output_path, width, height, processes=None, segments=None, # pylint: disable=too-many-arguments,too-many-locals
+                 store=None, backend=None, projection=None, blend=None):
+    """
+    Stitches synced recordings, ordered left to right, into a video at the output path,
+    without displaying them. The homographies are estimated once from the first frames,
+    with the provided homography store and feature backend, and shared by every segment.
+    Segments are stitched by a pool of processes, one segment per process by default,
+    encoded by OpenCV and concatenated by ffmpeg without re-encoding.
+    Returns the number of stitched frames and the seconds it took, or None if the
+    recordings do not overlap enough to be stitched.
+    """
+    start_time = time.time()
+    processes = processes or multiprocessing.cpu_count()
+    size = (width, height)
+    homographies = estimate_homographies(paths, size, store, backend, projection)
+    if homographies is None:
+        return None
+    capture = cv2.VideoCapture(paths[0])
+    frame_count = int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
+    fps = capture.get(cv2.CAP_PROP_FPS) or DEFAULT_FPS
+    capture.release()
+
+    directory = tempfile.mkdtemp(dir=os.path.dirname(os.path.abspath(output_path)))
+    extension = os.path.splitext(output_path)[1]
+    tasks = [(paths, size, start, count, homographies, projection, blend, fps,
+              os.path.join(directory, "%04d%s" % (index, extension)))
+             for index, (start, count)
+             in enumerate(get_segments(frame_count, segments or processes))]
+    pool = multiprocessing.Pool(min(processes, len(tasks)))
+    try:
+        stitched = sum(pool.map(stitch_segment, tasks, chunksize=1))
+        pool.close()
+        concat_segments([task[-1] for task in tasks], output_path)
+    finally:
+        pool.terminate()
+        pool.join()
+        shutil.rmtree(directory)
+    return stitched, time.time() - start_time
+
+def estimate_homographies(paths, size, store=None, backend=None, projection=None):
+    """
+    Returns the homographies linking the neighbouring recordings, estimated from the first
+    frames that overlap enough, or None if none of the leading frames do.
+    """
+    feeds = [VideoFeed(path, size[0]) for path in paths]
+    compositor = Compositor(get_recording_key(paths), store, backend, projection, size)
+    try:
+        for _ in range(ESTIMATE_FRAMES):
+            frames = read_frames(feeds)
+            if frames is None:
+                break
+            if compositor.composite(frames) is not None:
+                return [link.homography for link in compositor.links]
+        return None
+    finally:
+        for feed in feeds:
+            feed.close()
+
+def get_recording_key(paths):
+    """
+    Returns the key the homographies linking the recordings are stored under.
+    """
+    return "-".join(paths)
+
+def get_segments(frame_count, segments):
+    """
+    Returns the start and number of frames of each segment of the timeline. The last
+    segment runs to the end of the recordings, whose frame count may be approximate.
+    """
+    segments = max(1, min(segments, frame_count // MIN_SEGMENT_FRAMES))
+    bounds = [frame_count * index // segments for index in range(segments + 1)]
+    return [(start, end - start) for start, end in zip(bounds[:-1], bounds[1:-1])] + [
+        (bounds[-2], None)]
+
+def stitch_segment(task):
+    """
+    Stitches a segment of the recordings into a video with the shared homographies.
+    Returns the number of stitched frames.
+    """
+    paths, size, start, count, homographies, projection, blend, fps, path = task
+    feeds = [VideoFeed(feed_path, size[0]) for feed_path in paths]
+    for feed in feeds:
+        feed.seek(start)
+    compositor = Compositor(projection=projection, size=size, blend=blend)
+    compositor.create_links(len(homographies))
+    for link, homography in zip(compositor.links, homographies):
+        link.set_homography(homography)
+    writer = open_writer(path, size[0], size[1], fps)
+    read = stitched = 0
+    try:
+        while count is None or read < count:
+            frames = read_frames(feeds)
+            if frames is None:
+                break
+            read += 1
+            stitched_frame = compositor.composite(frames)
+            if stitched_frame is not None:
+                writer.write(stitched_frame)
+                stitched += 1
+    finally:
+        writer.release()
+        for feed in feeds:
+            feed.close()
+    return stitched
+
+def read_frames(feeds):
+    """
+    Returns the next frame of every feed, or None once any feed runs out of frames
+    or fails to decode one.
+    """
+    frames = []
+    for feed in feeds:
+        if not feed.grab():
+            return None
+        frame = feed.retrieve()
+        if frame is None:
+            return None
+        frames.append(frame)
+    return frames
+
+def concat_segments(paths, output_path):
+    """
+    Concatenates the videos of the segments into the output path with ffmpeg,
+    copying their streams without re-encoding them.
+    """
+    listing = os.path.join(os.path.dirname(paths[0]), "segments.txt")
+    with open(listing, 'w') as segments:
+        for path in paths:
+            segments.write("file '%s'\n" % path)
+    subprocess.check_call([
+        'ffmpeg', '-y', '-loglevel', 'error', '-f', 'concat', '-safe', '0',
+        '-i', listing, '-c', 'copy', output_path])
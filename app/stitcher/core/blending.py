@@ -0,0 +1,264 @@
+"""
+This module encapsulates the blenders hiding the seams between the tiles of a canvas plan.
+"""
+from __future__ import absolute_import, division, print_function
+from abc import ABCMeta, abstractmethod
+
+import numpy as np
+import cv2
+
+# Maximum number of pyramid levels of multi-band blending. Small overlaps use fewer.
+MULTIBAND_LEVELS = 5
+
+# Overlaps of fewer pixels are left unblended.
+MIN_OVERLAP_AREA = 16
+
+class Overlap(object):
+    """
+    Bounding box (x_min, y_min, x_max, y_max) of a part of the canvas covered by
+    several tiles, with the indices of the frames covering it, their tiles cropped to it,
+    and their coverage and feather distances within it.
+    Frames are rendered into buffers that are allocated once and reused for every frame.
+    """
+
+    def __init__(self, bounds, indices, tiles, coverages, distances):
+        self.bounds = bounds
+        self.indices = indices
+        self.tiles = tiles
+        self.coverages = coverages
+        self.distances = distances
+        self.width = bounds[2] - bounds[0]
+        self.height = bounds[3] - bounds[1]
+        self.buffers = [np.zeros((self.height, self.width, 3), np.uint8) for _ in indices]
+
+    def get_region(self, canvas):
+        """
+        Returns the view of the canvas the overlap covers.
+        """
+        x_min, y_min, x_max, y_max = self.bounds
+        return canvas[y_min:y_max, x_min:x_max]
+
+    def render(self, frames):
+        """
+        Renders the frames covering the overlap into their buffers and returns them.
+        """
+        for index, tile, buf in zip(self.indices, self.tiles, self.buffers):
+            tile.render(frames[index], buf)
+        return self.buffers
+
+class Blender(object):
+    """
+    Base blender. The overlaps of the plan and their weights are computed once,
+    and every frame only the bounding boxes of the overlaps are re-rendered and blended
+    over the canvas, leaving the rest of the canvas as the plan rendered it.
+    """
+    __metaclass__ = ABCMeta
+
+    def __init__(self, plan):
+        self.overlaps = find_overlaps(plan)
+        for overlap in self.overlaps:
+            self.prepare(overlap)
+
+    def prepare(self, overlap):
+        """
+        Precomputes the weights of an overlap.
+        """
+
+    def blend(self, frames, canvas):
+        """
+        Blends the overlaps of the frames into the canvas.
+        """
+        for overlap in self.overlaps:
+            self.blend_overlap(overlap, overlap.render(frames), overlap.get_region(canvas))
+
+    @abstractmethod
+    def blend_overlap(self, overlap, images, region):
+        """
+        Blends the images of the frames covering an overlap into its region of the canvas.
+        """
+        pass
+
+class FeatherBlender(Blender):
+    """
+    Blends overlaps with weights growing with the distance to the edge of each frame,
+    so every frame fades out towards its edges.
+    """
+
+    def prepare(self, overlap):
+        # Frames are blended in one after another, each against the accumulated weight
+        # of the previous ones, into a buffer kept with the overlap.
+        overlap.accumulated = []
+        accumulated = overlap.distances[0].copy()
+        for distance in overlap.distances[1:]:
+            overlap.accumulated.append(accumulated.copy())
+            accumulated += distance
+        overlap.blended = np.zeros((overlap.height, overlap.width, 3), np.uint8)
+
+    def blend_overlap(self, overlap, images, region):
+        result = images[0]
+        for image, accumulated, distance in zip(images[1:], overlap.accumulated,
+                                                overlap.distances[1:]):
+            result = cv2.blendLinear(result, image, accumulated, distance, dst=overlap.blended)
+        np.copyto(region, result)
+
+class MultiBandBlender(Blender):
+    """
+    Blends overlaps band by band over Laplacian pyramids, across a seam halfway between
+    the edges of the frames. Low frequencies are blended over wide transitions and high
+    frequencies over narrow ones, hiding exposure differences without ghosting detail.
+    """
+
+    def prepare(self, overlap):
+        levels = max(1, min(MULTIBAND_LEVELS, int(np.log2(min(overlap.width,
+                                                              overlap.height))) - 2))
+        seam = np.argmax(np.stack(overlap.distances), axis=0)
+        pyramids = []
+        for position, coverage in enumerate(overlap.coverages):
+            mask_pyramid = get_gaussian_pyramid(np.float32(seam == position), levels)
+            coverage_pyramid = get_gaussian_pyramid(np.float32(coverage), levels)
+            # Frames only contribute where they fully cover a level, so the black outside
+            # of a frame does not bleed into the blend.
+            pyramids.append([mask * (level_coverage > 0.999) for mask, level_coverage
+                             in zip(mask_pyramid, coverage_pyramid)])
+        for level in range(levels + 1):
+            total = sum(pyramid[level] for pyramid in pyramids) + 1e-6
+            for pyramid in pyramids:
+                # Weights are kept with one channel per image channel for OpenCV arithmetic.
+                pyramid[level] = cv2.merge([pyramid[level] / total] * 3)
+        overlap.levels = levels
+        overlap.weights = pyramids
+        # Pyramids are built and blended in buffers kept with the overlap.
+        overlap.pyramid = LaplacianPyramid((overlap.height, overlap.width, 3), levels)
+        overlap.blended = [np.zeros_like(level) for level in overlap.pyramid.levels]
+
+    def blend_overlap(self, overlap, images, region):
+        result = overlap.blended
+        for position, (image, weights) in enumerate(zip(images, overlap.weights)):
+            pyramid = overlap.pyramid.build(image)
+            for level, weight, blended in zip(pyramid, weights, result):
+                if position == 0:
+                    cv2.multiply(level, weight, dst=blended)
+                else:
+                    cv2.accumulateProduct(level, weight, blended)
+
+        image = overlap.pyramid.collapse(result)
+        image.round(out=image)
+        np.copyto(region, np.clip(image, 0, 255, out=image), casting='unsafe')
+
+class LaplacianPyramid(object):
+    """
+    Buffers of the Laplacian pyramid of images of a fixed shape, from the finest level
+    to the coarsest Gaussian level, built and collapsed without allocating.
+    """
+
+    def __init__(self, shape, levels):
+        self.gaussian = [np.zeros(shape, np.float32)]
+        for _ in range(levels):
+            rows, cols = self.gaussian[-1].shape[:2]
+            self.gaussian.append(np.zeros(((rows + 1) // 2, (cols + 1) // 2) + shape[2:],
+                                          np.float32))
+        self.levels = [np.zeros_like(level) for level in self.gaussian[:-1]]
+        self.levels.append(self.gaussian[-1])
+        self.expanded = [np.zeros_like(level) for level in self.gaussian[:-1]]
+
+    def build(self, image):
+        """
+        Builds the pyramid of the image and returns its levels, which are overwritten
+        by the next build.
+        """
+        self.gaussian[0][...] = image
+        for level, coarser in zip(self.gaussian[:-1], self.gaussian[1:]):
+            cv2.pyrDown(level, dst=coarser, dstsize=(coarser.shape[1], coarser.shape[0]))
+        for level, coarser, expanded, laplacian in zip(self.gaussian[:-1], self.gaussian[1:],
+                                                       self.expanded, self.levels):
+            cv2.pyrUp(coarser, dst=expanded, dstsize=(level.shape[1], level.shape[0]))
+            cv2.subtract(level, expanded, dst=laplacian)
+        return self.levels
+
+    def collapse(self, levels):
+        """
+        Collapses the provided pyramid levels into their finest level, in place,
+        and returns it.
+        """
+        image = levels[-1]
+        for level, expanded in zip(reversed(levels[:-1]), reversed(self.expanded)):
+            cv2.pyrUp(image, dst=expanded, dstsize=(level.shape[1], level.shape[0]))
+            cv2.add(expanded, level, dst=level)
+            image = level
+        return image
+
+BLENDERS = {
+    'feather': FeatherBlender,
+    'multiband': MultiBandBlender,
+}
+
+def set_blender(plan, name=None):
+    """
+    Sets the named blender on the plan, or removes blending if no name is provided.
+    Returns the plan.
+    """
+    if name is not None and name not in BLENDERS:
+        raise ValueError("Unknown blender %s. Choose one of %s."
+                         % (name, ", ".join(sorted(BLENDERS))))
+    if plan is not None:
+        plan.blender = None if name is None else BLENDERS[name](plan)
+    return plan
+
+def get_distances(coverage):
+    """
+    Returns the distance of every covered pixel to the nearest uncovered one,
+    counting pixels beyond the edges of the mask as uncovered.
+    """
+    padded = cv2.copyMakeBorder(coverage, 1, 1, 1, 1, cv2.BORDER_CONSTANT, value=0)
+    return cv2.distanceTransform(padded, cv2.DIST_L2, 3)[1:-1, 1:-1]
+
+def find_overlaps(plan):
+    """
+    Returns the overlaps of the tiles of the plan, one per connected part of the canvas
+    covered by several frames.
+    """
+    coverages = plan.get_coverages()
+    tile_distances = [None if coverage is None else get_distances(coverage)
+                      for coverage in coverages]
+    counts = np.zeros(plan.canvas.shape[:2], np.uint8)
+    for tile, coverage in zip(plan.tiles, coverages):
+        if tile is not None:
+            tile.get_region(counts)[...] += coverage
+
+    count, _, stats, _ = cv2.connectedComponentsWithStats(np.uint8(counts >= 2))
+    overlaps = []
+    for x, y, width, height, area in stats[1:count]:
+        if area < MIN_OVERLAP_AREA:
+            continue
+        bounds = (int(x), int(y), int(x + width), int(y + height))
+        indices, tiles, overlap_coverages, distances = [], [], [], []
+        for index, (tile, coverage, tile_distance) in enumerate(zip(plan.tiles, coverages,
+                                                                   tile_distances)):
+            cropped = None if tile is None else tile.crop(bounds)
+            if cropped is None:
+                continue
+            window = (slice(cropped.y, cropped.y + cropped.height),
+                      slice(cropped.x, cropped.x + cropped.width))
+            tile_window = (slice(y + cropped.y - tile.y, y + cropped.y - tile.y + cropped.height),
+                           slice(x + cropped.x - tile.x, x + cropped.x - tile.x + cropped.width))
+            overlap_coverage = np.zeros((height, width), np.uint8)
+            overlap_coverage[window] = coverage[tile_window]
+            if not overlap_coverage.any():
+                continue
+            distance = np.zeros((height, width), np.float32)
+            distance[window] = tile_distance[tile_window]
+            indices.append(index)
+            tiles.append(cropped)
+            overlap_coverages.append(overlap_coverage)
+            distances.append(distance)
+        overlaps.append(Overlap(bounds, indices, tiles, overlap_coverages, distances))
+    return overlaps
+
+def get_gaussian_pyramid(image, levels):
+    """
+    Returns the Gaussian pyramid of the image, from the image itself to the coarsest level.
+    """
+    pyramid = [image]
+    for _ in range(levels):
+        pyramid.append(cv2.pyrDown(pyramid[-1]))
+    return pyramid
@@ -0,0 +1,268 @@
+"""
+This module encapsulates the Compositor class to stitch any number of frames in a single pass.
+"""
+from __future__ import absolute_import, division, print_function
+
+from multiprocessing.pool import ThreadPool
+import threading
+import cv2
+
+from .blending import set_blender
+from .exposure import GainCompensator
+from .projection import build_projection_plan
+from .reestimator import Reestimator
+from .stitcher import DRIFT_BACKOFF_CHECKS, Stitcher
+from .warp import build_composite_plan
+
+# Number of frames to wait before retrying to load a homography the frames failed to give.
+LOAD_RETRY_FRAMES = 30
+
+# Number of failed homography loads after which a rig is given up on as not overlapping.
+MAX_FAILED_LOADS = 10
+
+class Compositor(object): # pylint: disable=too-many-instance-attributes
+    """
+    Creates a single panorama from a row of frames, ordered left to right.
+    Each pair of neighbouring frames is linked by the homography of a Stitcher, which
+    loads, stores, re-estimates and monitors it. The homographies are chained to map every
+    frame to the plane of the middle frame, so each frame is warped once, straight into
+    a shared canvas, however many frames there are.
+
+    Rigs covering wide angles, where planar panoramas blow up, can instead be projected
+    into a cylindrical or equirectangular panorama of the provided size
+    (see projection.PROJECTIONS).
+    The camera matrices of the frames default to ones estimated from the homographies.
+    Seams are blended with the named blender (see blending.BLENDERS), if any, and
+    exposure differences can be compensated (see start_gain_compensation).
+    Planar panoramas of the provided size are cropped to the largest part of the canvas
+    covered by frames and rendered straight at that size, so they need no resizing.
+    Frames can be warped concurrently by a pool of threads (see start_parallel_rendering).
+
+    Homographies the frames fail to give, as dark or warming-up frames do, are loaded
+    again every LOAD_RETRY_FRAMES frames. The number of failed loads since the last
+    successful one is kept in failed_loads, so callers can give up on rigs that never
+    overlap (see has_failed).
+
+    As with Stitcher, the canvas is preallocated and reused, so the returned panorama
+    is only valid until the next call to composite.
+    """
+
+    def __init__(self, key=None, store=None, backend=None, projection=None, size=None,
+                 camera_matrices=None, blend=None):
+        self.key = key
+        self.store = store
+        self.backend = backend
+        self.projection = projection
+        self.size = size
+        self.camera_matrices = camera_matrices
+        self.blend = blend
+        self.links = []
+        self.plan = None
+        self.reestimator = None
+        self.gain_compensator = None
+        self.pool = None
+        self.drift_threshold = None
+        self.drift_interval = 1
+        self.drift_backoff = 0
+        self.frame_count = 0
+        self.failed_loads = 0
+        self.lock = threading.Lock()
+
+    def composite(self, frames):
+        """
+        Returns the panorama of the frames, or None if a pair of neighbouring frames
+        has no homography.
+        """
+        if len(frames) == 1 and (self.size is None or
+                                 frames[0].shape[1::-1] == tuple(self.size)):
+            return frames[0]
+
+        if len(self.links) != len(frames) - 1:
+            self.create_links(len(frames) - 1)
+        should_retry = self.frame_count % LOAD_RETRY_FRAMES == 0
+        loaded = []
+        for link, frame1, frame2 in zip(self.links, frames[:-1], frames[1:]):
+            if link.homography is None or (link.homography is False and should_retry):
+                link.set_homography(link.load_homography(frame1, frame2))
+                loaded.append(link.homography is not False)
+        if loaded:
+            self.failed_loads = 0 if all(loaded) else self.failed_loads + 1
+
+        if self.reestimator is not None:
+            self.reestimator.offer(*frames)
+
+        self.frame_count += 1
+        if self.drift_threshold is not None and self.frame_count % self.drift_interval == 0:
+            self.check_drift(frames)
+
+        plan = self.plan
+        shapes = tuple(frame.shape for frame in frames)
+        if plan is None or plan.shapes != shapes:
+            with self.lock:
+                plan = self.build_plan(shapes)
+                self.plan = plan
+            if plan is None:
+                return None
+        if self.gain_compensator is not None:
+            frames = self.gain_compensator.compensate(frames, plan)
+        return plan.render(frames, self.pool)
+
+    def has_failed(self):
+        """
+        Returns True if the homographies failed to load MAX_FAILED_LOADS times in a row.
+        """
+        return self.failed_loads >= MAX_FAILED_LOADS
+
+    def create_links(self, count):
+        """
+        Creates the stitchers linking each pair of neighbouring frames.
+        """
+        self.links = [Stitcher(self.get_link_key(index), self.store, self.backend)
+                      for index in range(count)]
+        if self.drift_threshold is not None:
+            for link in self.links:
+                link.start_drift_monitoring(self.drift_threshold)
+        self.plan = None
+
+    def get_link_key(self, index):
+        """
+        Returns the key the homography between frames index and index + 1 is stored under.
+        """
+        if self.key is None:
+            return None
+        return "%s.%d-%d" % (self.key, index, index + 1)
+
+    def build_plan(self, shapes):
+        """
+        Returns the plan for frames of the provided shapes from the current homographies,
+        or None if a pair of neighbouring frames has no homography.
+        """
+        homographies = [link.homography for link in self.links]
+        if any(homography is None or homography is False for homography in homographies):
+            return None
+        if self.projection is not None and len(shapes) > 1:
+            plan = build_projection_plan(self.projection, shapes, homographies,
+                                         self.camera_matrices, self.size)
+        else:
+            plan = build_composite_plan(shapes, homographies, size=self.size)
+        return set_blender(plan, self.blend)
+
+    def reestimate(self, *frames):
+        """
+        Re-estimates the homography of every pair of neighbouring frames, and swaps in
+        a new plan if any of them was replaced. Returns True if a homography was replaced.
+        """
+        adopted = False
+        for link, frame1, frame2 in zip(self.links, frames[:-1], frames[1:]):
+            adopted = link.reestimate(frame1, frame2) or adopted
+        if adopted:
+            plan = self.build_plan(tuple(frame.shape for frame in frames))
+            with self.lock:
+                self.plan = plan
+        return adopted
+
+    def start_reestimation(self, interval=10.0):
+        """
+        Starts re-estimating the homographies in the background from a snapshot of the
+        frames every interval seconds.
+        """
+        if self.reestimator is None:
+            self.reestimator = Reestimator(self, interval)
+            self.reestimator.start()
+
+    def stop_reestimation(self):
+        """
+        Stops the background re-estimation of the homographies.
+        """
+        if self.reestimator is not None:
+            self.reestimator.stop()
+            self.reestimator = None
+
+    def start_drift_monitoring(self, threshold=4.0, interval=1):
+        """
+        Starts tracking the inliers of every homography every interval frames,
+        re-estimating the homographies when any of them drifts more than threshold pixels.
+        """
+        self.drift_threshold = threshold
+        self.drift_interval = interval
+        for link in self.links:
+            link.start_drift_monitoring(threshold)
+
+    def stop_drift_monitoring(self):
+        """
+        Stops monitoring drift of the homographies.
+        """
+        self.drift_threshold = None
+        for link in self.links:
+            link.stop_drift_monitoring()
+
+    def start_gain_compensation(self, interval=30):
+        """
+        Starts compensating exposure differences between the frames, with gains
+        re-estimated from their overlaps every interval frames.
+        """
+        self.gain_compensator = GainCompensator(interval)
+
+    def stop_gain_compensation(self):
+        """
+        Stops compensating exposure differences between the frames.
+        """
+        self.gain_compensator = None
+
+    def start_parallel_rendering(self, threads=None):
+        """
+        Starts rendering bands of the panorama concurrently in a pool of threads,
+        one per core by default.
+        """
+        self.stop_parallel_rendering()
+        self.pool = ThreadPool(threads or cv2.getNumberOfCPUs())
+
+    def stop_parallel_rendering(self):
+        """
+        Stops rendering the panorama concurrently, and shuts the pool of threads down.
+        """
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+    def check_drift(self, frames):
+        """
+        Requests a re-estimation if any homography is drifting from the frames.
+        Requests are not repeated for a while, to give the re-estimation time to finish.
+        """
+        drifting = [link.is_drifting(frame1, frame2) for link, frame1, frame2
+                    in zip(self.links, frames[:-1], frames[1:]) if link.homography is not False]
+        if not any(drifting):
+            self.drift_backoff = 0
+            return
+
+        if self.drift_backoff > 0:
+            self.drift_backoff -= 1
+            return
+        self.drift_backoff = DRIFT_BACKOFF_CHECKS
+        if self.reestimator is not None:
+            self.reestimator.request()
+        else:
+            self.reestimate(*frames)
+
+    def reset(self):
+        """
+        Resets the homographies of the compositor so they are loaded from the next frames.
+        """
+        for link in self.links:
+            link.reset()
+        self.failed_loads = 0
+        with self.lock:
+            self.plan = None
+
+    def invalidate(self):
+        """
+        Resets the homographies and removes them from the store,
+        so they are recomputed from the next frames.
+        """
+        for link in self.links:
+            link.invalidate()
+        self.failed_loads = 0
+        with self.lock:
+            self.plan = None
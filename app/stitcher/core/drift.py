@@ -0,0 +1,109 @@
+"""
+This module encapsulates the DriftMonitor class to detect rig movement cheaply
+by tracking homography inliers with sparse optical flow.
+"""
+from __future__ import absolute_import, division, print_function
+
+import threading
+import numpy as np
+import cv2
+
+# Maximum number of matched points tracked between frames.
+MAX_TRACKED_POINTS = 200
+
+class DriftMonitor(object):
+    """
+    Tracks matched points of two cameras across frames with pyramidal Lucas-Kanade
+    optical flow, and measures how far the points tracked in the second camera drift
+    from the points tracked in the first camera mapped through the homography.
+
+    Points are seeded from the inliers of a homography estimate, at full resolution,
+    and tracked on the grayscale pyramid levels the stitcher detects features on.
+    """
+
+    def __init__(self, min_points=12):
+        self.min_points = min_points
+        self.homography = None
+        self.points1 = None
+        self.points2 = None
+        self.baseline = 0.0
+        self.previous_levels = None
+        self.seed_points = None
+        self.lock = threading.Lock()
+
+    def seed(self, homography, src_points, dst_points):
+        """
+        Sets the points to track for a homography. Can be called from any thread,
+        the points are picked up by the next update.
+        """
+        if len(src_points) > MAX_TRACKED_POINTS:
+            step = len(src_points) / float(MAX_TRACKED_POINTS)
+            indices = np.int32(np.arange(MAX_TRACKED_POINTS) * step)
+            src_points, dst_points = src_points[indices], dst_points[indices]
+        with self.lock:
+            self.seed_points = (homography, np.float32(src_points).reshape(-1, 2),
+                                np.float32(dst_points).reshape(-1, 2))
+
+    def clear(self):
+        """
+        Drops the tracked points.
+        """
+        with self.lock:
+            self.seed_points = None
+            self.points1 = self.points2 = self.homography = None
+            self.previous_levels = None
+
+    def update(self, level1, scale1, level2, scale2):
+        """
+        Tracks the points into the provided grayscale pyramid levels of both frames,
+        which are at the provided scales of the full resolution frames.
+        Returns the drift in full resolution pixels, measured as the increase of the median
+        reprojection error since seeding, or None if there are too few points to track.
+        """
+        with self.lock:
+            seed_points, self.seed_points = self.seed_points, None
+        if seed_points is not None:
+            self.homography, self.points1, self.points2 = seed_points
+            self.baseline = get_reprojection_error(self.homography, self.points1,
+                                                   self.points2)
+        elif self.points1 is not None and self.previous_levels is not None and \
+                [level.shape for level in self.previous_levels] == [level1.shape, level2.shape]:
+            self.track(level1, scale1, level2, scale2)
+
+        self.previous_levels = (level1, level2)
+        if self.points1 is None or len(self.points1) < self.min_points:
+            return None
+        return get_reprojection_error(self.homography, self.points1,
+                                      self.points2) - self.baseline
+
+    def track(self, level1, scale1, level2, scale2):
+        """
+        Tracks the points from the previous levels into the provided levels,
+        dropping points that are lost in either frame.
+        """
+        previous1, previous2 = self.previous_levels
+        tracked1, status1 = track_points(previous1, level1, self.points1 * scale1)
+        tracked2, status2 = track_points(previous2, level2, self.points2 * scale2)
+        found = status1 & status2
+        self.points1 = tracked1[found] / scale1
+        self.points2 = tracked2[found] / scale2
+
+def track_points(previous_level, level, points):
+    """
+    Tracks the points from the previous level into the level.
+    Returns the tracked points and a mask of the points that were found.
+    """
+    tracked, status, _ = cv2.calcOpticalFlowPyrLK(previous_level, level,
+                                                  points.reshape(-1, 1, 2), None,
+                                                  winSize=(21, 21), maxLevel=3)
+    return tracked.reshape(-1, 2), status.ravel() > 0
+
+def get_reprojection_error(homography, src_points, dst_points):
+    """
+    Returns the median distance between the destination points and the source points
+    mapped through the homography.
+    """
+    if len(src_points) == 0:
+        return 0.0
+    projected = cv2.perspectiveTransform(src_points.reshape(-1, 1, 2), homography)
+    return float(np.median(np.linalg.norm(projected.reshape(-1, 2) - dst_points, axis=1)))
@@ -0,0 +1,126 @@
+"""
+This module encapsulates the GainCompensator class to even out the exposure of cameras.
+"""
+from __future__ import absolute_import, division, print_function
+
+import itertools
+import numpy as np
+import cv2
+
+from .blending import find_overlaps
+
+# Standard deviations of the intensity differences in overlaps and of the gains,
+# weighing how closely the gains match overlaps against how close they stay to 1.
+INTENSITY_DEVIATION = 10.0
+GAIN_DEVIATION = 0.1
+
+# Weight of newly estimated gains against the current ones, so gains settle gradually
+# instead of flickering with every estimation.
+GAIN_SMOOTHING = 0.5
+
+class GainCompensator(object):
+    """
+    Compensates the exposure differences of cameras with a gain per camera and channel.
+    Gains are estimated every interval frames from the mean intensities of the frames in the
+    overlaps of a canvas plan, and applied to every frame through 256-entry lookup tables,
+    which are only rebuilt when the gains change.
+    Compensated frames are written to buffers that are allocated once and reused.
+    """
+
+    def __init__(self, interval=30):
+        self.interval = interval
+        self.frame_count = 0
+        self.gains = None
+        self.plan = None
+        self.overlaps = []
+        self.tables = []
+        self.table_keys = []
+        self.buffers = []
+
+    def compensate(self, frames, plan):
+        """
+        Returns the frames with their gains applied, re-estimating the gains from the
+        overlaps of the plan every interval frames.
+        """
+        if self.gains is None or len(self.gains) != len(frames):
+            self.gains = np.ones((len(frames), 3))
+            self.frame_count = 0
+        if self.frame_count % self.interval == 0:
+            gains = self.estimate(frames, plan)
+            self.gains += GAIN_SMOOTHING * (gains - self.gains)
+        self.frame_count += 1
+
+        self.update_tables()
+        if [buf.shape for buf in self.buffers] != [frame.shape for frame in frames]:
+            self.buffers = [np.empty_like(frame) for frame in frames]
+        for frame, table, buf in zip(frames, self.tables, self.buffers):
+            cv2.LUT(frame, table, dst=buf)
+        return self.buffers
+
+    def estimate(self, frames, plan):
+        """
+        Returns the gains that best even out the mean intensities of the frames in the
+        overlaps of the plan, as an array with a row of channel gains per frame.
+        """
+        if plan is not self.plan:
+            self.plan = plan
+            self.overlaps = plan.blender.overlaps if plan.blender is not None else \
+                find_overlaps(plan)
+
+        pairs = []
+        for overlap in self.overlaps:
+            images = overlap.render(frames)
+            for first, second in itertools.combinations(range(len(overlap.indices)), 2):
+                mask = cv2.bitwise_and(overlap.coverages[first], overlap.coverages[second])
+                count = cv2.countNonZero(mask)
+                if count:
+                    pairs.append((overlap.indices[first], overlap.indices[second], count,
+                                  cv2.mean(images[first], mask)[:3],
+                                  cv2.mean(images[second], mask)[:3]))
+        return solve_gains(len(frames), pairs)
+
+    def update_tables(self):
+        """
+        Rebuilds the lookup tables of the cameras whose gains changed noticeably.
+        """
+        keys = [tuple(np.int32(np.round(gains * 256))) for gains in self.gains]
+        if len(self.tables) != len(keys):
+            self.tables = [None] * len(keys)
+            self.table_keys = [None] * len(keys)
+        for index, key in enumerate(keys):
+            if key != self.table_keys[index]:
+                self.tables[index] = build_gain_table(self.gains[index])
+                self.table_keys[index] = key
+
+def build_gain_table(gains):
+    """
+    Returns the lookup table applying the channel gains to an 8-bit image.
+    """
+    values = np.arange(256, dtype=np.float64).reshape(256, 1, 1) * np.reshape(gains, (1, 1, 3))
+    return np.uint8(np.clip(values + 0.5, 0, 255))
+
+def solve_gains(count, pairs):
+    """
+    Returns the gains of count frames minimizing the intensity differences in their overlaps,
+    given as (first index, second index, pixel count, first means, second means), while
+    keeping the gains close to 1. Frames without overlaps keep a gain of 1.
+    """
+    gains = np.ones((count, 3))
+    alpha = 1 / INTENSITY_DEVIATION ** 2
+    beta = 1 / GAIN_DEVIATION ** 2
+    for channel in range(3):
+        matrix = np.zeros((count, count))
+        vector = np.zeros(count)
+        for first, second, pixels, means1, means2 in pairs:
+            mean1, mean2 = means1[channel], means2[channel]
+            matrix[first, first] += pixels * (alpha * mean1 ** 2 + beta)
+            matrix[second, second] += pixels * (alpha * mean2 ** 2 + beta)
+            matrix[first, second] -= pixels * alpha * mean1 * mean2
+            matrix[second, first] -= pixels * alpha * mean1 * mean2
+            vector[first] += pixels * beta
+            vector[second] += pixels * beta
+        alone = np.diag(matrix) == 0
+        matrix[alone, alone] = 1
+        vector[alone] = 1
+        gains[:, channel] = np.linalg.solve(matrix, vector)
+    return gains
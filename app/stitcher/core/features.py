@@ -0,0 +1,157 @@
+"""
+This module encapsulates the registry of feature detector and matcher backends
+used to compute homographies.
+"""
+from __future__ import absolute_import, division, print_function
+
+import threading
+import cv2
+
+FLANN_INDEX_KDTREE = 0
+FLANN_INDEX_LSH = 6
+
+def create_surf():
+    """ Creates a SURF detector, which needs the non-free xfeatures2d module. """
+    return cv2.xfeatures2d.SURF_create()
+
+def create_orb():
+    """ Creates an ORB detector. """
+    return cv2.ORB_create(nfeatures=2000)
+
+def create_akaze():
+    """ Creates an AKAZE detector. """
+    return cv2.AKAZE_create()
+
+def create_brisk():
+    """ Creates a BRISK detector. """
+    return cv2.BRISK_create()
+
+def create_bf_hamming():
+    """ Creates a brute force matcher for binary descriptors. """
+    return cv2.BFMatcher(cv2.NORM_HAMMING)
+
+def create_flann_lsh():
+    """ Creates a Flann-based matcher with an LSH index for binary descriptors. """
+    index_params = dict(algorithm=FLANN_INDEX_LSH, table_number=6,
+                        key_size=12, multi_probe_level=1)
+    return cv2.FlannBasedMatcher(index_params, dict(checks=50))
+
+def create_flann_kdtree():
+    """ Creates a Flann-based matcher with a KD-tree index for float descriptors. """
+    index_params = dict(algorithm=FLANN_INDEX_KDTREE, trees=5)
+    return cv2.FlannBasedMatcher(index_params, dict(checks=50))
+
+DETECTORS = {
+    'surf': create_surf,
+    'orb': create_orb,
+    'akaze': create_akaze,
+    'brisk': create_brisk,
+}
+
+MATCHERS = {
+    'bf-hamming': create_bf_hamming,
+    'flann-lsh': create_flann_lsh,
+    'flann-kdtree': create_flann_kdtree,
+}
+
+# Matchers suited to the descriptors of each detector.
+DEFAULT_MATCHERS = {
+    'surf': 'flann-kdtree',
+    'orb': 'bf-hamming',
+    'akaze': 'bf-hamming',
+    'brisk': 'flann-lsh',
+}
+
+# Detectors tried in order when no backend is selected.
+DEFAULT_DETECTORS = ('surf', 'akaze', 'orb', 'brisk')
+
+class FeatureBackend(object):
+    """
+    A feature detector paired with a descriptor matcher.
+    Both are created once and reused for every homography computation.
+    """
+
+    def __init__(self, detector_name, matcher_name):
+        self.detector_name = detector_name
+        self.matcher_name = matcher_name
+        self.name = "%s/%s" % (detector_name, matcher_name)
+        self.detector = DETECTORS[detector_name]()
+        self.matcher = MATCHERS[matcher_name]()
+        self.lock = threading.Lock()
+
+    def detect(self, frame, mask=None):
+        """
+        Returns the keypoints and descriptors of the frame.
+        """
+        with self.lock:
+            return self.detector.detectAndCompute(frame, mask)
+
+    def match(self, descriptors1, descriptors2):
+        """
+        Returns the two nearest matches of each descriptor of the first set in the second.
+        """
+        if descriptors1 is None or descriptors2 is None:
+            return []
+        with self.lock:
+            return self.matcher.knnMatch(descriptors1, descriptors2, k=2)
+
+BACKENDS = {}
+BACKENDS_LOCK = threading.Lock()
+
+# Whether each detector can be created with this OpenCV build, checked once per name.
+AVAILABILITY = {}
+
+def get_backend(detector_name=None, matcher_name=None):
+    """
+    Returns the shared backend for the detector and matcher.
+    The matcher defaults to the one suited to the detector, and the detector defaults
+    to the first one available in this OpenCV build.
+    """
+    if isinstance(detector_name, FeatureBackend):
+        return detector_name
+    default = detector_name is None and matcher_name is None
+    if default and None in BACKENDS:
+        return BACKENDS[None]
+    if detector_name is None:
+        available_detectors = get_available_detectors()
+        if not available_detectors:
+            raise ValueError("No feature detector is available in this OpenCV build.")
+        detector_name = available_detectors[0]
+    if detector_name not in DETECTORS:
+        raise ValueError("Unknown feature detector %s. Choose one of %s."
+                         % (detector_name, ", ".join(sorted(DETECTORS))))
+    if matcher_name is None:
+        matcher_name = DEFAULT_MATCHERS[detector_name]
+    if matcher_name not in MATCHERS:
+        raise ValueError("Unknown feature matcher %s. Choose one of %s."
+                         % (matcher_name, ", ".join(sorted(MATCHERS))))
+    if not is_available(detector_name):
+        raise ValueError("Feature detector %s is not available in this OpenCV build."
+                         % detector_name)
+
+    key = (detector_name, matcher_name)
+    with BACKENDS_LOCK:
+        if key not in BACKENDS:
+            BACKENDS[key] = FeatureBackend(detector_name, matcher_name)
+        if default:
+            BACKENDS[None] = BACKENDS[key]
+        return BACKENDS[key]
+
+def is_available(detector_name):
+    """
+    Returns True if the detector can be created with this OpenCV build.
+    The check creates the detector only the first time each name is asked about.
+    """
+    if detector_name not in AVAILABILITY:
+        try:
+            DETECTORS[detector_name]()
+            AVAILABILITY[detector_name] = True
+        except (AttributeError, cv2.error):
+            AVAILABILITY[detector_name] = False
+    return AVAILABILITY[detector_name]
+
+def get_available_detectors():
+    """
+    Returns the names of the detectors available in this OpenCV build, in default order.
+    """
+    return [name for name in DEFAULT_DETECTORS if is_available(name)]
@@ -9,7 +9,17 @@ import subprocess
 import cv2
 import imutils
 
-from .stitcher import Stitcher
+from app.util.capturegroup import CaptureGroup
+from app.util.control import ControlChannel
+from app.util.encoder import EncoderSink
+from app.util.pacer import FramePacer
+from app.util.preview import PreviewSink
+from app.util.textformatter import TextFormatter
+from .compositor import Compositor
+from .pipeline import Pipeline, is_pipeline_supported
+
+# Frame rate of recorded and streamed videos when frames are not paced.
+OUTPUT_FPS = 20.0
 
 class FeedHandler(object): # pylint: disable=too-few-public-methods
     """
@@ -24,126 +34,356 @@ class FeedHandler(object): # pylint: disable=too-few-public-methods
         """
         pass
 
+    @abstractmethod
+    def get_rig_key(self):
+        """
+        Returns the key the homographies of the feeds are stored under.
+        """
+        pass
+
 class MultiFeedHandler(FeedHandler):
     """
     Handler for generating a stream from multiple feeds.
+    Homographies are persisted in the provided homography store and computed with
+    the provided feature backend. If a re-estimation interval (in seconds) is provided,
+    homographies are re-estimated in the background at that interval. If a drift threshold
+    (in pixels) is provided, homographies are also re-estimated when the rig drifts past it.
+    Feeds are composited on the plane of the middle feed, or into a panorama of the
+    provided projection (cylindrical or equirectangular), with seams blended by the
+    named blender (feather or multiband). If a gain interval (in frames) is provided,
+    exposure differences between feeds are compensated with gains re-estimated at that interval.
+    If a number of render threads is provided, bands of the panorama are warped concurrently.
+    If a capture policy (latest or drain) is provided, camera feeds capture frames on
+    background threads and the stitch loop takes buffered frames with that policy.
+    Frames of all feeds are grabbed back to back, and if a sync tolerance (in seconds) is
+    provided, they are paired on their capture timestamps within that tolerance.
+    Stitched frames are previewed on a background thread at the provided rate, streams
+    only being previewed when a rate is provided (see open_preview). If a frame rate is provided, frames are paced at that rate,
+    dropping stale frames when stitching falls behind (see pacer.FramePacer).
+    Streamed frames are queued for ffmpeg on a background thread, and dropped with the
+    provided encoder policy (oldest, newest or block) when it falls behind.
     """
-    def __init__(self, feeds):
+    def __init__(self, feeds, homography_store=None, feature_backend=None, # pylint: disable=too-many-arguments
+                 reestimate_interval=None, drift_threshold=None, projection=None, blend=None,
+                 gain_interval=None, render_threads=None, capture_policy=None,
+                 sync_tolerance=None, preview_fps=None, fps=None, encoder_policy=None):
         self.feeds = feeds
+        self.homography_store = homography_store
+        self.feature_backend = feature_backend
+        self.reestimate_interval = reestimate_interval
+        self.drift_threshold = drift_threshold
+        self.projection = projection
+        self.blend = blend
+        self.gain_interval = gain_interval
+        self.render_threads = render_threads
+        self.capture_policy = capture_policy
+        self.sync_tolerance = sync_tolerance
+        self.preview_fps = preview_fps
+        self.fps = fps
+        self.encoder_policy = encoder_policy
 
     def stitch_feeds(self, should_stream, output_path, width, height, rtmp_url):
-        feed_count = len(self.feeds)
-        if feed_count == 1:
-            stitch(
-                self.feeds, stitch_frame,
-                should_stream, output_path,
-                width, height, rtmp_url)
-        elif feed_count == 2:
-            stitch(
-                self.feeds, stitch_two_frames,
-                should_stream, output_path,
-                width, height, rtmp_url)
-        elif feed_count == 3:
-            stitch(
-                self.feeds, stitch_three_frames,
-                should_stream, output_path,
-                width, height, rtmp_url)
-        else:
-            stitch(
-                self.feeds, stitch_four_frames,
-                should_stream, output_path,
-                width, height, rtmp_url)
+        stitch(
+            self.feeds, should_stream, output_path,
+            width, height, rtmp_url, self.homography_store,
+            self.feature_backend, self.reestimate_interval, self.drift_threshold,
+            self.projection, self.blend, self.gain_interval, self.render_threads,
+            self.capture_policy, self.sync_tolerance, self.preview_fps, self.fps,
+            self.encoder_policy)
+
+    def get_rig_key(self):
+        """
+        Returns the key the homographies of the feeds are stored under.
+        """
+        return get_rig_key(self.feeds)
 
     def kill(self):
         """
-        Cleans up all open feeds
+        Cleans up all open feeds, stopping their capture threads.
         """
         for feed in self.feeds:
             feed.close()
         cv2.destroyAllWindows()
         sys.exit(0)
 
+class PipelineFeedHandler(FeedHandler):
+    """
+    Handler for generating a stream from multiple feeds in a staged pipeline, capturing
+    each feed and stitching their frames in separate processes connected by shared memory.
+    Feeds are created in their capture processes by the provided factories, and their
+    frames are corrected at the provided feed width. Stitching is configured with the
+    same options as MultiFeedHandler, the feature backend being recreated in the stitching
+    process from its detector and matcher names. Frames are paired in capture order,
+    and previewed, paced and streamed as with MultiFeedHandler.
+    """
+    def __init__(self, feed_factories, feed_width, key=None, homography_store=None, # pylint: disable=too-many-arguments
+                 feature_backend=None, reestimate_interval=None, drift_threshold=None,
+                 projection=None, blend=None, gain_interval=None, render_threads=None,
+                 preview_fps=None, fps=None, encoder_policy=None):
+        if not is_pipeline_supported():
+            raise ValueError("The pipeline needs shared memory, from Python 3.8.")
+        self.feed_factories = feed_factories
+        self.feed_width = feed_width
+        self.preview_fps = preview_fps
+        self.fps = fps
+        self.encoder_policy = encoder_policy
+        self.settings = {
+            'key': key,
+            'store': homography_store,
+            'backend': (feature_backend.detector_name, feature_backend.matcher_name)
+                       if feature_backend else None,
+            'reestimate-interval': reestimate_interval,
+            'drift-threshold': drift_threshold,
+            'projection': projection,
+            'blend': blend,
+            'gain-interval': gain_interval,
+            'render-threads': render_threads,
+        }
+        self.pipeline = None
+
+    def stitch_feeds(self, should_stream, output_path, width, height, rtmp_url):
+        self.pipeline = Pipeline(self.feed_factories, self.feed_width, (width, height),
+                                 self.settings)
+        stitch_pipeline(self.pipeline, should_stream, output_path, width, height, rtmp_url,
+                        self.preview_fps, self.fps, self.encoder_policy)
 
-def stitch(feeds, stitcher_func, should_stream, output_path, width, height, rtmp_url):
+    def get_rig_key(self):
+        """
+        Returns the key the homographies of the feeds are stored under.
+        """
+        return self.settings['key']
+
+    def kill(self):
+        """
+        Stops the stages of the pipeline.
+        """
+        if self.pipeline is not None:
+            self.pipeline.stop()
+        cv2.destroyAllWindows()
+        sys.exit(0)
+
+
+def stitch(feeds, should_stream, output_path, width, height, rtmp_url, # pylint: disable=too-many-arguments,too-many-branches,too-many-locals
+           homography_store=None, feature_backend=None, reestimate_interval=None,
+           drift_threshold=None, projection=None, blend=None, gain_interval=None,
+           render_threads=None, capture_policy=None, sync_tolerance=None, preview_fps=None,
+           fps=None, encoder_policy=None):
     """
     Main stitching function for stitching feeds together.
+    Feeds are ordered left to right and composited in a single pass, whatever their number,
+    straight at the output size. Their frames are captured as a synchronized group.
+    The loop runs until the feeds run out of frames, they fail to overlap for too long,
+    or it is asked to quit through the standard input or the preview. If a frame rate is
+    provided, stitched frames are output at that rate, and the encoders record and stream
+    at it.
     """
-    left_stitcher = Stitcher()
-    right_stitcher = Stitcher()
-    combined_stitcher = Stitcher()
-    dimensions = str(width) + 'x' + str(height)
+    compositor = Compositor(get_rig_key(feeds), homography_store, feature_backend, projection,
+                            (width, height), blend=blend)
+    if reestimate_interval:
+        compositor.start_reestimation(reestimate_interval)
+    if drift_threshold:
+        compositor.start_drift_monitoring(drift_threshold)
+    if gain_interval:
+        compositor.start_gain_compensation(gain_interval)
+    if render_threads:
+        compositor.start_parallel_rendering(render_threads)
+    if capture_policy:
+        for feed in feeds:
+            if hasattr(feed, 'start_capture'):
+                feed.start_capture(capture_policy)
+    group = CaptureGroup(feeds, sync_tolerance)
+    writer = open_writer(output_path, width, height, fps or OUTPUT_FPS) if output_path else None
+    encoder = open_encoder(rtmp_url, width, height, fps, encoder_policy) if should_stream else None
+    control = ControlChannel(sys.stdin)
+    control.start()
+    preview = open_preview(control, preview_fps, should_stream)
+    pacer = FramePacer(fps) if fps else None
+    if pacer is not None:
+        pacer.start()
 
-    if output_path:
-        # Creates video writer for saving of videos.
-        if imutils.is_cv3():
-            codec = cv2.VideoWriter_fourcc('m', 'p', '4', 'v')
-        else:
-            codec = cv2.cv.CV_FOURCC('m', 'p', '4', 'v')
-        writer = cv2.VideoWriter(output_path, codec, 20.0, (width, height))
-
-    if should_stream:
-        proc = subprocess.Popen([
-            'ffmpeg', '-y', '-f', 'rawvideo',
-            '-s', dimensions, '-pix_fmt', 'bgr24', '-i', 'pipe:0', '-vcodec',
-            'libx264', '-pix_fmt', 'yuv422p', '-r', '28', '-an', '-f', 'flv',
-            rtmp_url], stdin=subprocess.PIPE)
-
-    while all([feed.has_next() for feed in feeds]):
-        frames = [feed.get_next() for feed in feeds]
-        stitched_frame = stitcher_func(frames,
-                                       [left_stitcher, right_stitcher, combined_stitcher])
-        resized_st_frame = cv2.resize(stitched_frame, (width, height))
-
-        if should_stream:
-            proc.stdin.write(resized_st_frame.tostring())
-
-        if output_path is not None:
-            writer.write(resized_st_frame)
-
-        cv2.imshow("Result", resized_st_frame)
-        key = cv2.waitKey(1) & 0xFF
-
-        if key == ord("q"):
+    while not control.should_quit():
+        frames = group.read()
+        if frames is None:
             break
+        stitched_frame = compositor.composite(frames)
+        if stitched_frame is None:
+            if compositor.has_failed():
+                TextFormatter.print_error("The feeds do not overlap enough to be stitched.")
+                break
+            # The feeds have not overlapped enough yet, and are retried.
+            continue
+        # Paced at the output, so the deadlines cover stitching as well as capture.
+        intervals = pacer.wait() if pacer is not None else 1
+        if not intervals:
+            # The loop fell behind, and the stitched frame is stale.
+            continue
+        output_frame(stitched_frame, encoder, writer, preview, intervals)
 
+    if preview is not None:
+        preview.stop()
+    if encoder is not None:
+        close_encoder(encoder)
+    if pacer is not None:
+        print_pacing(pacer)
+    compositor.stop_reestimation()
+    compositor.stop_parallel_rendering()
+    if group.count:
+        TextFormatter.print_info("Capture skew: %.1f ms mean, %.1f ms max, %d skipped, "
+                                 "%d repeated frames." % (
+                                     1000 * group.get_mean_skew(), 1000 * group.max_skew,
+                                     group.skipped, group.repeated))
     for feed in feeds:
         feed.close()
-    cv2.destroyAllWindows()
-    cv2.waitKey(1)
 
-def identity(frame):
+def stitch_pipeline(pipeline, should_stream, output_path, width, height, rtmp_url, # pylint: disable=too-many-arguments
+                    preview_fps=None, fps=None, encoder_policy=None):
     """
-    Identity function to return an input frame.
+    Outputs the frames stitched by a pipeline until it runs out of frames or it is asked
+    to quit, then stops it and prints the throughput of its stages.
+    Output is paced as with stitch.
     """
-    return frame
+    writer = open_writer(output_path, width, height, fps or OUTPUT_FPS) if output_path else None
+    encoder = open_encoder(rtmp_url, width, height, fps, encoder_policy) if should_stream else None
+    control = ControlChannel(sys.stdin)
+    control.start()
+    preview = open_preview(control, preview_fps, should_stream)
+    pacer = FramePacer(fps) if fps else None
+    pipeline.start()
+    if pacer is not None:
+        pacer.start()
+    try:
+        while not control.should_quit():
+            stitched_frame, _ = pipeline.read()
+            if stitched_frame is None:
+                break
+            intervals = pacer.wait() if pacer is not None else 1
+            if intervals:
+                output_frame(stitched_frame, encoder, writer, preview, intervals)
+        # Drops the last frame, a view of the shared memory released on stopping.
+        stitched_frame = None
+    finally:
+        if preview is not None:
+            preview.stop()
+        if encoder is not None:
+            close_encoder(encoder)
+        pipeline.stop()
+    for name, frames, rate, busy, input_wait, output_wait in pipeline.get_stats():
+        TextFormatter.print_pair(name, "%d frames, %.1f fps, %.0f%% busy, %.1f s waiting "
+                                 "for input, %.1f s waiting on output" % (
+                                     frames, rate, 100 * busy, input_wait, output_wait))
+    if pacer is not None:
+        print_pacing(pacer)
+
+def open_writer(output_path, width, height, fps=OUTPUT_FPS):
+    """
+    Returns a video writer saving frames of the output size to the path,
+    at the provided frame rate.
+    """
+    if imutils.is_cv2():
+        codec = cv2.cv.CV_FOURCC('m', 'p', '4', 'v')
+    else:
+        codec = cv2.VideoWriter_fourcc('m', 'p', '4', 'v')
+    return cv2.VideoWriter(output_path, codec, fps, (width, height))
+
+def open_stream(rtmp_url, width, height, fps=OUTPUT_FPS):
+    """
+    Returns an ffmpeg process streaming raw frames of the output size to the RTMP url,
+    at the provided frame rate. Its standard input is unbuffered, so frames are written
+    to the pipe without being copied into a buffer first.
+    """
+    dimensions = str(width) + 'x' + str(height)
+    return subprocess.Popen([
+        'ffmpeg', '-y', '-f', 'rawvideo', '-r', str(fps),
+        '-s', dimensions, '-pix_fmt', 'bgr24', '-i', 'pipe:0', '-vcodec',
+        'libx264', '-pix_fmt', 'yuv422p', '-r', str(fps), '-an', '-f', 'flv',
+        rtmp_url], stdin=subprocess.PIPE, bufsize=0)
+
+def open_encoder(rtmp_url, width, height, fps=None, policy=None):
+    """
+    Returns a started encoder sink streaming frames to the RTMP url through ffmpeg,
+    dropping frames with the provided policy, which defaults to dropping the oldest.
+    """
+    encoder = EncoderSink(open_stream(rtmp_url, width, height, fps or OUTPUT_FPS),
+                          policy=policy or 'oldest')
+    encoder.start()
+    return encoder
 
-def stitch_frame(frames, _):
+def close_encoder(encoder):
     """
-    Stitching for single frame.
-    Simply returns the frame of the first index in the frames list.
+    Stops an encoder sink, once its queued frames are written or the encoder stalls,
+    and prints its counters.
     """
-    return frames[0]
+    encoder.stop()
+    stats = encoder.get_stats()
+    TextFormatter.print_info("Encoder: %d frames encoded, %d dropped, queue depth %.1f mean "
+                             "and %d max, %.1f s stalled on writes, %.1f ms at most." % (
+                                 stats['encoded'], stats['dropped'], stats['mean-depth'],
+                                 stats['max-depth'], stats['stall'], 1000 * stats['max-stall']))
+    if encoder.error is not None:
+        TextFormatter.print_error("Encoder stopped: %s" % encoder.error)
+    if stats['abandoned']:
+        TextFormatter.print_error("%d queued frames were dropped, never reaching the encoder."
+                                  % stats['abandoned'])
 
-def stitch_two_frames(frames, stitchers):
+def open_preview(control, preview_fps=None, should_stream=False):
     """
-    Stitches two frames together via the first stitcher in the stitcher array.
+    Returns a started preview of stitched frames at the provided rate, which defaults
+    to preview.PREVIEW_FPS, forwarding quit keys to the control channel.
+    Returns None if the rate is 0, or if no rate is provided when streaming, so
+    production streams run headless unless a preview is asked for.
     """
-    return stitchers[0].stitch(frames[0], frames[1])
+    if preview_fps == 0 or (preview_fps is None and should_stream):
+        return None
+    preview = PreviewSink(control) if preview_fps is None else PreviewSink(control, preview_fps)
+    preview.start()
+    return preview
 
-def stitch_three_frames(frames, stitchers):
+def output_frame(stitched_frame, encoder, writer, preview=None, intervals=1):
     """
-    Stitches three frames together via the first and second stitcher in the stitcher array.
+    Streams, saves and previews a stitched frame. The frame is encoded once per frame
+    interval it covers, so frames dropped by the pacer keep their time in the output.
     """
-    first_stitch = stitchers[0].stitch(frames[0], frames[1])
+    for _ in range(intervals):
+        if encoder is not None:
+            encoder.write(stitched_frame)
 
-    return stitchers[1].stitch(first_stitch, frames[2])
+        if writer is not None:
+            writer.write(stitched_frame)
 
-def stitch_four_frames(frames, stitchers):
+    if preview is not None:
+        preview.show(stitched_frame)
+
+def print_pacing(pacer):
+    """
+    Prints the pacing counters and the jitter and lateness histograms of a pacer.
+    """
+    stats = pacer.get_stats()
+    TextFormatter.print_info("Paced %d frames at %g fps: %d stale frames dropped, %d "
+                             "deadlines missed, %.2f ms mean jitter, %.2f ms max." % (
+                                 stats['frames'], stats['fps'], stats['dropped'],
+                                 stats['missed'], stats['mean-jitter'], stats['max-jitter']))
+    for name in ('jitter', 'lateness'):
+        for label, count in stats[name]:
+            if count:
+                TextFormatter.print_pair("%s %s" % (name, label), count)
+
+def get_rig_key(feeds):
+    """
+    Returns the key the homographies linking the feeds are stored under.
+    """
+    return "-".join(get_feed_id(feed) for feed in feeds)
+
+def get_feed_id(feed):
     """
-    Stitches four frames together.
+    Returns the identity of the camera behind a feed, used to key stored homographies.
     """
-    left_stitch = stitch_two_frames([frames[0], frames[1]], [stitchers[0]])
-    right_stitch = stitch_two_frames([frames[2], frames[3]], [stitchers[1]])
+    camera_id = getattr(feed, 'camera_id', None)
+    if camera_id is None:
+        camera_id = getattr(feed, 'path', None)
+    return str(camera_id)
 
-    # Stitches the first two stitched images together with the third stitcher in the stitcher list.
-    return stitch_two_frames([left_stitch, right_stitch], [stitchers[2]])
+def identity(frame):
+    """
+    Identity function to return an input frame.
+    """
+    return frame
@@ -0,0 +1,63 @@
+"""
+This module encapsulates the HomographyStore class to persist homographies between runs.
+"""
+from __future__ import absolute_import, division, print_function
+
+import os
+import re
+import numpy as np
+
+DEFAULT_HOMOGRAPHY_DIR = "config/homographies"
+
+class HomographyStore(object):
+    """
+    Stores the homography of each stitcher on disk, keyed by the identity of the stitched
+    cameras and the sizes of the stitched frames, so restarts can skip feature matching.
+    """
+
+    def __init__(self, directory=DEFAULT_HOMOGRAPHY_DIR):
+        self.directory = directory
+
+    def get_path(self, key, shape1, shape2):
+        """
+        Returns the path of the homography stored for the key and frame shapes.
+        """
+        return os.path.join(self.directory, "%s.%dx%d.%dx%d.npy" % (
+            (get_filename(key),) + tuple(shape1[1::-1]) + tuple(shape2[1::-1])))
+
+    def load(self, key, shape1, shape2):
+        """
+        Returns the homography stored for the key and frame shapes, or None if there is none.
+        """
+        path = self.get_path(key, shape1, shape2)
+        if not os.path.isfile(path):
+            return None
+        return np.load(path)
+
+    def save(self, key, shape1, shape2, homography):
+        """
+        Stores the homography for the key and frame shapes.
+        """
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        np.save(self.get_path(key, shape1, shape2), homography)
+
+    def invalidate(self, key=None):
+        """
+        Removes the homographies stored for the key at any frame size, along with those
+        of the links of the rig the key identifies (stored as "<key>.<link>"),
+        or all stored homographies if no key is provided.
+        """
+        if not os.path.isdir(self.directory):
+            return
+        prefixes = ("",) if key is None else ("%s." % get_filename(key),
+                                              get_filename("%s." % key))
+        for filename in os.listdir(self.directory):
+            if filename.startswith(prefixes) and filename.endswith(".npy"):
+                os.remove(os.path.join(self.directory, filename))
+
+def get_filename(key):
+    """
+    Returns a filename-safe version of a stitcher key.
+    """
+    return re.sub(r'[^A-Za-z0-9_-]+', '_', str(key))
@@ -0,0 +1,339 @@
+"""
+This module encapsulates the Pipeline class to capture, stitch and output frames
+in separate processes, passing frames between them through shared memory.
+"""
+from __future__ import absolute_import, division, print_function
+
+import multiprocessing
+import signal
+import time
+import numpy as np
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:
+    # Shared memory needs Python 3.8.
+    shared_memory = None
+
+from app.util.textformatter import TextFormatter
+from .compositor import Compositor
+from .features import get_backend
+
+# Number of slots of the rings between stages. A stage writing to a full ring waits
+# until the next stage frees a slot, so a slow stage holds back the ones before it.
+PIPELINE_SLOTS = 4
+
+# Seconds a stage waits on a ring before checking whether the pipeline was stopped.
+POLL_INTERVAL = 0.1
+
+# Seconds to wait for a stage to finish when stopping, before it is terminated.
+STAGE_TIMEOUT = 5.0
+
+# Header of each slot of a ring: rows, columns and channels of the frame in the slot,
+# and its capture timestamp. A slot of zero rows marks the end of the frames.
+HEADER_SIZE = 4
+
+def is_pipeline_supported():
+    """
+    Returns True if this interpreter provides the shared memory the pipeline runs on.
+    """
+    return shared_memory is not None
+
+class SharedRing(object):
+    """
+    Ring of frame slots in shared memory, written by one process and read by another.
+    Frames are copied into the slots once and read in place, without pickling.
+    Free and filled slots are counted by semaphores, so the writer waits for a free slot
+    when the reader falls behind, and the reader waits for a filled slot when it is ahead.
+    A read frame is held until the next read, which frees its slot.
+
+    Time spent waiting on the ring is counted on both sides, along with the frames
+    written and read.
+    """
+
+    def __init__(self, capacity, slots=PIPELINE_SLOTS):
+        self.capacity = capacity
+        self.slots = slots
+        self.memory = shared_memory.SharedMemory(create=True, size=capacity * slots)
+        self.headers = multiprocessing.Array('d', slots * HEADER_SIZE, lock=False)
+        self.free = multiprocessing.Semaphore(slots)
+        self.filled = multiprocessing.Semaphore(0)
+        self.written = multiprocessing.Value('l', 0, lock=False)
+        self.read_count = multiprocessing.Value('l', 0, lock=False)
+        self.write_wait = multiprocessing.Value('d', 0.0, lock=False)
+        self.read_wait = multiprocessing.Value('d', 0.0, lock=False)
+        self.write_index = 0
+        self.read_index = 0
+        self.held = False
+
+    def get_slot(self, index, shape):
+        """
+        Returns the frame of the provided shape in the slot, as a view of the shared memory.
+        """
+        return np.ndarray(shape, np.uint8, buffer=self.memory.buf,
+                          offset=(index % self.slots) * self.capacity)
+
+    def write(self, frame, timestamp, stopped):
+        """
+        Copies the frame into the next slot, waiting for one to be free, or marks the end
+        of the frames if the frame is None. Returns False if the pipeline was stopped first.
+        """
+        if not acquire(self.free, stopped, self.write_wait):
+            return False
+        header = (self.write_index % self.slots) * HEADER_SIZE
+        if frame is None:
+            self.headers[header] = 0
+        else:
+            if frame.nbytes > self.capacity:
+                raise ValueError("Frame of shape %s exceeds the %d bytes of a ring slot."
+                                 % (frame.shape, self.capacity))
+            shape = frame.shape[:2] + (frame.shape[2] if frame.ndim == 3 else 1,)
+            np.copyto(self.get_slot(self.write_index, frame.shape), frame)
+            self.headers[header:header + HEADER_SIZE] = list(shape) + [timestamp or 0.0]
+        self.write_index += 1
+        self.written.value += 1
+        self.filled.release()
+        return True
+
+    def read(self, stopped):
+        """
+        Frees the slot of the previously read frame and returns the next frame and its
+        timestamp, waiting for one to be written. Returns (None, None) at the end of the
+        frames or if the pipeline was stopped first.
+        """
+        if self.held:
+            self.free.release()
+            self.held = False
+        if not acquire(self.filled, stopped, self.read_wait):
+            return None, None
+        header = (self.read_index % self.slots) * HEADER_SIZE
+        rows, cols, channels, timestamp = self.headers[header:header + HEADER_SIZE]
+        if rows == 0:
+            self.free.release()
+            return None, None
+        shape = (int(rows), int(cols)) + ((int(channels),) if channels > 1 else ())
+        frame = self.get_slot(self.read_index, shape)
+        self.read_index += 1
+        self.read_count.value += 1
+        self.held = True
+        return frame, timestamp
+
+    def close(self):
+        """
+        Detaches this process from the shared memory.
+        """
+        try:
+            self.memory.close()
+        except BufferError:
+            # Frames read from the ring are still referenced, and the memory is
+            # detached once they are collected.
+            pass
+
+    def unlink(self):
+        """
+        Destroys the shared memory and detaches from it. Called by the process that
+        created it.
+        """
+        self.memory.unlink()
+        self.close()
+
+class StageCounters(object): # pylint: disable=too-few-public-methods
+    """
+    Throughput counters of a stage, shared with the process running it:
+    the frames it processed and the seconds it spent processing them.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.frames = multiprocessing.Value('l', 0, lock=False)
+        self.busy = multiprocessing.Value('d', 0.0, lock=False)
+
+    def record(self, start_time):
+        """
+        Records a frame processed since the start time.
+        """
+        self.frames.value += 1
+        self.busy.value += time.time() - start_time
+
+class Pipeline(object):
+    """
+    Runs the capture of each feed and the stitching of their frames in separate processes,
+    connected by shared-memory rings, and hands the stitched frames to the calling process
+    for output. Feeds are created in their capture processes by the provided factories,
+    and frames are corrected there. Frames of the feeds are paired in capture order.
+
+    The stitching process composites frames as stitch does, with the provided compositor
+    settings: key, store, backend (detector and matcher names), projection, blend,
+    reestimate-interval, drift-threshold, gain-interval and render-threads.
+    Stitched frames are rendered at the provided size.
+
+    Capture rings hold frames up to as tall as they are wide, at the provided feed width.
+    """
+
+    def __init__(self, feed_factories, feed_width, size, settings=None, slots=PIPELINE_SLOTS):
+        self.stopped = multiprocessing.Event()
+        self.capture_rings = [SharedRing(feed_width * feed_width * 3, slots)
+                              for _ in feed_factories]
+        self.output_ring = SharedRing(size[0] * size[1] * 3, slots)
+        self.counters = [StageCounters("capture-%d" % index)
+                         for index in range(len(feed_factories))]
+        self.counters.append(StageCounters("stitch"))
+        self.counters.append(StageCounters("output"))
+        self.processes = [
+            multiprocessing.Process(target=run_capture, name=counters.name,
+                                    args=(factory, ring, self.stopped, counters))
+            for factory, ring, counters in zip(feed_factories, self.capture_rings,
+                                               self.counters)]
+        self.processes.append(multiprocessing.Process(
+            target=run_stitch, name="stitch",
+            args=(self.capture_rings, self.output_ring, self.stopped, self.counters[-2],
+                  size, settings or {})))
+        self.start_time = None
+        self.output_start = None
+
+    def start(self):
+        """
+        Starts the stages.
+        """
+        self.start_time = time.time()
+        for process in self.processes:
+            process.daemon = True
+            process.start()
+
+    def read(self):
+        """
+        Returns the next stitched frame and the capture timestamp of its first frame,
+        or (None, None) once the feeds run out of frames. The frame is only valid until
+        the next read.
+        """
+        if self.output_start is not None:
+            self.counters[-1].record(self.output_start)
+        frame, timestamp = self.output_ring.read(self.stopped)
+        self.output_start = time.time() if frame is not None else None
+        return frame, timestamp
+
+    def stop(self):
+        """
+        Stops the stages, terminating those that do not finish in time,
+        and releases the shared memory.
+        """
+        self.stopped.set()
+        for process in self.processes:
+            if process.pid is not None:
+                process.join(STAGE_TIMEOUT)
+                if process.is_alive():
+                    process.terminate()
+                    process.join()
+        for ring in self.capture_rings + [self.output_ring]:
+            ring.unlink()
+
+    def get_stats(self):
+        """
+        Returns the throughput of each stage as (name, frames, frames per second,
+        busy fraction, seconds waiting for input, seconds waiting on output).
+        """
+        elapsed = max(time.time() - (self.start_time or time.time()), 1e-9)
+        input_waits = [0.0] * len(self.capture_rings) + [
+            sum(ring.read_wait.value for ring in self.capture_rings),
+            self.output_ring.read_wait.value]
+        output_waits = [ring.write_wait.value for ring in self.capture_rings] + [
+            self.output_ring.write_wait.value, 0.0]
+        return [(counters.name, counters.frames.value, counters.frames.value / elapsed,
+                 counters.busy.value / elapsed, input_wait, output_wait)
+                for counters, input_wait, output_wait
+                in zip(self.counters, input_waits, output_waits)]
+
+def acquire(semaphore, stopped, wait):
+    """
+    Acquires the semaphore, adding the seconds spent waiting to the wait counter.
+    Returns False if the pipeline was stopped first.
+    """
+    start_time = time.time()
+    try:
+        while not semaphore.acquire(timeout=POLL_INTERVAL):
+            if stopped.is_set():
+                return False
+        return True
+    finally:
+        wait.value += time.time() - start_time
+
+def run_capture(factory, ring, stopped, counters):
+    """
+    Capture stage. Reads and corrects the frames of the feed created by the factory
+    into the ring until the feed runs out of frames or the pipeline is stopped.
+    """
+    # Interrupts are handled by the process running the pipeline, which stops the stages.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    feed = factory()
+    try:
+        start_time = time.time()
+        for frame in feed:
+            if frame is None:
+                break
+            counters.record(start_time)
+            if not ring.write(frame, feed.timestamp, stopped):
+                break
+            start_time = time.time()
+        ring.write(None, None, stopped)
+    finally:
+        feed.close()
+        ring.close()
+
+def run_stitch(capture_rings, output_ring, stopped, counters, size, settings):
+    """
+    Stitching stage. Composites a frame of each capture ring into the output ring
+    until any feed runs out of frames, the feeds fail to overlap for too long,
+    or the pipeline is stopped.
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    compositor = create_compositor(size, settings)
+    frames = frame = stitched_frame = None
+    try:
+        while True:
+            frames = []
+            timestamp = None
+            for ring in capture_rings:
+                frame, frame_timestamp = ring.read(stopped)
+                if frame is None:
+                    break
+                frames.append(frame)
+                timestamp = frame_timestamp if timestamp is None else timestamp
+            if len(frames) < len(capture_rings):
+                break
+
+            start_time = time.time()
+            stitched_frame = compositor.composite(frames)
+            if stitched_frame is None:
+                if compositor.has_failed():
+                    TextFormatter.print_error("The feeds do not overlap enough to be stitched.")
+                    break
+                # The feeds have not overlapped enough yet, and are retried.
+                continue
+            counters.record(start_time)
+            if not output_ring.write(stitched_frame, timestamp, stopped):
+                break
+        output_ring.write(None, None, stopped)
+    finally:
+        compositor.stop_reestimation()
+        compositor.stop_parallel_rendering()
+        del frames, frame, stitched_frame
+        for ring in capture_rings + [output_ring]:
+            ring.close()
+
+def create_compositor(size, settings):
+    """
+    Returns a compositor configured with the pipeline settings.
+    """
+    backend = settings.get('backend')
+    compositor = Compositor(settings.get('key'), settings.get('store'),
+                            get_backend(*backend) if backend else None,
+                            settings.get('projection'), size, blend=settings.get('blend'))
+    if settings.get('reestimate-interval'):
+        compositor.start_reestimation(settings['reestimate-interval'])
+    if settings.get('drift-threshold'):
+        compositor.start_drift_monitoring(settings['drift-threshold'])
+    if settings.get('gain-interval'):
+        compositor.start_gain_compensation(settings['gain-interval'])
+    if settings.get('render-threads'):
+        compositor.start_parallel_rendering(settings['render-threads'])
+    return compositor
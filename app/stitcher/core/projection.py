@@ -0,0 +1,298 @@
+"""
+This module encapsulates cylindrical and equirectangular projections of a camera rig
+into a panorama, rendered through precomputed warp plans.
+"""
+from __future__ import absolute_import, division, print_function
+
+import numpy as np
+import cv2
+
+from .warp import CanvasPlan, Tile, get_preview_size
+
+PROJECTIONS = ('cylindrical', 'equirectangular')
+
+# Horizontal field of view in degrees assumed for cameras whose focal length
+# cannot be estimated from the homographies.
+DEFAULT_FIELD_OF_VIEW = 60.0
+
+# Largest height on the unit cylinder covered by a cylindrical panorama,
+# the tangent of the largest elevation above or below the horizon.
+MAX_CYLINDER_HEIGHT = np.tan(np.radians(70.0))
+
+# Number of points sampled along each side of a frame to find its footprint in a panorama.
+BORDER_SAMPLES = 32
+
+class Projection(object):
+    """
+    Maps between the pixels of a panorama of the provided size and viewing directions
+    in the frame of the reference camera, with x pointing right, y down and z forward.
+    Columns are longitudes around the vertical axis. Rows are latitudes in an
+    equirectangular panorama, and heights on the unit cylinder in a cylindrical one.
+    The scale is in pixels per radian or per unit of height, and the origin is the pixel
+    looking straight ahead of the reference camera.
+    """
+
+    def __init__(self, name, size, scale, origin):
+        if name not in PROJECTIONS:
+            raise ValueError("Unknown projection %s. Choose one of %s."
+                             % (name, ", ".join(PROJECTIONS)))
+        self.name = name
+        self.size = size
+        self.scale = scale
+        self.origin = origin
+
+    def get_rays(self, xs, ys):
+        """
+        Returns the x, y and z components of the viewing directions of the pixels.
+        """
+        longitude = (xs - self.origin[0]) / self.scale[0]
+        vertical = (ys - self.origin[1]) / self.scale[1]
+        if self.name == 'equirectangular':
+            return (np.cos(vertical) * np.sin(longitude), np.sin(vertical),
+                    np.cos(vertical) * np.cos(longitude))
+        return np.sin(longitude), vertical, np.cos(longitude)
+
+    def get_pixels(self, rays_x, rays_y, rays_z):
+        """
+        Returns the x and y coordinates of the pixels looking in the directions.
+        """
+        radius = np.hypot(rays_x, rays_z)
+        if self.name == 'equirectangular':
+            vertical = np.arctan2(rays_y, radius)
+        else:
+            vertical = rays_y / np.maximum(radius, 1e-9)
+        return (np.arctan2(rays_x, rays_z) * self.scale[0] + self.origin[0],
+                vertical * self.scale[1] + self.origin[1])
+
+    def crop(self, crop, size):
+        """
+        Returns the projection of the rectangle (x, y, width, height) of this panorama,
+        in pixel edge coordinates, sampled at the provided size.
+        """
+        x, y, width, height = crop
+        factors = (size[0] / width, size[1] / height)
+        return Projection(self.name, tuple(size),
+                          (self.scale[0] * factors[0], self.scale[1] * factors[1]),
+                          ((self.origin[0] + 0.5 - x) * factors[0] - 0.5,
+                           (self.origin[1] + 0.5 - y) * factors[1] - 0.5))
+
+def is_valid_size(name, size):
+    """
+    Returns True if a panorama of the projection can be rendered at the provided size.
+    Equirectangular panoramas cover 360 by 180 degrees, so they must be twice as wide as
+    high, or they come out stretched.
+    """
+    return name != 'equirectangular' or size[0] == 2 * size[1]
+
+def create_projection(name, shapes, camera_matrices, rotations, size=None): # pylint: disable=too-many-locals
+    """
+    Returns the projection of a panorama covering the frames of the provided shapes.
+    An equirectangular panorama always covers the full sphere at the provided size, which
+    must be twice as wide as high (see is_valid_size), or at such a size by default. A cylindrical panorama covers the longitudes and
+    heights seen by the frames. Panoramas are sampled at the mean focal length of the
+    cameras unless a size is provided.
+    """
+    if size is not None and not is_valid_size(name, size):
+        raise ValueError("An equirectangular panorama must be twice as wide as high, "
+                         "not %dx%d." % tuple(size))
+    focal = np.mean([camera_matrix[0, 0] for camera_matrix in camera_matrices])
+    if name == 'equirectangular':
+        if size is None:
+            width = int(round(2 * np.pi * focal))
+            size = (width, width // 2)
+        scale = (size[0] / (2 * np.pi), size[1] / np.pi)
+        return Projection(name, size, scale, (size[0] / 2 - 0.5, size[1] / 2 - 0.5))
+
+    longitudes, heights = [], []
+    for shape, camera_matrix, rotation in zip(shapes, camera_matrices, rotations):
+        rays_x, rays_y, rays_z = get_border_rays(shape, camera_matrix, rotation)
+        longitude = np.arctan2(rays_x, rays_z)
+        if longitude.max() - longitude.min() > np.pi:
+            # The frame straddles the back of the rig, so the panorama goes all around.
+            longitude = np.array([-np.pi, np.pi])
+        longitudes.append(longitude)
+        heights.append(np.clip(rays_y / np.maximum(np.hypot(rays_x, rays_z), 1e-9),
+                               -MAX_CYLINDER_HEIGHT, MAX_CYLINDER_HEIGHT))
+    longitude_min, longitude_max = min(map(np.min, longitudes)), max(map(np.max, longitudes))
+    height_min, height_max = min(map(np.min, heights)), max(map(np.max, heights))
+
+    projection = Projection(name, (int(np.ceil((longitude_max - longitude_min) * focal)),
+                                   int(np.ceil((height_max - height_min) * focal))),
+                            (focal, focal), (-longitude_min * focal - 0.5,
+                                             -height_min * focal - 0.5))
+    if size is not None:
+        projection = projection.crop((0, 0) + projection.size, size)
+    return projection
+
+def get_border_rays(shape, camera_matrix, rotation):
+    """
+    Returns the viewing directions in the rig frame of points along the border of a frame.
+    """
+    rows, cols = shape[:2]
+    steps = np.linspace(0, 1, BORDER_SAMPLES)
+    xs = np.concatenate([steps * cols, np.full_like(steps, cols), steps[::-1] * cols,
+                         np.zeros_like(steps)])
+    ys = np.concatenate([np.zeros_like(steps), steps * rows, np.full_like(steps, rows),
+                         steps[::-1] * rows])
+    points = np.vstack([xs - 0.5, ys - 0.5, np.ones_like(xs)])
+    return rotation.T.dot(np.linalg.inv(camera_matrix).dot(points))
+
+def get_footprint(projection, shape, camera_matrix, rotation):
+    """
+    Returns the bounding box (x_min, y_min, x_max, y_max) of the panorama pixels
+    a frame of the provided shape can cover.
+    """
+    width, height = projection.size
+    rays = get_border_rays(shape, camera_matrix, rotation)
+    xs, ys = projection.get_pixels(*rays)
+    x_min, x_max = int(np.floor(xs.min())) - 1, int(np.ceil(xs.max())) + 2
+    y_min, y_max = int(np.floor(ys.min())) - 1, int(np.ceil(ys.max())) + 2
+
+    longitude = np.arctan2(rays[0], rays[2])
+    if longitude.max() - longitude.min() > np.pi:
+        x_min, x_max = 0, width
+    # Frames looking at a pole cover whole rows of an equirectangular panorama.
+    for pole, edge in (((0, -1, 0), 'top'), ((0, 1, 0), 'bottom')):
+        point = camera_matrix.dot(rotation.dot(pole))
+        if point[2] > 0 and 0 <= point[0] / point[2] < shape[1] and \
+                0 <= point[1] / point[2] < shape[0]:
+            x_min, x_max = 0, width
+            if edge == 'top':
+                y_min = 0
+            else:
+                y_max = height
+    return max(x_min, 0), max(y_min, 0), min(x_max, width), min(y_max, height)
+
+def build_projection_tile(projection, shape, camera_matrix, rotation):
+    """
+    Returns a tile projecting a frame of the provided shape into the panorama,
+    limited to the pixels the frame covers. Returns None if the frame misses the panorama.
+    """
+    x_min, y_min, x_max, y_max = get_footprint(projection, shape, camera_matrix, rotation)
+    if x_min >= x_max or y_min >= y_max:
+        return None
+
+    xs, ys = np.meshgrid(np.arange(x_min, x_max, dtype=np.float64),
+                         np.arange(y_min, y_max, dtype=np.float64))
+    rays = projection.get_rays(xs, ys)
+    transform = camera_matrix.dot(rotation)
+    points = [transform[row, 0] * rays[0] + transform[row, 1] * rays[1] +
+              transform[row, 2] * rays[2] for row in range(3)]
+    valid = points[2] > 1e-9
+    depth = np.where(valid, points[2], 1.0)
+    map_x, map_y = points[0] / depth, points[1] / depth
+    valid &= (map_x > -1) & (map_x < shape[1]) & (map_y > -1) & (map_y < shape[0])
+    if not valid.any():
+        return None
+
+    # Shrinks the tile to the pixels the frame actually covers.
+    rows, cols = np.flatnonzero(valid.any(axis=1)), np.flatnonzero(valid.any(axis=0))
+    window = (slice(rows[0], rows[-1] + 1), slice(cols[0], cols[-1] + 1))
+    map_x, map_y, valid = map_x[window], map_y[window], valid[window]
+    map_x[~valid] = -1
+    map_y[~valid] = -1
+    map1, map2 = cv2.convertMaps(np.float32(map_x), np.float32(map_y), cv2.CV_16SC2)
+    return Tile(x_min + cols[0], y_min + rows[0], map_x.shape[1], map_x.shape[0], map1, map2)
+
+def build_projection_plan(name, shapes, homographies, camera_matrices=None, size=None,
+                          reference=None):
+    """
+    Returns the plan projecting a row of frames of the provided shapes, ordered left to right,
+    into a panorama of the named projection. Each homography maps a frame to the plane of
+    the next one, and is taken to be a pure rotation of the camera to recover the camera
+    orientations. The camera matrices default to ones with a focal length estimated
+    from the homographies. Every frame is remapped once, and frames closer to the reference,
+    the middle frame by default, are rendered over farther ones.
+
+    If an output size is provided, a cylindrical panorama is cropped to its largest region
+    of the same aspect ratio covered by frames, and rendered straight at that size.
+    An equirectangular panorama always covers the full sphere, as 360 players expect.
+    """
+    if reference is None:
+        reference = len(shapes) // 2
+    if camera_matrices is None:
+        focal = estimate_focal(homographies, shapes)
+        camera_matrices = [get_camera_matrix(shape, focal) for shape in shapes]
+    rotations = get_rotations(homographies, camera_matrices, reference)
+    order = sorted(range(len(shapes)), key=lambda index: -abs(index - reference))
+    if name == 'equirectangular':
+        projection = create_projection(name, shapes, camera_matrices, rotations, size)
+    else:
+        projection = create_projection(name, shapes, camera_matrices, rotations)
+        if size is not None:
+            # The valid region is searched on a low resolution rendering of the panorama.
+            preview = projection.crop((0, 0) + projection.size,
+                                      get_preview_size(projection.size))
+            preview_plan = build_projection_canvas(preview, shapes, camera_matrices,
+                                                   rotations, order)
+            crop = preview_plan.get_valid_crop(size[0] / size[1])
+            scale = projection.size[0] / preview.size[0]
+            projection = projection.crop([value * scale for value in crop], size)
+    return build_projection_canvas(projection, shapes, camera_matrices, rotations, order)
+
+def build_projection_canvas(projection, shapes, camera_matrices, rotations, order):
+    """
+    Returns the plan projecting frames of the provided shapes into the panorama.
+    """
+    tiles = [build_projection_tile(projection, shape, camera_matrix, rotation)
+             for shape, camera_matrix, rotation in zip(shapes, camera_matrices, rotations)]
+    return CanvasPlan(projection.size, tiles, tuple(shapes), order)
+
+def get_camera_matrix(shape, focal):
+    """
+    Returns the camera matrix of a frame of the provided shape with the focal length
+    and the principal point at its center.
+    """
+    return np.array([[focal, 0, (shape[1] - 1) / 2], [0, focal, (shape[0] - 1) / 2],
+                     [0, 0, 1]], dtype=np.float64)
+
+def get_rotation_error(homography, camera_matrix1, camera_matrix2):
+    """
+    Returns how far the homography is from a pure rotation between cameras
+    with the provided camera matrices.
+    """
+    rotation = np.linalg.inv(camera_matrix2).dot(homography).dot(camera_matrix1)
+    rotation /= np.cbrt(np.linalg.det(rotation))
+    return np.linalg.norm(rotation.dot(rotation.T) - np.eye(3))
+
+def estimate_focal(homographies, shapes):
+    """
+    Returns the focal length that makes the homographies between neighbouring frames
+    closest to pure camera rotations, or one giving DEFAULT_FIELD_OF_VIEW if the
+    homographies cannot tell, as with purely translated frames.
+    """
+    width = np.mean([shape[1] for shape in shapes])
+    default_focal = width / (2 * np.tan(np.radians(DEFAULT_FIELD_OF_VIEW) / 2))
+    candidates = np.geomspace(width / 10, width * 10, 400)
+    errors = np.zeros(len(candidates))
+    for index, focal in enumerate(candidates):
+        for homography, shape1, shape2 in zip(homographies, shapes[:-1], shapes[1:]):
+            errors[index] += get_rotation_error(homography, get_camera_matrix(shape1, focal),
+                                                get_camera_matrix(shape2, focal))
+    best = int(np.argmin(errors))
+    if best in (0, len(candidates) - 1):
+        return default_focal
+    return candidates[best]
+
+def get_rotations(homographies, camera_matrices, reference):
+    """
+    Returns the rotations from the rig frame to each camera frame, taking the homographies
+    between neighbouring frames as pure rotations and the reference camera as the rig frame.
+    """
+    relative = []
+    for homography, camera_matrix1, camera_matrix2 in zip(homographies, camera_matrices[:-1],
+                                                          camera_matrices[1:]):
+        rotation = np.linalg.inv(camera_matrix2).dot(homography).dot(camera_matrix1)
+        left, _, right = np.linalg.svd(rotation)
+        rotation = left.dot(right)
+        if np.linalg.det(rotation) < 0:
+            rotation = -rotation
+        relative.append(rotation)
+
+    rotations = [None] * len(camera_matrices)
+    rotations[reference] = np.eye(3)
+    for index in range(reference - 1, -1, -1):
+        rotations[index] = relative[index].T.dot(rotations[index + 1])
+    for index in range(reference + 1, len(rotations)):
+        rotations[index] = relative[index - 1].dot(rotations[index - 1])
+    return rotations
@@ -0,0 +1,101 @@
+"""
+This module encapsulates the Reestimator class to refresh stitching geometry in the
+background without stalling the frame loop.
+"""
+from __future__ import absolute_import, division, print_function
+
+import threading
+import time
+import numpy as np
+
+from app.util.textformatter import TextFormatter
+
+class Reestimator(object):
+    """
+    Periodically snapshots the frames offered by the frame loop and hands them to
+    the target's reestimate method on a worker thread. The target decides whether the
+    result is better than its current geometry and swaps it in atomically.
+
+    Offering frames is cheap: frames are only copied into preallocated snapshot buffers
+    when a snapshot is due and the worker is idle.
+
+    A re-estimation that fails, as on degenerate snapshots, is reported and counted in
+    failures, and the worker carries on with the next snapshot.
+    """
+
+    def __init__(self, target, interval=10.0):
+        self.target = target
+        self.interval = interval
+        self.snapshot = []
+        self.pending = False
+        self.requested = False
+        self.stopped = False
+        self.last_time = time.time()
+        self.attempts = 0
+        self.adoptions = 0
+        self.failures = 0
+        self.condition = threading.Condition()
+        self.thread = threading.Thread(target=self.run, name="reestimator")
+        self.thread.daemon = True
+
+    def start(self):
+        """
+        Starts the worker thread.
+        """
+        self.thread.start()
+
+    def request(self):
+        """
+        Requests a re-estimation from the next offered frames, regardless of the interval.
+        """
+        self.requested = True
+
+    def offer(self, *frames):
+        """
+        Offers the current frames for a snapshot. Called from the frame loop.
+        """
+        if self.pending or self.stopped:
+            return
+        if not self.requested and time.time() - self.last_time < self.interval:
+            return
+
+        if [buf.shape for buf in self.snapshot] != [frame.shape for frame in frames]:
+            self.snapshot = [np.empty_like(frame) for frame in frames]
+        for buf, frame in zip(self.snapshot, frames):
+            np.copyto(buf, frame)
+
+        with self.condition:
+            self.requested = False
+            self.last_time = time.time()
+            self.pending = True
+            self.condition.notify()
+
+    def run(self):
+        """
+        Worker loop re-estimating from each snapshot.
+        """
+        while True:
+            with self.condition:
+                while not self.pending and not self.stopped:
+                    self.condition.wait()
+                if self.stopped:
+                    return
+            try:
+                self.attempts += 1
+                if self.target.reestimate(*self.snapshot):
+                    self.adoptions += 1
+            except Exception as error: # pylint: disable=broad-except
+                self.failures += 1
+                TextFormatter.print_error("Re-estimation failed: %s" % error)
+            finally:
+                self.pending = False
+
+    def stop(self):
+        """
+        Stops the worker thread, waiting for a running re-estimation to finish.
+        """
+        with self.condition:
+            self.stopped = True
+            self.condition.notify()
+        if self.thread.is_alive():
+            self.thread.join()
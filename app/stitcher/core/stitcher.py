@@ -4,17 +4,81 @@ This module encapsulates the Stitcher class to enable stitching of images/frames
 """
 from __future__ import absolute_import, division, print_function
 
+from collections import namedtuple
+import threading
 import numpy as np
 import imutils
 import cv2
 
-class Stitcher(object):
-    """ Creates a single stitched frame from two frames """
+from .blending import set_blender
+from .drift import DriftMonitor
+from .exposure import GainCompensator
+from .features import get_backend
+from .reestimator import Reestimator
+from .warp import build_warp_plan
 
-    def __init__(self):
+# Frames are downscaled for feature detection by pyramid levels while they are
+# at least twice this wide.
+MIN_DETECTION_WIDTH = 480
+
+# Expected overlap between neighbouring frames, as a fraction of the frame width.
+DEFAULT_OVERLAP = 0.5
+
+# Maximum reprojection error in pixels of a match consistent with a homography.
+INLIER_THRESHOLD = 5.0
+
+# Number of drift checks to wait after requesting a re-estimation before requesting another.
+DRIFT_BACKOFF_CHECKS = 30
+
+# Fraction by which a re-estimated homography must have more inliers than the current one
+# on the same matches to replace it.
+IMPROVEMENT_MARGIN = 0.1
+
+# Homography estimated from a pair of frames. The points of the good matches are given
+# at full resolution, along with the mask of the RANSAC inliers among them.
+HomographyEstimate = namedtuple('HomographyEstimate',
+                                ['homography', 'src_points', 'dst_points', 'inliers'])
+
+class Stitcher(object): # pylint: disable=too-many-instance-attributes
+    """
+    Creates a single stitched frame from two frames.
+    If a homography store and a key identifying the stitched cameras are provided,
+    the homography is loaded from the store instead of being computed when possible.
+    Homographies are computed with the named feature backend (see features.get_backend).
+
+    Once the homography is known, the canvas geometry and warp maps are frozen in a plan
+    and every frame is rendered into the same preallocated canvas.
+    The returned stitch is therefore only valid until the next call to stitch.
+
+    The homography can be re-estimated in the background (see start_reestimation),
+    in which case better homographies are swapped in between frames. Drift of the rig can
+    be monitored by tracking the homography inliers (see start_drift_monitoring), in which
+    case a re-estimation is triggered when the drift crosses a threshold.
+
+    The seam is blended with the named blender (see blending.BLENDERS), if any, and
+    exposure differences can be compensated (see start_gain_compensation).
+    If an output size (width, height) is provided, stitches are rendered straight at that
+    size, cropped to the largest part of the canvas covered by the frames.
+    """
+
+    def __init__(self, key=None, store=None, backend=None, blend=None, size=None):
         """ Initializes homography matrix and checks opencv version """
         self.isv3 = imutils.is_cv3()
         self.homography = None
+        self.plan = None
+        self.key = key
+        self.store = store
+        self.backend = backend
+        self.blend = blend
+        self.size = size
+        self.reestimator = None
+        self.drift_monitor = None
+        self.gain_compensator = None
+        self.drift_threshold = None
+        self.drift_interval = 1
+        self.drift_backoff = 0
+        self.frame_count = 0
+        self.lock = threading.Lock()
 
     def stitch(self, frame1, frame2):
         """
@@ -22,13 +86,159 @@ class Stitcher(object):
         Returns a stitched composition of frame1 and frame2.
         """
         if self.homography is None:
-            self.homography = compute_homography(frame1, frame2)
+            self.set_homography(self.load_homography(frame1, frame2))
 
-        if self.homography is not False:
-            result = warp_images(frame2, frame1, self.homography)
-            return result
+        if self.reestimator is not None:
+            self.reestimator.offer(frame1, frame2)
 
-        return None
+        self.frame_count += 1
+        if self.drift_monitor is not None and self.frame_count % self.drift_interval == 0:
+            self.check_drift(frame1, frame2)
+
+        plan = self.plan
+        if plan is None or plan.shapes != (frame1.shape, frame2.shape):
+            with self.lock:
+                if self.homography is False:
+                    return None
+                plan = set_blender(build_warp_plan(frame2.shape, frame1.shape,
+                                                   self.homography, self.size), self.blend)
+                self.plan = plan
+        frames = [frame1, frame2]
+        if self.gain_compensator is not None:
+            frames = self.gain_compensator.compensate(frames, plan)
+        return plan.render(frames)
+
+    def set_homography(self, homography):
+        """
+        Sets the homography of the stitcher. The warp plan is rebuilt from the next frames.
+        """
+        with self.lock:
+            self.homography = homography
+            self.plan = None
+
+    def adopt(self, homography, shape1, shape2):
+        """
+        Swaps in a new homography for frames of the provided shapes, together with its
+        warp plan, so the next frame is rendered with it. Used by the background
+        re-estimation, which calls it off the frame loop. The plan is only built if the
+        stitcher is rendering, which it is not when it links frames of a Compositor.
+        """
+        plan = None
+        if self.plan is not None:
+            plan = set_blender(build_warp_plan(shape2, shape1, homography, self.size),
+                               self.blend)
+        with self.lock:
+            self.plan = plan
+            self.homography = homography
+        if self.store is not None and self.key is not None:
+            self.store.save(self.key, shape1, shape2, homography)
+
+    def seed_drift_monitor(self, homography, estimate):
+        """
+        Seeds drift monitoring with the matches of the estimate consistent with the homography.
+        """
+        if self.drift_monitor is None or estimate is None:
+            return
+        inliers = get_inlier_mask(homography, estimate.src_points, estimate.dst_points)
+        self.drift_monitor.seed(homography, estimate.src_points[inliers],
+                                estimate.dst_points[inliers])
+
+    def reestimate(self, frame1, frame2):
+        """
+        Estimates a homography from the frames and adopts it if it is clearly better than
+        the current one, judged by their inliers among the new matches.
+        Returns True if the new homography was adopted.
+        """
+        estimate = estimate_homography(frame1, frame2, self.backend)
+        if estimate is None:
+            return False
+
+        homography = self.homography
+        current_inliers = count_inliers(homography, estimate.src_points,
+                                        estimate.dst_points)
+        candidate_inliers = count_inliers(estimate.homography, estimate.src_points,
+                                          estimate.dst_points)
+        if candidate_inliers <= (1 + IMPROVEMENT_MARGIN) * current_inliers:
+            self.seed_drift_monitor(homography, estimate)
+            return False
+
+        self.adopt(estimate.homography, frame1.shape, frame2.shape)
+        self.seed_drift_monitor(estimate.homography, estimate)
+        return True
+
+    def start_reestimation(self, interval=10.0):
+        """
+        Starts re-estimating the homography in the background from a snapshot of the
+        stitched frames every interval seconds.
+        """
+        if self.reestimator is None:
+            self.reestimator = Reestimator(self, interval)
+            self.reestimator.start()
+
+    def stop_reestimation(self):
+        """
+        Stops the background re-estimation of the homography.
+        """
+        if self.reestimator is not None:
+            self.reestimator.stop()
+            self.reestimator = None
+
+    def start_drift_monitoring(self, threshold=4.0, interval=1):
+        """
+        Starts tracking the homography inliers every interval frames, re-estimating the
+        homography when they drift more than threshold pixels from it. Re-estimation runs
+        in the background if it was started, and inline otherwise.
+        """
+        self.drift_monitor = DriftMonitor()
+        self.drift_threshold = threshold
+        self.drift_interval = interval
+
+    def stop_drift_monitoring(self):
+        """
+        Stops monitoring drift of the homography.
+        """
+        self.drift_monitor = None
+
+    def start_gain_compensation(self, interval=30):
+        """
+        Starts compensating exposure differences between the frames, with gains
+        re-estimated from their overlap every interval frames.
+        """
+        self.gain_compensator = GainCompensator(interval)
+
+    def stop_gain_compensation(self):
+        """
+        Stops compensating exposure differences between the frames.
+        """
+        self.gain_compensator = None
+
+    def is_drifting(self, frame1, frame2):
+        """
+        Tracks the homography inliers into the frames. Returns True if they drifted past
+        the threshold or if there are too few of them to track.
+        """
+        level1, scale1 = get_pyramid_level(frame1)
+        level2, scale2 = get_pyramid_level(frame2)
+        drift = self.drift_monitor.update(level1, scale1, level2, scale2)
+        return drift is None or drift > self.drift_threshold
+
+    def check_drift(self, frame1, frame2):
+        """
+        Requests a re-estimation if the homography is drifting from the frames.
+        Requests are not repeated for a while, to give the re-estimation time to finish.
+        """
+        if not self.is_drifting(frame1, frame2):
+            self.drift_backoff = 0
+            return
+
+        if self.drift_backoff > 0:
+            self.drift_backoff -= 1
+            return
+        self.drift_backoff = DRIFT_BACKOFF_CHECKS
+        if self.reestimator is not None:
+            self.reestimator.request()
+        elif self.homography is not False:
+            self.reestimate(frame1, frame2)
 
     def show_stitch(self, frame1, frame2):
         """
@@ -39,11 +249,41 @@ class Stitcher(object):
             cv2.imshow('Stitched output', result)
             cv2.waitKey()
 
+    def load_homography(self, frame1, frame2):
+        """
+        Returns the stored homography for the frames, computing and storing it if
+        there is none.
+        """
+        homography = None
+        if self.store is not None and self.key is not None:
+            homography = self.store.load(self.key, frame1.shape, frame2.shape)
+        if homography is not None:
+            return homography
+
+        estimate = estimate_homography(frame1, frame2, self.backend)
+        if estimate is None:
+            return False
+        if self.store is not None and self.key is not None:
+            self.store.save(self.key, frame1.shape, frame2.shape, estimate.homography)
+        self.seed_drift_monitor(estimate.homography, estimate)
+        return estimate.homography
+
     def reset(self):
         """
         Resets the homography of the stitcher to None for stitcher reuse.
         """
-        self.homography = None
+        self.set_homography(None)
+        if self.drift_monitor is not None:
+            self.drift_monitor.clear()
+
+    def invalidate(self):
+        """
+        Resets the homography and removes it from the store,
+        so it is recomputed from the next frames.
+        """
+        self.reset()
+        if self.store is not None and self.key is not None:
+            self.store.invalidate(self.key)
 
     def double_stitch(self, img1, img2, img3): # pylint: disable=unused-argument, no-self-use
         """
@@ -51,82 +291,129 @@ class Stitcher(object):
         """
         raise Exception('Not implemented')
 
-def compute_matches(frame1, frame2):
+def compute_matches(frame1, frame2, backend=None, masks=(None, None)):
     """
-    Computes the keypoint matches between the provided frames.
+    Computes the keypoint matches between the provided frames
+    with the named feature backend (see features.get_backend).
+    Detection in each frame is limited to the nonzero pixels of its mask.
     """
+    backend = get_backend(backend)
 
-    # Initialize the SURF detector
-    surf = cv2.xfeatures2d.SURF_create()
+    # Extracts the keypoints and descriptors with the backend's reused detector
+    keypoints1, descriptors1 = backend.detect(frame1, masks[0])
+    keypoints2, descriptors2 = backend.detect(frame2, masks[1])
 
-    # Extracts the keypoints and descriptors via SURF
-    keypoints1, descriptors1 = surf.detectAndCompute(frame1, None)
-    keypoints2, descriptors2 = surf.detectAndCompute(frame2, None)
+    # Computes matches using the backend's reused matcher
+    matches = backend.match(descriptors1, descriptors2)
 
-    # Initializes parameters for Flann-based matcher
-    flann_index_kdtree = 0
-    index_params = dict(algorithm=flann_index_kdtree, trees=5)
-    search_params = dict(checks=50)
+    return matches, keypoints1, keypoints2
+
+def match_points(matches, keypoints1, keypoints2, ratio=0.7):
+    """
+    Returns the points of both frames for the matches that pass Lowe's ratio test,
+    as two Nx2 arrays. Matches without a second nearest neighbour are discarded.
+    """
+    pairs = [pair for pair in matches if len(pair) == 2]
+    if not pairs:
+        return np.zeros((0, 2), np.float32), np.zeros((0, 2), np.float32)
 
-    # Initializes the Flann-based matcher object
-    flann = cv2.FlannBasedMatcher(index_params, search_params)
+    fields = np.array([(first.queryIdx, first.trainIdx, first.distance, second.distance)
+                       for first, second in pairs], dtype=np.float64)
+    good = fields[:, 2] < ratio * fields[:, 3]
+    points1 = cv2.KeyPoint_convert(keypoints1)[fields[good, 0].astype(np.intp)]
+    points2 = cv2.KeyPoint_convert(keypoints2)[fields[good, 1].astype(np.intp)]
+    return points1.reshape(-1, 2), points2.reshape(-1, 2)
 
-    # Computes matches using Flann matcher
-    matches = flann.knnMatch(descriptors1, descriptors2, k=2)
+def get_pyramid_level(frame, min_width=MIN_DETECTION_WIDTH):
+    """
+    Returns the grayscale pyramid level of the frame used for feature detection,
+    the smallest one that is still at least min_width wide, along with its scale.
+    """
+    if frame.ndim == 3:
+        frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    scale = 1.0
+    while frame.shape[1] >= 2 * min_width:
+        frame = cv2.pyrDown(frame)
+        scale /= 2
+    return frame, scale
 
-    return matches, keypoints1, keypoints2
+def get_overlap_masks(shape1, shape2, overlap=DEFAULT_OVERLAP):
+    """
+    Returns detection masks limited to the expected overlap of two frames, the right
+    part of the first frame and the left part of the second, each overlap wide
+    as a fraction of the frame width. Returns no masks if overlap is None.
+    """
+    if overlap is None:
+        return None, None
+    mask1 = np.zeros(shape1[:2], np.uint8)
+    mask2 = np.zeros(shape2[:2], np.uint8)
+    mask1[:, int(shape1[1] * (1 - overlap)):] = 255
+    mask2[:, :int(np.ceil(shape2[1] * overlap))] = 255
+    return mask1, mask2
 
-def compute_homography(frame1, frame2):
+def estimate_homography(frame1, frame2, backend=None, overlap=DEFAULT_OVERLAP):
     """
-    Computes homography based on the provided frames.
+    Estimates the homography between the provided frames.
+    Features are detected on downscaled grayscale pyramid levels of the frames,
+    limited to their expected overlap, and the homography is rescaled to full resolution.
+    Returns a HomographyEstimate, or None if the frames do not have enough matches.
     """
     min_match_count = 20
-    matches, keypoints1, keypoints2 = compute_matches(frame1, frame2)
+    level1, scale1 = get_pyramid_level(frame1)
+    level2, scale2 = get_pyramid_level(frame2)
+    masks = get_overlap_masks(level1.shape, level2.shape, overlap)
+    matches, keypoints1, keypoints2 = compute_matches(level1, level2, backend, masks)
 
     # Store all the good matches based on Lowes ratio test
-    good_matches = []
-    for match1, match2 in matches:
-        if match1.distance < 0.7 * match2.distance:
-            good_matches.append(match1)
+    src_pts, dst_pts = match_points(matches, keypoints1, keypoints2)
 
-    if len(good_matches) > min_match_count:
+    if len(src_pts) <= min_match_count:
+        # TextFormatter.print_error("Images do not have enough matches to produce homography.")
         # TextFormatter.print_info("Found %d matches. We need at least %d matches."
-        #                          % (len(good_matches), min_match_count))
-        src_pts = np.float32([keypoints1[good_match.queryIdx].pt
-                              for good_match in good_matches]).reshape(-1, 1, 2)
-        dst_pts = np.float32([keypoints2[good_match.trainIdx].pt
-                              for good_match in good_matches]).reshape(-1, 1, 2)
+        #                          % (len(src_pts), min_match_count))
+        return None
 
-        homography, _ = cv2.findHomography(src_pts, dst_pts, cv2.RANSAC, 5.0)
+    # Points on the pyramid levels are mapped back to full resolution.
+    # The inlier threshold is scaled with them, as it applies to the detection resolution.
+    src_pts /= scale1
+    dst_pts /= scale2
+    homography, mask = cv2.findHomography(src_pts, dst_pts, cv2.RANSAC,
+                                          INLIER_THRESHOLD / min(scale1, scale2))
+    if homography is None:
+        return None
+    return HomographyEstimate(homography, src_pts, dst_pts, mask.ravel() > 0)
 
-        return homography
-    else:
-        # TextFormatter.print_error("Images do not have enough matches to produce homography.")
-        # TextFormatter.print_info("Found %d matches. We need at least %d matches."
-        #                          % (len(good_matches), min_match_count))
+def compute_homography(frame1, frame2, backend=None, overlap=DEFAULT_OVERLAP):
+    """
+    Computes homography based on the provided frames.
+    Returns False if the frames do not have enough matches.
+    """
+    estimate = estimate_homography(frame1, frame2, backend, overlap)
+    if estimate is None:
         return False
+    return estimate.homography
 
-def warp_images(img1, img2, homography):
+def get_inlier_mask(homography, src_pts, dst_pts, threshold=INLIER_THRESHOLD):
     """
-    Warps second image to plane of first image based on provided homography.
+    Returns the mask of the matched points the homography maps within the threshold.
     """
-    rows1, cols1 = img1.shape[:2]
-    rows2, cols2 = img2.shape[:2]
-
-    point_list1 = np.float32([[0, 0], [0, rows1], [cols1, rows1], [cols1, 0]]).reshape(-1, 1, 2)
-    temp_points = np.float32([[0, 0], [0, rows2], [cols2, rows2], [cols2, 0]]).reshape(-1, 1, 2)
-    point_list2 = cv2.perspectiveTransform(temp_points, homography)
-    combined_point_list = np.concatenate((point_list1, point_list2), axis=0)
+    if homography is None or homography is False or len(src_pts) == 0:
+        return np.zeros(len(src_pts), bool)
+    projected = cv2.perspectiveTransform(src_pts.reshape(-1, 1, 2), homography)
+    return np.linalg.norm(projected.reshape(-1, 2) - dst_pts, axis=1) < threshold
 
-    [x_min, y_min] = np.int32(combined_point_list.min(axis=0).ravel() - 0.5)
-    [x_max, y_max] = np.int32(combined_point_list.max(axis=0).ravel() + 0.5)
-    translation_dist = [-x_min, -y_min]
-    homography_translation = np.array([[1, 0, translation_dist[0]],
-                                       [0, 1, translation_dist[1]], [0, 0, 1]])
-
-    output_img = cv2.warpPerspective(img2, homography_translation.dot(homography), # pylint: disable=no-member
-                                     (x_max-x_min, y_max-y_min))
-    output_img[translation_dist[1]:rows1+translation_dist[1],
-               translation_dist[0]:cols1+translation_dist[0]] = img1
+def count_inliers(homography, src_pts, dst_pts, threshold=INLIER_THRESHOLD):
+    """
+    Returns the number of matched points the homography maps within the threshold.
+    """
+    return int(np.count_nonzero(get_inlier_mask(homography, src_pts, dst_pts, threshold)))
 
-    return output_img
+def warp_images(img1, img2, homography, blend=None):
+    """
+    Warps second image to plane of first image based on provided homography,
+    blending the seam with the named blender if one is provided.
+    Builds a one-off warp plan, so repeated warps with the same homography
+    should go through Stitcher, which keeps its plan.
+    """
+    plan = set_blender(build_warp_plan(img1.shape, img2.shape, homography), blend)
+    return plan.render([img2, img1]).copy()
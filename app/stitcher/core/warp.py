@@ -0,0 +1,338 @@
+"""
+This module encapsulates precomputed warps that render frames into a reusable canvas.
+"""
+from __future__ import absolute_import, division, print_function
+
+import functools
+import numpy as np
+import cv2
+
+# Width of the low resolution canvas the valid region of a canvas is searched on.
+CROP_PREVIEW_WIDTH = 480
+
+# Number of horizontal bands a canvas is split into when rendered by a pool of threads.
+# Keeping more bands than threads lets threads done with cheap bands pick up the rest.
+RENDER_BANDS = 32
+
+# Minimum height in pixels of the bands a canvas is split into.
+MIN_BAND_HEIGHT = 16
+
+class Tile(object):
+    """
+    Renders a source frame into a fixed region of a canvas.
+    Without remap tables the frame is copied into the region as is.
+    """
+
+    def __init__(self, x, y, width, height, map1=None, map2=None):
+        self.x = x
+        self.y = y
+        self.width = width
+        self.height = height
+        self.map1 = map1
+        self.map2 = map2
+
+    def get_region(self, canvas):
+        """
+        Returns the view of the canvas the tile renders into.
+        """
+        return canvas[self.y:self.y + self.height, self.x:self.x + self.width]
+
+    def render(self, frame, canvas, top=None, bottom=None):
+        """
+        Renders the frame into the canvas, or only into the canvas rows from top to bottom
+        if they are provided. Canvas pixels that the frame does not cover are left untouched.
+        """
+        top = self.y if top is None else max(top, self.y)
+        bottom = self.y + self.height if bottom is None else min(bottom, self.y + self.height)
+        if top >= bottom:
+            return
+        region = canvas[top:bottom, self.x:self.x + self.width]
+        rows = slice(top - self.y, bottom - self.y)
+        if self.map1 is None:
+            np.copyto(region, frame[rows])
+        else:
+            cv2.remap(frame, self.map1[rows], self.map2[rows], cv2.INTER_LINEAR, dst=region,
+                      borderMode=cv2.BORDER_TRANSPARENT)
+
+    def crop(self, bounds):
+        """
+        Returns a tile rendering the part of this tile within the canvas bounds
+        (x_min, y_min, x_max, y_max) into a canvas covering just these bounds,
+        or None if the tile misses them.
+        """
+        x_min, y_min, x_max, y_max = bounds
+        left, top = max(self.x, x_min), max(self.y, y_min)
+        right, bottom = min(self.x + self.width, x_max), min(self.y + self.height, y_max)
+        if left >= right or top >= bottom:
+            return None
+
+        if self.map1 is None:
+            xs, ys = np.meshgrid(np.arange(left - self.x, right - self.x, dtype=np.float32),
+                                 np.arange(top - self.y, bottom - self.y, dtype=np.float32))
+            map1, map2 = cv2.convertMaps(xs, ys, cv2.CV_16SC2)
+        else:
+            window = (slice(top - self.y, bottom - self.y), slice(left - self.x, right - self.x))
+            map1 = np.ascontiguousarray(self.map1[window])
+            map2 = np.ascontiguousarray(self.map2[window])
+        return Tile(left - x_min, top - y_min, right - left, bottom - top, map1, map2)
+
+    @staticmethod
+    def from_translation(x, y, shape):
+        """
+        Returns a tile copying a frame of the provided shape to (x, y).
+        """
+        return Tile(x, y, shape[1], shape[0])
+
+    @staticmethod
+    def from_homography(homography, shape, canvas_size):
+        """
+        Returns a tile warping a frame of the provided shape into a canvas of the
+        provided size with the homography. Returns None if the frame misses the canvas.
+        """
+        x_min, y_min, x_max, y_max = get_bounds(homography, shape)
+        x_min, y_min = max(x_min, 0), max(y_min, 0)
+        x_max, y_max = min(x_max, canvas_size[0]), min(y_max, canvas_size[1])
+        if x_min >= x_max or y_min >= y_max:
+            return None
+
+        map1, map2 = build_homography_maps(homography, (x_min, y_min, x_max, y_max))
+        return Tile(x_min, y_min, x_max - x_min, y_max - y_min, map1, map2)
+
+class CanvasPlan(object):
+    """
+    Fixed canvas geometry with one tile per frame, built for frames of the provided shapes.
+    Tiles are rendered in the provided order of frame indices, or in frame order by default,
+    so later tiles are drawn over earlier ones.
+    Frames are rendered into a canvas that is allocated once and reused for every frame,
+    so a rendered canvas is only valid until the next call to render.
+    If a blender is set (see blending.set_blender), it then blends the overlaps of the tiles.
+
+    Canvases can be rendered by a pool of threads, as OpenCV releases the GIL while it warps.
+    Threads render disjoint horizontal bands of the canvas, each drawing every tile
+    in order, so they never write to the same pixels.
+    """
+
+    def __init__(self, size, tiles, shapes=None, order=None):
+        self.size = size
+        self.tiles = tiles
+        self.shapes = shapes
+        self.order = list(range(len(tiles))) if order is None else list(order)
+        self.canvas = np.zeros((size[1], size[0], 3), np.uint8)
+        self.blender = None
+        self.bands = get_bands(size[1])
+
+    def render(self, frames, pool=None):
+        """
+        Renders the frames into the canvas and returns it.
+        If a thread pool is provided, bands of the canvas are rendered concurrently.
+        """
+        if pool is None:
+            self.render_band(frames, (None, None))
+        else:
+            pool.map(functools.partial(self.render_band, frames), self.bands, chunksize=1)
+        if self.blender is not None:
+            self.blender.blend(frames, self.canvas)
+        return self.canvas
+
+    def render_band(self, frames, band):
+        """
+        Renders the frames into the canvas rows (top, bottom) of the band.
+        """
+        top, bottom = band
+        for index in self.order:
+            if self.tiles[index] is not None:
+                self.tiles[index].render(frames[index], self.canvas, top, bottom)
+
+    def get_coverages(self):
+        """
+        Returns, for each tile, the mask of the pixels of its region its frame covers.
+        """
+        scratch = np.zeros_like(self.canvas)
+        coverages = []
+        for tile, shape in zip(self.tiles, self.shapes):
+            if tile is None:
+                coverages.append(None)
+                continue
+            tile.render(np.full(shape, 255, np.uint8), scratch)
+            region = tile.get_region(scratch)
+            coverages.append(np.uint8(region[..., 0] > 0))
+            region[...] = 0
+        return coverages
+
+    def get_valid_crop(self, aspect):
+        """
+        Returns the largest rectangle (x, y, width, height) of the provided aspect ratio
+        covered by frames, closest to the center of the canvas, in pixel edge coordinates.
+        Pixels at the edges of the frames are left out, as they may only be partly covered.
+        Returns the whole canvas if no frame covers it.
+        """
+        covered = np.zeros(self.canvas.shape[:2], np.uint8)
+        for tile, coverage in zip(self.tiles, self.get_coverages()):
+            if tile is not None:
+                np.maximum(tile.get_region(covered), coverage, out=tile.get_region(covered))
+        covered = cv2.erode(covered, np.ones((3, 3), np.uint8), borderValue=0)
+        integral = cv2.integral(1 - covered)
+
+        best = None
+        low, high = 1, covered.shape[0]
+        while low <= high:
+            height = (low + high) // 2
+            window = find_uncovered_window(integral, int(np.ceil(height * aspect)), height)
+            if window is None:
+                high = height - 1
+            else:
+                best = (window[0], window[1], height * aspect, height)
+                low = height + 1
+        if best is None:
+            return (0, 0) + tuple(self.size)
+        return best
+
+def get_bands(height):
+    """
+    Returns the rows (top, bottom) of the bands a canvas of the provided height is split into
+    for rendering by a pool of threads.
+    """
+    count = max(1, min(RENDER_BANDS, height // MIN_BAND_HEIGHT))
+    edges = [height * index // count for index in range(count + 1)]
+    return list(zip(edges[:-1], edges[1:]))
+
+def find_uncovered_window(integral, width, height):
+    """
+    Returns the position of the window of the provided size with no uncovered pixels
+    closest to the center, given the integral image of the uncovered pixels,
+    or None if every window has some.
+    """
+    rows, cols = integral.shape[0] - 1, integral.shape[1] - 1
+    if width > cols or height > rows:
+        return None
+    sums = (integral[height:, width:] - integral[:-height, width:] -
+            integral[height:, :-width] + integral[:-height, :-width])
+    ys, xs = np.nonzero(sums == 0)
+    if len(xs) == 0:
+        return None
+    closest = np.argmin((2 * xs + width - cols) ** 2 + (2 * ys + height - rows) ** 2)
+    return xs[closest], ys[closest]
+
+def get_crop_transform(crop, size):
+    """
+    Returns the transform mapping the rectangle (x, y, width, height) of a canvas,
+    in pixel edge coordinates, to an output canvas of the provided size.
+    """
+    x, y, width, height = crop
+    scale_x, scale_y = size[0] / width, size[1] / height
+    return np.array([[scale_x, 0, (0.5 - x) * scale_x - 0.5],
+                     [0, scale_y, (0.5 - y) * scale_y - 0.5],
+                     [0, 0, 1]], dtype=np.float64)
+
+def get_preview_size(size):
+    """
+    Returns the size of the low resolution canvas the valid region of a canvas
+    of the provided size is searched on.
+    """
+    scale = min(1.0, CROP_PREVIEW_WIDTH / size[0])
+    return max(int(round(size[0] * scale)), 1), max(int(round(size[1] * scale)), 1)
+
+def get_corners(shape):
+    """
+    Returns the corner points of a frame of the provided shape.
+    """
+    rows, cols = shape[:2]
+    return np.float32([[0, 0], [0, rows], [cols, rows], [cols, 0]]).reshape(-1, 1, 2)
+
+def get_bounds(homography, shape):
+    """
+    Returns the integer bounding box (x_min, y_min, x_max, y_max)
+    of a frame of the provided shape warped with the homography.
+    """
+    points = cv2.perspectiveTransform(get_corners(shape), homography)
+    [x_min, y_min] = np.int32(points.min(axis=0).ravel() - 0.5)
+    [x_max, y_max] = np.int32(points.max(axis=0).ravel() + 0.5)
+    return x_min, y_min, x_max, y_max
+
+def build_homography_maps(homography, bounds):
+    """
+    Builds fixed-point remap tables sampling the source of the homography
+    for every canvas pixel in the bounds. Pixels mapping from behind the source plane
+    are pointed outside the source so they are left untouched.
+    """
+    x_min, y_min, x_max, y_max = bounds
+    xs, ys = np.meshgrid(np.arange(x_min, x_max, dtype=np.float64),
+                         np.arange(y_min, y_max, dtype=np.float64))
+    inverse = np.linalg.inv(homography)
+    denominator = inverse[2, 0] * xs + inverse[2, 1] * ys + inverse[2, 2]
+    valid = denominator > 1e-9
+    denominator[~valid] = 1.0
+    map_x = (inverse[0, 0] * xs + inverse[0, 1] * ys + inverse[0, 2]) / denominator
+    map_y = (inverse[1, 0] * xs + inverse[1, 1] * ys + inverse[1, 2]) / denominator
+    map_x[~valid] = -1
+    map_y[~valid] = -1
+    return cv2.convertMaps(np.float32(np.clip(map_x, -1, 32767)),
+                           np.float32(np.clip(map_y, -1, 32767)), cv2.CV_16SC2)
+
+def chain_homographies(homographies, reference):
+    """
+    Returns the homographies mapping each of a row of frames to the plane of the reference
+    frame, given the homographies mapping each frame to the plane of the next one.
+    """
+    transforms = [None] * (len(homographies) + 1)
+    transforms[reference] = np.eye(3)
+    for index in range(reference - 1, -1, -1):
+        transforms[index] = transforms[index + 1].dot(homographies[index])
+    for index in range(reference + 1, len(transforms)):
+        transforms[index] = transforms[index - 1].dot(np.linalg.inv(homographies[index - 1]))
+    return transforms
+
+def build_composite_plan(shapes, homographies, reference=None, size=None):
+    """
+    Returns the plan mapping a row of frames of the provided shapes, ordered left to right,
+    to the plane of the reference frame, each in a single warp into a shared canvas.
+    Each homography maps a frame to the plane of the next one. The reference defaults to
+    the middle frame, and is pasted over the others as is. Frames closer to the reference
+    are rendered over farther ones.
+
+    If an output size is provided, the largest region of the canvas of the same aspect ratio
+    covered by frames is rendered straight at that size instead, so the canvas has
+    no empty borders and needs no resizing.
+    """
+    if reference is None:
+        reference = len(shapes) // 2
+    transforms = chain_homographies(homographies, reference)
+
+    rows, cols = shapes[reference][:2]
+    bounds = [get_bounds(transform, shape) for transform, shape in zip(transforms, shapes)]
+    x_min = min([0] + [bound[0] for bound in bounds])
+    y_min = min([0] + [bound[1] for bound in bounds])
+    x_max = max([cols] + [bound[2] for bound in bounds])
+    y_max = max([rows] + [bound[3] for bound in bounds])
+    translation = np.array([[1, 0, -x_min], [0, 1, -y_min], [0, 0, 1]], dtype=np.float64)
+
+    canvas_size = (x_max - x_min, y_max - y_min)
+    order = sorted(range(len(shapes)), key=lambda index: -abs(index - reference))
+    if size is None:
+        tiles = [Tile.from_translation(-x_min, -y_min, shape) if index == reference else
+                 Tile.from_homography(translation.dot(transform), shape, canvas_size)
+                 for index, (transform, shape) in enumerate(zip(transforms, shapes))]
+        return CanvasPlan(canvas_size, tiles, tuple(shapes), order)
+
+    # The valid region is searched on a low resolution rendering of the canvas.
+    transforms = [translation.dot(transform) for transform in transforms]
+    preview_size = get_preview_size(canvas_size)
+    preview = get_crop_transform((0, 0) + canvas_size, preview_size)
+    preview_plan = CanvasPlan(preview_size, [
+        Tile.from_homography(preview.dot(transform), shape, preview_size)
+        for transform, shape in zip(transforms, shapes)], tuple(shapes))
+    crop = preview_plan.get_valid_crop(size[0] / size[1])
+    scale = canvas_size[0] / preview_size[0]
+    output = get_crop_transform([value * scale for value in crop], size)
+    tiles = [Tile.from_homography(output.dot(transform), shape, size)
+             for transform, shape in zip(transforms, shapes)]
+    return CanvasPlan(tuple(size), tiles, tuple(shapes), order)
+
+def build_warp_plan(shape1, shape2, homography, size=None):
+    """
+    Returns the plan warping a second frame to the plane of a first frame with the
+    homography and pasting the first frame over it. Frames are rendered in the order
+    (second frame, first frame). If an output size is provided, the region covered by
+    both frames is rendered straight at that size (see build_composite_plan).
+    """
+    return build_composite_plan((shape2, shape1), [homography], 1, size)
@@ -0,0 +1,105 @@
+"""
+Calibration profile module for storing per-camera distortion calibrations
+and their precomputed remap tables.
+"""
+from __future__ import absolute_import, division, print_function
+
+import os
+import numpy as np
+import yaml
+
+DEFAULT_CALIBRATION_DIR = "config/calibration"
+
+class CalibrationProfile(object):
+    """
+    Calibration of a single camera, identified by its index or serial.
+    Profiles are stored as <camera>.yml in the calibration directory, and the
+    remap tables derived from them as memory-mappable .npy files next to it.
+    """
+
+    def __init__(self, camera, camera_matrix, distortion_coefficients,
+                 image_size=None, rms=None, directory=DEFAULT_CALIBRATION_DIR):
+        self.camera = str(camera)
+        self.camera_matrix = np.array(camera_matrix, dtype=np.float64).reshape(3, 3)
+        self.distortion_coefficients = np.array(distortion_coefficients,
+                                                dtype=np.float64).ravel()
+        self.image_size = tuple(image_size) if image_size is not None else None
+        self.rms = rms
+        self.directory = directory
+
+    @staticmethod
+    def get_path(camera, directory=DEFAULT_CALIBRATION_DIR):
+        """
+        Returns the path of the profile for the provided camera.
+        """
+        return os.path.join(directory, "%s.yml" % camera)
+
+    @staticmethod
+    def load(camera, directory=DEFAULT_CALIBRATION_DIR):
+        """
+        Loads the profile of the provided camera. Returns None if the camera has no profile.
+        """
+        path = CalibrationProfile.get_path(camera, directory)
+        if camera is None or not os.path.isfile(path):
+            return None
+        with open(path, 'r') as profile_file:
+            profile = yaml.safe_load(profile_file)
+        return CalibrationProfile(camera, profile['camera_matrix'],
+                                  profile['distortion_coefficients'],
+                                  profile.get('image_size'), profile.get('rms'), directory)
+
+    def save(self):
+        """
+        Writes the profile to the calibration directory.
+        Previously stored remap tables are discarded since they no longer match.
+        """
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        self.clear_maps()
+        profile = {
+            'camera': self.camera,
+            'rms': None if self.rms is None else float(self.rms),
+            'image_size': None if self.image_size is None else [int(x) for x in self.image_size],
+            'camera_matrix': self.camera_matrix.tolist(),
+            'distortion_coefficients': self.distortion_coefficients.tolist(),
+        }
+        with open(CalibrationProfile.get_path(self.camera, self.directory), 'w') as profile_file:
+            yaml.safe_dump(profile, profile_file, default_flow_style=None)
+
+    def get_maps_paths(self, input_size, output_size):
+        """
+        Returns the paths of the two remap tables for the input and output sizes.
+        """
+        prefix = os.path.join(self.directory, "%s.%dx%d.%dx%d" % (
+            (self.camera,) + tuple(input_size) + tuple(output_size)))
+        return prefix + ".map1.npy", prefix + ".map2.npy"
+
+    def load_maps(self, input_size, output_size):
+        """
+        Memory-maps the stored remap tables for the input and output sizes.
+        Returns None if no tables were stored for these sizes.
+        """
+        paths = self.get_maps_paths(input_size, output_size)
+        if not all(os.path.isfile(path) for path in paths):
+            return None
+        return tuple(np.load(path, mmap_mode='r') for path in paths)
+
+    def save_maps(self, input_size, output_size, maps):
+        """
+        Stores remap tables for the input and output sizes.
+        """
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        for path, table in zip(self.get_maps_paths(input_size, output_size), maps):
+            np.save(path, table)
+
+    def clear_maps(self):
+        """
+        Removes all remap tables stored for the camera.
+        """
+        if not os.path.isdir(self.directory):
+            return
+        prefix = "%s." % self.camera
+        for filename in os.listdir(self.directory):
+            if filename.startswith(prefix) and filename.endswith(".npy"):
+                os.remove(os.path.join(self.directory, filename))
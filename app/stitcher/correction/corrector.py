@@ -1,39 +1,165 @@
 """
 Distortion corrector module for providing functionality to correct a distorted image.
 """
+from __future__ import absolute_import, division, print_function
+
+from collections import OrderedDict
+import threading
 import numpy as np
 import cv2
+from .calibration import CalibrationProfile, DEFAULT_CALIBRATION_DIR
+
+# These are the fallback calibration parameters for cameras without a calibration profile,
+# derived from the radial distortion correction calibration.
+# To calibrate a camera, run app/util/calibrate.py, which writes a profile
+# for each camera to the calibration directory.
+#
+# RMS: 2.40806793018
+# camera matrix:
+#  [[  6.11968871e+02   0.00000000e+00   1.15939403e+03]
+#  [  0.00000000e+00   6.03873075e+02   8.71465543e+02]
+#  [  0.00000000e+00   0.00000000e+00   1.00000000e+00]]
+# distortion coefficients:  [-0.13851498  0.01500291 -0.00039581 -0.00014884 -0.00065915]
+# [-0.13851498  0.01500291  0.          0.          0.        ]
+#
+# CAMERA_MATRIX = np.array([[6.11968871e+02,
+#                            0, 1.15939403e+03],
+#                           [0, 6.03873075e+02, 8.71465543e+02], [0, 0, 1]])
+# DISTORTION_COEFFICIENTS = np.array([-0.13851498, 0.01500291, 0, 0, 0])
+
+CAMERA_MATRIX = np.array([[857.48296979,
+                           0, 968.06224829],
+                          [0, 876.71824265, 556.37145899], [0, 0, 1]])
+DISTORTION_COEFFICIENTS = np.array([-2.57614020e-01, 8.77086999e-02, 0, 0, 0])
 
-def correct_distortion(image):
+class Corrector(object):
     """
-    This function corrects the distortion of a radially-distorted
-    input image based on pre-determined, hard-coded distortion correction parameters.
+    Corrects radial distortion with remap tables that are built once per
+    (camera, input resolution) and kept in a bounded least-recently-used cache.
+
+    Cameras are calibrated by their profile in the calibration directory when one exists,
+    and by the provided fallback parameters otherwise. Remap tables of profiled cameras
+    are stored next to the profile and memory-mapped on later runs.
+    """
+
+    def __init__(self, camera_matrix=CAMERA_MATRIX,
+                 distortion_coefficients=DISTORTION_COEFFICIENTS, cache_size=8,
+                 profile_dir=DEFAULT_CALIBRATION_DIR):
+        self.camera_matrix = camera_matrix
+        self.distortion_coefficients = distortion_coefficients
+        self.cache_size = cache_size
+        self.profile_dir = profile_dir
+        self.profiles = {}
+        self.maps = OrderedDict()
+        self.lock = threading.Lock()
+
+    def correct(self, image, camera=None, width=None, dst=None):
+        """
+        Corrects the radial distortion of the provided image.
+        The camera argument is the index or serial of the camera the image comes from.
+        If a width is provided, the image is downscaled to that width in the same remap.
+        If a destination buffer of the output shape is provided, the image is corrected
+        into it instead of a new array.
+        """
+        map1, map2 = self.get_maps(camera, image.shape[:2], width)
+        return cv2.remap(image, map1, map2, cv2.INTER_LINEAR, dst=dst)
+
+    def get_profile(self, camera):
+        """
+        Returns the calibration profile of the camera, or None if it has none.
+        """
+        if camera not in self.profiles:
+            if self.profile_dir is None:
+                self.profiles[camera] = None
+            else:
+                self.profiles[camera] = CalibrationProfile.load(camera, self.profile_dir)
+        return self.profiles[camera]
+
+    def get_maps(self, camera, shape, width=None):
+        """
+        Returns the cached remap tables for the camera, image shape and output width,
+        building them if they are not cached yet.
+        """
+        input_size = (shape[1], shape[0])
+        key = (camera, input_size, get_output_size(input_size, width))
+        with self.lock:
+            maps = self.maps.pop(key, None)
+            if maps is None:
+                maps = self.load_maps(*key)
+            self.maps[key] = maps
+            while len(self.maps) > self.cache_size:
+                self.maps.popitem(last=False)
+        return maps
 
-    These are calibration parameters derived
-    from the radial distortion correction calibration.
-    For a new set of parameters, run the calibration in the calibrate folder
-    and pull the parameters from the program result.
+    def load_maps(self, camera, input_size, output_size):
+        """
+        Returns the remap tables of the camera for the input and output sizes, mapping in
+        the tables stored with its profile or building and storing them if there are none.
+        """
+        profile = self.get_profile(camera)
+        if profile is None:
+            return self.build_maps(self.camera_matrix, self.distortion_coefficients,
+                                   input_size, output_size)
 
-    RMS: 2.40806793018
-    camera matrix:
-     [[  6.11968871e+02   0.00000000e+00   1.15939403e+03]
-     [  0.00000000e+00   6.03873075e+02   8.71465543e+02]
-     [  0.00000000e+00   0.00000000e+00   1.00000000e+00]]
-    distortion coefficients:  [-0.13851498  0.01500291 -0.00039581 -0.00014884 -0.00065915]
-    [-0.13851498  0.01500291  0.          0.          0.        ]
+        maps = profile.load_maps(input_size, output_size)
+        if maps is None:
+            camera_matrix = profile.camera_matrix
+            if profile.image_size is not None:
+                camera_matrix = scale_camera_matrix(camera_matrix, profile.image_size,
+                                                    input_size)
+            maps = self.build_maps(camera_matrix, profile.distortion_coefficients,
+                                   input_size, output_size)
+            profile.save_maps(input_size, output_size, maps)
+        return maps
 
+    @staticmethod
+    def build_maps(camera_matrix, distortion_coefficients, input_size, output_size):
+        """
+        Builds fixed-point remap tables that undistort an image of the input size
+        and sample it directly at the output size.
+        """
+        return cv2.initUndistortRectifyMap(camera_matrix, distortion_coefficients, None,
+                                           scale_camera_matrix(camera_matrix,
+                                                               input_size, output_size),
+                                           output_size, cv2.CV_16SC2)
+
+    def clear(self):
+        """
+        Drops all cached remap tables and profiles.
+        """
+        with self.lock:
+            self.maps.clear()
+            self.profiles.clear()
+
+def get_output_size(input_size, width=None):
+    """
+    Returns the output size for an input size resized to the provided width,
+    keeping the aspect ratio in the same way as imutils.resize.
     """
-    # camera_matrix = np.array([[6.11968871e+02,
-    #                            0, 1.15939403e+03],
-    #                           [0, 6.03873075e+02, 8.71465543e+02], [0, 0, 1]])
-    # distortion_coefficients = np.array([-0.13851498, 0.01500291, 0, 0, 0])
+    if width is None or width == input_size[0]:
+        return input_size
+    return (width, int(input_size[1] * (width / float(input_size[0]))))
 
-    camera_matrix = np.array([[857.48296979,
-                               0, 968.06224829],
-                              [0, 876.71824265, 556.37145899], [0, 0, 1]])
-    distortion_coefficients = np.array([-2.57614020e-01, 8.77086999e-02, 0, 0, 0])
+def scale_camera_matrix(camera_matrix, input_size, output_size):
+    """
+    Returns the camera matrix rescaled from the input size to the output size.
+    """
+    scaled_matrix = np.array(camera_matrix, dtype=np.float64)
+    for axis in range(2):
+        scale = output_size[axis] / float(input_size[axis])
+        scaled_matrix[axis, axis] *= scale
+        scaled_matrix[axis, 2] = (scaled_matrix[axis, 2] + 0.5) * scale - 0.5
+    return scaled_matrix
 
-    # Correct the radial distortion
-    corrected_image = cv2.undistort(image, camera_matrix, distortion_coefficients)
+DEFAULT_CORRECTOR = Corrector()
 
-    return corrected_image
+def correct_distortion(image, camera=None, width=None):
+    """
+    This function corrects the distortion of a radially-distorted
+    input image based on the calibration profile of the camera, or on pre-determined,
+    hard-coded distortion correction parameters if the camera has no profile.
+
+    The undistortion maps are cached by the shared default corrector,
+    so repeated calls for the same camera and resolution only pay for a remap.
+    """
+    return DEFAULT_CORRECTOR.correct(image, camera, width)
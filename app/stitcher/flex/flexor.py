@@ -14,8 +14,7 @@ def main():
     """
     video = VideoFeed("app/storage/flex/naiveflex.mp4")
     if video.is_valid():
-        while video.has_next():
-            frame = video.get_next(True, False)
+        for frame in video:
             average_frame_color = get_average_color(frame)
             zero_array = np.array([0, 0, 0])
 
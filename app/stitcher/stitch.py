@@ -5,28 +5,53 @@ Module for correcting and stitching frames and feeds. Used as a driver from the
 from __future__ import absolute_import, division, print_function
 
 import argparse
+import functools
 import signal
 
+from app.util.configure import get_configuration
 from app.util.feed import CameraFeed
+from app.util.grabber import CAPTURE_POLICIES, OVERFLOW_POLICIES
+from app.util.textformatter import TextFormatter
 
-from .core.feedhandler import MultiFeedHandler
+from .core.feedhandler import MultiFeedHandler, PipelineFeedHandler
+from .core.blending import BLENDERS
+from .core.features import DETECTORS, MATCHERS, get_backend
+from .core.homographystore import HomographyStore
+from .core.pipeline import is_pipeline_supported
+from .core.projection import PROJECTIONS, is_valid_size
 
-def main():
+def main(): # pylint: disable=too-many-statements
     """
     Responsible for handling stitch call from the command line.
     """
     opts = parse_args()
 
     if opts.use_config:
-        config = opts.config_profile
-        should_preview = config['just_preview']
+        if opts.config_profile:
+            config = get_configuration(opts.config_profile)
+        else:
+            config = get_configuration()
+        should_preview = config['just-preview']
         width = config['width']
         height = config['height']
-        index = config['camera_index']
-        left_index = config['left_index']
-        right_index = config['right_index']
-        dest = config['output_path']
+        index = config['camera-index']
+        left_index = config['left-index']
+        right_index = config['right-index']
+        dest = config['output-path']
         url = config['rtmp_url']
+        feature_backend = (config.get('feature-backend'), config.get('feature-matcher'))
+        reestimate_interval = config.get('reestimate-interval')
+        drift_threshold = config.get('drift-threshold')
+        projection = config.get('projection')
+        blend = config.get('blend')
+        gain_interval = config.get('gain-interval')
+        render_threads = config.get('render-threads')
+        capture_policy = config.get('capture-policy')
+        sync_tolerance = config.get('sync-tolerance')
+        pipeline = config.get('pipeline')
+        preview_fps = config.get('preview-fps')
+        fps = config.get('fps')
+        encoder_policy = config.get('encoder-policy')
     else:
         should_preview = opts.just_preview
         width = opts.width
@@ -36,8 +61,38 @@ def main():
         right_index = opts.right_index
         dest = opts.output_path
         url = opts.rtmp_url
+        feature_backend = (opts.feature_backend, opts.feature_matcher)
+        reestimate_interval = opts.reestimate_interval
+        drift_threshold = opts.drift_threshold
+        projection = opts.projection
+        blend = opts.blend
+        gain_interval = opts.gain_interval
+        render_threads = opts.render_threads
+        capture_policy = opts.capture_policy
+        sync_tolerance = opts.sync_tolerance
+        pipeline = opts.pipeline
+        preview_fps = opts.preview_fps
+        fps = opts.fps
+        encoder_policy = opts.encoder_policy
 
-    handler = get_feedhandler(should_preview, width, height, index, left_index, right_index)
+    if pipeline and not should_preview and not is_pipeline_supported():
+        TextFormatter.print_error("The pipeline needs shared memory, from Python 3.8.")
+        return
+    if projection and not should_preview and not is_valid_size(projection, (width, height)):
+        TextFormatter.print_error("Equirectangular panoramas must be twice as wide as high, "
+                                  "not %dx%d." % (width, height))
+        return
+
+    homography_store = HomographyStore()
+    handler = get_feedhandler(should_preview, width, height, index, left_index, right_index,
+                              homography_store, get_backend(*feature_backend),
+                              reestimate_interval, drift_threshold, projection, blend,
+                              gain_interval, render_threads, capture_policy, sync_tolerance,
+                              pipeline, preview_fps, fps, encoder_policy)
+    if opts.recompute:
+        # Drops the stored homographies of the rig so they are recomputed from the first
+        # frames, keeping those of other rigs.
+        homography_store.invalidate(handler.get_rig_key())
 
     if should_preview:
         preview(handler, width, height)
@@ -67,30 +122,58 @@ def stream_and_record(handler, width, height, dest, url):
     """
     handler.stitch_feeds(True, dest, width, height, url)
 
-def get_feedhandler(should_preview, width, height, preview_index, left_index, right_index): # pylint: disable=too-many-arguments
+def get_feedhandler(should_preview, width, height, preview_index, left_index, right_index, # pylint: disable=too-many-arguments
+                    homography_store=None, feature_backend=None, reestimate_interval=None,
+                    drift_threshold=None, projection=None, blend=None, gain_interval=None,
+                    render_threads=None, capture_policy=None, sync_tolerance=None,
+                    pipeline=False, preview_fps=None, fps=None, encoder_policy=None):
     """
     Get appropriate feed handler
     """
     if should_preview:
-        handler = get_single_handler(width, height, preview_index)
+        handler = get_single_handler(width, height, preview_index, capture_policy, preview_fps,
+                                     fps)
     else:
-        handler = get_multi_handler(width, height, left_index, right_index)
+        handler = get_multi_handler(width, height, left_index, right_index, homography_store,
+                                    feature_backend, reestimate_interval, drift_threshold,
+                                    projection, blend, gain_interval, render_threads,
+                                    capture_policy, sync_tolerance, pipeline, preview_fps,
+                                    fps, encoder_policy)
 
     return handler
 
-def get_single_handler(width, height, index):
+def get_single_handler(width, height, index, capture_policy=None, preview_fps=None, # pylint: disable=too-many-arguments
+                       fps=None):
     """
-    Returns a handler for single stream
+    Returns a handler for single stream.
+    Previewed frames are only ever shown at the output width, so they are
+    undistorted and downscaled in a single pass.
     """
-    return MultiFeedHandler([CameraFeed(index, width, height)])
+    return MultiFeedHandler([CameraFeed(index, width, height, single_pass=True)],
+                            capture_policy=capture_policy, preview_fps=preview_fps, fps=fps)
 
-def get_multi_handler(width, height, left_index, right_index):
+def get_multi_handler(width, height, left_index, right_index, # pylint: disable=too-many-arguments
+                      homography_store=None, feature_backend=None, reestimate_interval=None,
+                      drift_threshold=None, projection=None, blend=None, gain_interval=None,
+                      render_threads=None, capture_policy=None, sync_tolerance=None,
+                      pipeline=False, preview_fps=None, fps=None, encoder_policy=None):
     """
-    Returns a handler for multiple streams
+    Returns a handler for multiple streams, or for a staged pipeline capturing and
+    stitching them in separate processes.
     """
+    if pipeline:
+        factories = [functools.partial(CameraFeed, camera_index, width, height)
+                     for camera_index in (left_index, right_index)]
+        return PipelineFeedHandler(factories, width, "%s-%s" % (left_index, right_index),
+                                   homography_store, feature_backend, reestimate_interval,
+                                   drift_threshold, projection, blend, gain_interval,
+                                   render_threads, preview_fps, fps, encoder_policy)
     left_feed = CameraFeed(left_index, width, height)
     right_feed = CameraFeed(right_index, width, height)
-    return MultiFeedHandler([left_feed, right_feed])
+    return MultiFeedHandler([left_feed, right_feed], homography_store, feature_backend,
+                            reestimate_interval, drift_threshold, projection, blend,
+                            gain_interval, render_threads, capture_policy, sync_tolerance,
+                            preview_fps, fps, encoder_policy)
 
 def parse_args():
     """
@@ -138,6 +221,58 @@ def parse_args():
     parser.add_argument('--url', action='store', type=str, dest='rtmp_url',
                         default="rtmp://54.227.214.22:1935/live/myStream",
                         help='RTMP url to stream to.')
+    parser.add_argument('--features', action='store', type=str, dest='feature_backend',
+                        default=None, choices=sorted(DETECTORS),
+                        help='Feature detector used to compute homographies.')
+    parser.add_argument('--matcher', action='store', type=str, dest='feature_matcher',
+                        default=None, choices=sorted(MATCHERS),
+                        help='Feature matcher used to compute homographies.')
+    parser.add_argument('--reestimate', action='store', type=float,
+                        dest='reestimate_interval', default=None,
+                        help='Interval in seconds between background homography re-estimations.')
+    parser.add_argument('--drift-threshold', action='store', type=float,
+                        dest='drift_threshold', default=None,
+                        help='Drift in pixels of tracked matches that triggers re-estimation.')
+    parser.add_argument('--projection', action='store', type=str, dest='projection',
+                        default=None, choices=PROJECTIONS,
+                        help='Projection of the panorama. Planar if not provided. Equirectangular '
+                        'panoramas must be twice as wide as high.')
+    parser.add_argument('--blend', action='store', type=str, dest='blend',
+                        default=None, choices=sorted(BLENDERS),
+                        help='Blending of the seams. Frames are pasted if not provided.')
+    parser.add_argument('--gain-interval', action='store', type=int,
+                        dest='gain_interval', default=None,
+                        help='Interval in frames between exposure gain estimations.')
+    parser.add_argument('--render-threads', action='store', type=int,
+                        dest='render_threads', default=None,
+                        help='Number of threads warping bands of the panorama concurrently.')
+    parser.add_argument('--capture', action='store', type=str, dest='capture_policy',
+                        default=None, choices=CAPTURE_POLICIES,
+                        help='Capture cameras on background threads, taking the latest frame '
+                        'or draining frames in order.')
+    parser.add_argument('--sync-tolerance', action='store', type=float,
+                        dest='sync_tolerance', default=None,
+                        help='Tolerance in seconds of pairing frames on capture timestamps.')
+    parser.add_argument('--pipeline', action='store_true', default=False, dest='pipeline',
+                        help='Capture and stitch feeds in separate processes connected by '
+                        'shared memory.')
+    parser.add_argument('--fps', action='store', type=float, dest='fps', default=None,
+                        help='Frames per second the stitch loop is paced at, dropping stale '
+                        'frames when it falls behind. Unpaced if not provided.')
+    parser.add_argument('--encoder-drop', action='store', type=str, dest='encoder_policy',
+                        default=None, choices=OVERFLOW_POLICIES,
+                        help='Frames dropped when the stream encoder falls behind: the oldest '
+                        'queued, the newest, or none, blocking stitching. Oldest by default.')
+    parser.add_argument('--preview-fps', action='store', type=float,
+                        dest='preview_fps', default=None,
+                        help='Frames per second of the preview window. 10 by default. '
+                        'Streams run without a preview unless a rate is provided.')
+    parser.add_argument('--headless', action='store_const', const=0, dest='preview_fps',
+                        help='Run without a preview window. Send q to the standard input '
+                        'to quit.')
+    parser.add_argument('--recompute', action='store_true',
+                        default=False, dest='recompute',
+                        help='Invalidate the stored homographies of the rig and recompute them.')
     parser.add_argument('--default', action='store_true',
                         default=False, dest='use_config',
                         help='Use configuration values.')
@@ -103,9 +103,8 @@ def correct_single_frame(frame):
     """
     Function to correct distortion on a single frame/image.
     """
-    corrected_frame = correct_distortion(frame)
     resized_frame = imutils.resize(frame, 400)
-    resized_corrected_frame = imutils.resize(corrected_frame, 400)
+    resized_corrected_frame = correct_distortion(frame, width=400)
     title = "Corrected Image"
     cv2.imshow("Uncorrected Image", resized_frame)
     cv2.imshow(title, resized_corrected_frame)
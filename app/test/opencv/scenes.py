@@ -0,0 +1,41 @@
+"""
+Module providing synthetic scenes and recordings shared by the opencv tests.
+"""
+
+from __future__ import absolute_import, division, print_function
+import numpy as np
+import cv2
+
+
+def make_scene(width=1200, height=360):
+    """
+    Returns a textured scene with detail at several scales.
+    """
+    state = np.random.RandomState(0)
+    scene = np.zeros((height, width, 3), np.float32)
+    for cell in (4, 16, 64):
+        noise = state.rand(height // cell + 1, width // cell + 1, 3).astype(np.float32)
+        scene += cv2.resize(noise, (width, height), interpolation=cv2.INTER_CUBIC)
+    return np.uint8(np.clip(scene * 85, 0, 255))
+
+def make_videos(tmpdir, count, width, height, pan=0):
+    """
+    Writes two synced videos of a scene, overlapping by half their width, and returns
+    their paths. The scene pans to the right by pan pixels every frame.
+    """
+    state = np.random.RandomState(0)
+    scene_width = 2 * width + pan * count
+    scene = cv2.resize(state.randint(0, 256, (height // 8, scene_width // 8, 3))
+                       .astype(np.uint8), (scene_width, height),
+                       interpolation=cv2.INTER_CUBIC)
+    paths = []
+    for offset in (0, width // 2):
+        path = str(tmpdir.join("%d.avi" % offset))
+        writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc('M', 'J', 'P', 'G'), 30,
+                                 (width, height))
+        for index in range(count):
+            start = offset + pan * index
+            writer.write(scene[:, start:start + width])
+        writer.release()
+        paths.append(path)
+    return paths
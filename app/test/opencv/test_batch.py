@@ -0,0 +1,105 @@
+"""
+Module responsible for testing offline batch stitching of synced recordings.
+"""
+
+from __future__ import absolute_import, division, print_function
+from distutils.spawn import find_executable # pylint: disable=deprecated-module
+import numpy as np
+import pytest
+import cv2
+from app.stitcher.core.batch import (estimate_homographies, get_segments, stitch_batch,
+                                     stitch_segment)
+from app.stitcher.core.homographystore import HomographyStore
+from app.test.opencv.scenes import make_videos
+
+
+opencv = pytest.mark.skipif(
+    not pytest.config.getoption("--opencv"),
+    reason="Need --opencv option to run."
+)
+
+WIDTH, HEIGHT = 160, 120
+
+def make_store(tmpdir, paths):
+    """
+    Returns a homography store holding the homography linking the two videos.
+    """
+    store = HomographyStore(str(tmpdir.join("homographies")))
+    store.save("-".join(paths) + ".0-1", (HEIGHT, WIDTH, 3), (HEIGHT, WIDTH, 3),
+               np.array([[1, 0, -WIDTH // 2], [0, 1, 0], [0, 0, 1]], np.float64))
+    return store
+
+def count_frames(path):
+    """
+    Returns the number of frames decoded from a video.
+    """
+    capture = cv2.VideoCapture(path)
+    count = 0
+    while capture.grab():
+        count += 1
+    capture.release()
+    return count
+
+def get_shifts(path):
+    """
+    Returns the horizontal shift in pixels between each pair of consecutive frames
+    of a video.
+    """
+    capture = cv2.VideoCapture(path)
+    shifts = []
+    previous = None
+    while True:
+        found, frame = capture.read()
+        if not found:
+            break
+        frame = np.float32(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY))
+        if previous is not None:
+            (shift, _), _ = cv2.phaseCorrelate(previous, frame)
+            shifts.append(shift)
+        previous = frame
+    capture.release()
+    return shifts
+
+@opencv
+def test_segments_cover_timeline():
+    """
+    Checks that segments split the timeline evenly, the last one running to its end,
+    and that short timelines are not split.
+    """
+    assert get_segments(100, 3) == [(0, 33), (33, 33), (66, None)]
+    assert get_segments(40, 4) == [(0, None)]
+    assert get_segments(0, 4) == [(0, None)]
+
+@opencv
+def test_segments_stitch_their_frames(tmpdir):
+    """
+    Checks that each segment stitches its own frames with the shared homographies.
+    """
+    paths = make_videos(tmpdir, 60, WIDTH, HEIGHT, pan=1)
+    size = (WIDTH, HEIGHT)
+    homographies = estimate_homographies(paths, size, make_store(tmpdir, paths))
+    assert len(homographies) == 1
+    for start, count in get_segments(60, 2):
+        path = str(tmpdir.join("segment-%d.avi" % start))
+        stitched = stitch_segment((paths, size, start, count, homographies, None, None,
+                                   30.0, path))
+        assert stitched == 30
+        assert count_frames(path) == 30
+
+@opencv
+def test_batch_concatenates_segments(tmpdir):
+    """
+    Checks that the segments are concatenated into a video of every frame, each once
+    and in order.
+    """
+    if find_executable('ffmpeg') is None:
+        pytest.skip("Needs ffmpeg.")
+    output_path = str(tmpdir.join("out.avi"))
+    paths = make_videos(tmpdir, 90, WIDTH, HEIGHT, pan=1)
+    frames, _ = stitch_batch(paths, output_path, WIDTH, HEIGHT, processes=2, segments=3,
+                             store=make_store(tmpdir, paths))
+    assert frames == 90
+    assert count_frames(output_path) == 90
+    # The scene pans a pixel every frame, so frames repeated or dropped at the segment
+    # boundaries show up as shifts of zero or two pixels.
+    assert all(abs(abs(shift) - 1) < 0.5 for shift in get_shifts(output_path))
@@ -0,0 +1,45 @@
+"""
+Module responsible for testing seam blending of stitched frames.
+"""
+
+from __future__ import absolute_import, division, print_function
+import numpy as np
+import pytest
+from app.stitcher.core.blending import set_blender
+from app.stitcher.core.warp import build_warp_plan
+
+
+opencv = pytest.mark.skipif(
+    not pytest.config.getoption("--opencv"),
+    reason="Need --opencv option to run."
+)
+
+HOMOGRAPHY = np.array([[1, 0, -200], [0, 1, 0], [0, 0, 1]], dtype=np.float64)
+
+def render(name, frame1, frame2):
+    """
+    Returns a copy of the frames stitched with the named blender.
+    """
+    plan = set_blender(build_warp_plan(frame2.shape, frame1.shape, HOMOGRAPHY), name)
+    return plan.render([frame1, frame2]).copy(), plan
+
+@opencv
+@pytest.mark.parametrize("name", ["feather", "multiband"])
+def test_blending_hides_exposure_step(name):
+    """
+    Checks that a brightness step between the frames is smoothed within their overlap,
+    and that the canvas outside of the overlap is left as pasted.
+    """
+    frame1 = np.full((120, 320, 3), 100, np.uint8)
+    frame2 = np.full((120, 320, 3), 160, np.uint8)
+    pasted, _ = render(None, frame1, frame2)
+    blended, plan = render(name, frame1, frame2)
+
+    [overlap] = plan.blender.overlaps
+    assert overlap.bounds == (200, 0, 320, 120)
+    assert np.array_equal(blended[:, :200], pasted[:, :200])
+    assert np.array_equal(blended[:, 320:], pasted[:, 320:])
+
+    row = blended[60, :, 0].astype(int)
+    assert row[205] < 115 and row[315] > 145
+    assert np.abs(np.diff(row)).max() < 20
@@ -0,0 +1,57 @@
+"""
+Module responsible for testing synchronized capture of several feeds.
+"""
+
+from __future__ import absolute_import, division, print_function
+import numpy as np
+import pytest
+import cv2
+from app.util.capturegroup import CaptureGroup
+from app.util.feed import VideoFeed
+
+
+opencv = pytest.mark.skipif(
+    not pytest.config.getoption("--opencv"),
+    reason="Need --opencv option to run."
+)
+
+def make_video(path, fps, count):
+    """
+    Writes a video of count frames at the provided frame rate.
+    """
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc('M', 'J', 'P', 'G'), fps, (64, 48))
+    for index in range(count):
+        writer.write(np.full((48, 64, 3), index, np.uint8))
+    writer.release()
+
+@opencv
+def test_frames_are_paired_on_timestamps(tmpdir):
+    """
+    Checks that a video at half the frame rate of the first one repeats every other frame,
+    keeping the frames of each read within the tolerance.
+    """
+    fast, slow = str(tmpdir.join("fast.avi")), str(tmpdir.join("slow.avi"))
+    make_video(fast, 20, 20)
+    make_video(slow, 10, 10)
+    group = CaptureGroup([VideoFeed(fast, 64), VideoFeed(slow, 64)], tolerance=0.03)
+    while group.read() is not None:
+        assert group.skew < 0.06
+    assert group.count == 19
+    assert group.repeated == 9
+    assert group.skipped == 0
+
+@opencv
+def test_lagging_feed_skips_frames(tmpdir):
+    """
+    Checks that a feed starting behind the first one skips frames to catch up.
+    """
+    first, second = str(tmpdir.join("first.avi")), str(tmpdir.join("second.avi"))
+    make_video(first, 10, 10)
+    make_video(second, 10, 10)
+    leading = VideoFeed(first, 64)
+    for _ in range(3):
+        leading.grab()
+    group = CaptureGroup([leading, VideoFeed(second, 64)], tolerance=0.03)
+    assert group.read() is not None
+    assert group.skipped == 3
+    assert group.get_stats()['max-skew'] < 0.03
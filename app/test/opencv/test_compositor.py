@@ -0,0 +1,58 @@
+"""
+Module responsible for testing single-pass compositing of several frames.
+"""
+
+from __future__ import absolute_import, division, print_function
+import numpy as np
+import pytest
+from app.stitcher.core.compositor import LOAD_RETRY_FRAMES, MAX_FAILED_LOADS, Compositor
+from app.stitcher.core.homographystore import HomographyStore
+from app.test.opencv.scenes import make_scene
+
+
+opencv = pytest.mark.skipif(
+    not pytest.config.getoption("--opencv"),
+    reason="Need --opencv option to run."
+)
+
+@opencv
+def test_three_frames_composite_into_scene(tmpdir):
+    """
+    Checks that three overlapping frames are composited into the scene they cover,
+    and that their homographies are stored per pair of neighbouring frames.
+    """
+    scene = make_scene(1440)
+    frames = [scene[:, offset:offset + 640].copy() for offset in (0, 400, 800)]
+    store = HomographyStore(str(tmpdir))
+    compositor = Compositor("rig", store)
+    result = compositor.composite(frames)
+    assert result is not None
+    assert abs(result.shape[1] - scene.shape[1]) < 10
+    assert store.load("rig.0-1", frames[0].shape, frames[1].shape) is not None
+    assert store.load("rig.1-2", frames[1].shape, frames[2].shape) is not None
+
+    # The middle frame is the reference and is pasted as is.
+    reference = compositor.plan.tiles[1]
+    assert np.array_equal(reference.get_region(result), frames[1])
+    assert compositor.composite(frames) is result
+
+@opencv
+def test_failed_homographies_are_retried():
+    """
+    Checks that homographies the frames fail to give are loaded again every
+    LOAD_RETRY_FRAMES frames, and that the compositor gives up after enough failures.
+    """
+    scene = make_scene(1440)
+    frames = [scene[:, offset:offset + 640].copy() for offset in (0, 400, 800)]
+    blank_frames = [np.zeros_like(frame) for frame in frames]
+    compositor = Compositor()
+    for _ in range(LOAD_RETRY_FRAMES):
+        assert compositor.composite(blank_frames) is None
+    assert compositor.failed_loads == 1
+    assert compositor.composite(frames) is not None
+    assert compositor.failed_loads == 0
+
+    compositor.reset()
+    for _ in range(LOAD_RETRY_FRAMES * MAX_FAILED_LOADS):
+        compositor.composite(blank_frames)
+    assert compositor.has_failed()
@@ -0,0 +1,80 @@
+"""
+Module responsible for testing functionality of the distortion corrector.
+"""
+
+from __future__ import absolute_import, division, print_function
+import numpy as np
+import pytest
+import cv2
+from app.stitcher.correction.calibration import CalibrationProfile
+from app.stitcher.correction.corrector import (Corrector, CAMERA_MATRIX,
+                                               DISTORTION_COEFFICIENTS)
+
+
+opencv = pytest.mark.skipif(
+    not pytest.config.getoption("--opencv"),
+    reason="Need --opencv option to run."
+)
+
+def make_frame(width=640, height=360):
+    """
+    Returns a synthetic checkered frame of the provided size.
+    """
+    rows, cols = np.indices((height, width))
+    frame = np.uint8(((rows // 20 + cols // 20) % 2) * 255)
+    return cv2.merge([frame, frame, frame])
+
+@opencv
+def test_correct_matches_undistort():
+    """
+    Checks that remap correction closely matches cv2.undistort.
+    """
+    frame = make_frame()
+    expected = cv2.undistort(frame, CAMERA_MATRIX, DISTORTION_COEFFICIENTS)
+    corrected = Corrector(profile_dir=None).correct(frame, 0)
+    difference = cv2.absdiff(expected, corrected)
+    assert corrected.shape == frame.shape
+    assert np.count_nonzero(difference > 64) < 0.01 * difference.size
+
+@opencv
+def test_maps_are_cached_and_bounded():
+    """
+    Checks that maps are reused per camera and resolution and that the cache is bounded.
+    """
+    corrector = Corrector(cache_size=2, profile_dir=None)
+    first = corrector.get_maps(0, (360, 640))
+    assert corrector.get_maps(0, (360, 640)) is first
+    corrector.get_maps(1, (360, 640))
+    corrector.get_maps(0, (180, 320))
+    assert len(corrector.maps) == 2
+    assert (0, (640, 360), (640, 360)) not in corrector.maps
+
+@opencv
+def test_single_pass_resize():
+    """
+    Checks that single-pass correction produces frames at the requested width.
+    """
+    frame = make_frame(1280, 720)
+    corrector = Corrector(profile_dir=None)
+    expected = cv2.resize(corrector.correct(frame, 0), (320, 180), interpolation=cv2.INTER_AREA)
+    corrected = corrector.correct(frame, 0, 320)
+    assert corrected.shape == (180, 320, 3)
+    assert np.mean(cv2.absdiff(expected, corrected)) < 32
+
+@opencv
+def test_profile_maps_are_stored_and_mapped(tmpdir):
+    """
+    Checks that profiled cameras store their remap tables and map them in on later runs.
+    """
+    profile_dir = str(tmpdir)
+    CalibrationProfile("serial-1", CAMERA_MATRIX * 0.5, [-0.1, 0.01, 0, 0, 0],
+                       (640, 360), 0.5, profile_dir).save()
+    frame = make_frame()
+    corrected = Corrector(profile_dir=profile_dir).correct(frame, "serial-1")
+    assert len(tmpdir.listdir(lambda path: path.ext == ".npy")) == 2
+
+    maps = Corrector(profile_dir=profile_dir).get_maps("serial-1", frame.shape[:2])
+    assert isinstance(maps[0], np.memmap)
+    fallback = Corrector(profile_dir=profile_dir).correct(frame, "serial-2")
+    assert np.array_equal(corrected, cv2.remap(frame, maps[0], maps[1], cv2.INTER_LINEAR))
+    assert not np.array_equal(corrected, fallback)
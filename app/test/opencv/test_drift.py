@@ -0,0 +1,35 @@
+"""
+Module responsible for testing drift detection of stitched cameras.
+"""
+
+from __future__ import absolute_import, division, print_function
+import pytest
+from app.stitcher.core.stitcher import Stitcher, get_pyramid_level
+from app.test.opencv.scenes import make_scene
+
+
+opencv = pytest.mark.skipif(
+    not pytest.config.getoption("--opencv"),
+    reason="Need --opencv option to run."
+)
+
+@opencv
+def test_drift_triggers_reestimation():
+    """
+    Checks that a static rig shows no drift, and that moving a camera
+    gets the homography re-estimated.
+    """
+    scene = make_scene()
+    frame1, frame2 = scene[:, :640].copy(), scene[:, 400:1040].copy()
+    stitcher = Stitcher()
+    stitcher.start_drift_monitoring(threshold=4.0)
+    for _ in range(3):
+        stitcher.stitch(frame1, frame2)
+    drift = stitcher.drift_monitor.update(*(get_pyramid_level(frame1) +
+                                            get_pyramid_level(frame2)))
+    assert drift is not None and abs(drift) < 1
+    assert abs(stitcher.homography[0, 2] + 400) < 5
+
+    moved_frame2 = scene[:, 420:1060].copy()
+    stitcher.stitch(frame1, moved_frame2)
+    assert abs(stitcher.homography[0, 2] + 420) < 5
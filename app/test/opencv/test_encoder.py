@@ -0,0 +1,189 @@
+"""
+Module responsible for testing the background encoder sink.
+"""
+
+from __future__ import absolute_import, division, print_function
+import threading
+import time
+import numpy as np
+import pytest
+from app.util.encoder import EncoderSink
+
+
+opencv = pytest.mark.skipif(
+    not pytest.config.getoption("--opencv"),
+    reason="Need --opencv option to run."
+)
+
+FRAME_SHAPE = (4, 4, 3)
+FRAME_SIZE = 4 * 4 * 3
+
+class SlowPipe(object):
+    """
+    Pipe of an encoder taking the provided seconds to write each buffer, recording
+    the written bytes and the type of the written buffers. If a chunk size is provided,
+    writes take at most that many bytes, as unbuffered pipes may. Without a delay,
+    writes stall until the pipe is broken.
+    """
+
+    def __init__(self, delay, chunk=None):
+        self.delay = delay
+        self.chunk = chunk
+        self.received = bytearray()
+        self.buffers = set()
+        self.closed = False
+        self.broken = threading.Event()
+
+    @property
+    def frames(self):
+        """
+        Returns the first byte of every written frame.
+        """
+        return list(self.received[::FRAME_SIZE])
+
+    def write(self, data):
+        """
+        Records the accepted part of the buffer after the delay, and returns its size.
+        """
+        if self.delay is None:
+            self.broken.wait()
+        else:
+            time.sleep(self.delay)
+        if self.broken.is_set():
+            raise IOError("Broken pipe")
+        self.buffers.add(type(data))
+        accepted = data[:self.chunk] if self.chunk else data
+        self.received.extend(accepted)
+        return len(accepted)
+
+    def close(self):
+        """
+        Closes the pipe.
+        """
+        self.closed = True
+
+class FakeEncoder(object):
+    """
+    Encoder process reading frames from a slow pipe, exiting once the pipe is closed
+    unless it stalls.
+    """
+
+    def __init__(self, delay, chunk=None):
+        self.stdin = SlowPipe(delay, chunk)
+        self.returncode = None
+
+    def poll(self):
+        """
+        Returns the exit code of the encoder, or None if it is still running.
+        """
+        if self.returncode is None and self.stdin.closed and self.stdin.delay is not None:
+            self.returncode = 0
+        return self.returncode
+
+    def wait(self):
+        """
+        Returns the exit code of the encoder.
+        """
+        return self.poll()
+
+    def terminate(self):
+        """
+        Stops the encoder, breaking its pipe.
+        """
+        self.returncode = -15
+        self.stdin.broken.set()
+
+    def kill(self):
+        """
+        Kills the encoder, breaking its pipe.
+        """
+        self.returncode = -9
+        self.stdin.broken.set()
+
+def feed(sink, count):
+    """
+    Writes count frames to the sink as fast as possible, numbering them by their pixels.
+    Returns the seconds spent writing.
+    """
+    frame = np.zeros(FRAME_SHAPE, np.uint8)
+    start_time = time.time()
+    for index in range(count):
+        frame[:] = index
+        sink.write(frame)
+    return time.time() - start_time
+
+@opencv
+def test_block_policy_encodes_every_frame():
+    """
+    Checks that blocking on a full queue encodes every frame in order, straight from
+    their slots.
+    """
+    encoder = FakeEncoder(0.005)
+    sink = EncoderSink(encoder, slots=3, policy='block')
+    sink.start()
+    feed(sink, 12)
+    sink.stop()
+    assert encoder.stdin.frames == list(range(12))
+    assert encoder.stdin.buffers == set([type(np.zeros(1).data)])
+    assert encoder.stdin.closed
+    stats = sink.get_stats()
+    assert stats['encoded'] == 12 and stats['dropped'] == 0
+    assert stats['stall'] >= 12 * 0.005
+    # Until the first frame is taken, its slot holds a queued frame too.
+    assert stats['max-depth'] <= 4
+
+@opencv
+def test_drop_policies_do_not_block():
+    """
+    Checks that a slow encoder does not hold back the loop, and that frames are dropped
+    from the queue as the policy asks, keeping the encoded ones in order.
+    """
+    for policy in ('oldest', 'newest'):
+        encoder = FakeEncoder(0.02)
+        sink = EncoderSink(encoder, slots=3, policy=policy)
+        sink.start()
+        assert feed(sink, 30) < 0.1
+        sink.stop()
+        frames = encoder.stdin.frames
+        assert frames == sorted(frames)
+        assert len(frames) + sink.get_stats()['dropped'] == 30
+        assert sink.get_stats()['dropped'] > 20
+        if policy == 'oldest':
+            assert frames[-1] == 29
+        else:
+            assert frames[-1] < 29
+
+@opencv
+def test_partial_writes_keep_frames_whole():
+    """
+    Checks that frames taken by the pipe in parts are written whole, so the following
+    frames stay aligned.
+    """
+    encoder = FakeEncoder(0, chunk=FRAME_SIZE // 3 + 1)
+    sink = EncoderSink(encoder, slots=3, policy='block')
+    sink.start()
+    feed(sink, 5)
+    sink.stop()
+    assert len(encoder.stdin.received) == 5 * FRAME_SIZE
+    assert encoder.stdin.received == bytearray(index for index in range(5)
+                                               for _ in range(FRAME_SIZE))
+    assert sink.get_stats()['encoded'] == 5
+
+@opencv
+def test_stalled_encoder_is_terminated():
+    """
+    Checks that stopping does not wait forever on a stalled encoder, which is terminated
+    with the frames it did not take counted as abandoned.
+    """
+    encoder = FakeEncoder(None)
+    sink = EncoderSink(encoder, slots=3)
+    sink.start()
+    feed(sink, 5)
+    start_time = time.time()
+    sink.stop(timeout=0.2)
+    assert time.time() - start_time < 2.0
+    assert encoder.returncode == -15
+    assert not sink.thread.is_alive()
+    stats = sink.get_stats()
+    assert stats['encoded'] == 0
+    assert stats['abandoned'] == 5 - stats['dropped'] > 0
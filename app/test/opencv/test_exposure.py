@@ -0,0 +1,47 @@
+"""
+Module responsible for testing exposure compensation of stitched frames.
+"""
+
+from __future__ import absolute_import, division, print_function
+import numpy as np
+import pytest
+import cv2
+from app.stitcher.core.exposure import build_gain_table
+from app.stitcher.core.stitcher import Stitcher
+
+
+opencv = pytest.mark.skipif(
+    not pytest.config.getoption("--opencv"),
+    reason="Need --opencv option to run."
+)
+
+@opencv
+def test_gain_table_scales_channels():
+    """
+    Checks that a gain table scales each channel by its gain, saturating at 255.
+    """
+    frame = np.full((2, 2, 3), 100, np.uint8)
+    result = cv2.LUT(frame, build_gain_table([0.5, 1.0, 3.0]))
+    assert result[0, 0].tolist() == [50, 100, 255]
+
+@opencv
+def test_gains_even_out_overlap():
+    """
+    Checks that the brightness gap between an underexposed frame and its neighbour
+    is more than halved in their overlap.
+    """
+    state = np.random.RandomState(0)
+    scene = cv2.resize(state.randint(60, 200, (30, 52, 3)).astype(np.uint8), (520, 300))
+    frame1 = scene[:, :320].copy()
+    frame2 = np.uint8(scene[:, 200:] * 0.7)
+    stitcher = Stitcher()
+    stitcher.set_homography(np.array([[1, 0, -200], [0, 1, 0], [0, 0, 1]], np.float64))
+    stitcher.start_gain_compensation(interval=1)
+    for _ in range(10):
+        stitcher.stitch(frame1, frame2)
+
+    gap = cv2.mean(frame1[:, 200:])[0] - cv2.mean(frame2[:, :120])[0]
+    compensated1, compensated2 = stitcher.gain_compensator.buffers
+    compensated_gap = cv2.mean(compensated1[:, 200:])[0] - cv2.mean(compensated2[:, :120])[0]
+    assert 0 <= compensated_gap < gap / 2
+    assert stitcher.gain_compensator.gains[0, 0] < 1 < stitcher.gain_compensator.gains[1, 0]
@@ -4,8 +4,10 @@ Module responsible for testing functionality of the inputscanner utility.
 
 from __future__ import absolute_import, division, print_function
 import imutils
+import numpy as np
 import pytest
-from app.util.feed import CameraFeed
+import cv2
+from app.util.feed import CameraFeed, VideoFeed
 
 
 opencv = pytest.mark.skipif(
@@ -13,6 +15,49 @@ opencv = pytest.mark.skipif(
     reason="Need --opencv option to run."
 )
 
+def make_video(path, count):
+    """
+    Writes a video of count frames.
+    """
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc('M', 'J', 'P', 'G'), 10, (64, 48))
+    for index in range(count):
+        writer.write(np.full((48, 64, 3), index, np.uint8))
+    writer.release()
+
+@opencv
+def test_iteration_decodes_every_frame_once(tmpdir):
+    """
+    Checks that iterating over a feed, and looping with has_next and get_next,
+    both deliver every frame of a video.
+    """
+    path = str(tmpdir.join("video.avi"))
+    make_video(path, 12)
+    assert sum(1 for _ in VideoFeed(path, 64)) == 12
+
+    feed = VideoFeed(path, 64)
+    count = 0
+    while feed.has_next():
+        assert feed.get_next() is not None
+        count += 1
+    assert count == 12
+
+@opencv
+def test_seek_lands_on_exact_frame(tmpdir):
+    """
+    Checks that seeking makes the frame of the index the next one read, and that
+    frames keep coming in order after it.
+    """
+    path = str(tmpdir.join("video.avi"))
+    make_video(path, 40)
+    feed = VideoFeed(path, 64)
+    for index in (25, 3, 0):
+        feed.seek(index)
+        assert feed.get_next() is not None
+        assert int(round(feed.timestamp * 10)) == index
+        assert abs(feed.raw.mean() - index) < 2
+        assert feed.get_next() is not None
+        assert int(round(feed.timestamp * 10)) == index + 1
+
 @opencv
 def test_frame_resize():
     """
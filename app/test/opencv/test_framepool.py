@@ -0,0 +1,66 @@
+"""
+Module responsible for testing that frames reuse pooled buffers across the pipeline.
+"""
+
+from __future__ import absolute_import, division, print_function
+import numpy as np
+import pytest
+from app.stitcher.core.compositor import Compositor
+from app.util.capturegroup import CaptureGroup
+from app.util.feed import VideoFeed
+from app.util.framepool import FramePool
+from app.test.opencv.scenes import make_videos
+
+tracemalloc = pytest.importorskip("tracemalloc")
+
+
+opencv = pytest.mark.skipif(
+    not pytest.config.getoption("--opencv"),
+    reason="Need --opencv option to run."
+)
+
+WIDTH, HEIGHT = 320, 240
+
+@opencv
+def test_pool_recycles_released_buffers():
+    """
+    Checks that released buffers are handed out again for the same shape and type.
+    """
+    pool = FramePool()
+    frame = pool.acquire((4, 4, 3))
+    pool.release(frame)
+    assert pool.acquire((4, 4, 3)) is frame
+    assert pool.acquire((4, 4, 3)) is not frame
+    assert pool.allocated == 2 and pool.reused == 1
+
+@opencv
+def test_steady_state_allocates_almost_nothing(tmpdir):
+    """
+    Checks that reading, correcting, compositing and blending frames allocates no
+    frame-sized buffers once the pipeline is warmed up.
+    """
+    if not hasattr(tracemalloc, 'reset_peak'):
+        pytest.skip("Needs tracemalloc.reset_peak.")
+    pool = FramePool()
+    group = CaptureGroup([VideoFeed(path, WIDTH, pool=pool)
+                          for path in make_videos(tmpdir, 40, WIDTH, HEIGHT)])
+    compositor = Compositor(blend='feather')
+    compositor.create_links(1)
+    compositor.links[0].set_homography(
+        np.array([[1, 0, -WIDTH // 2], [0, 1, 0], [0, 0, 1]], np.float64))
+
+    tracemalloc.start()
+    try:
+        for _ in range(5):
+            assert compositor.composite(group.read()) is not None
+        current = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        for _ in range(20):
+            compositor.composite(group.read())
+        growth, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    frame_size = WIDTH * HEIGHT * 3
+    assert peak - current < 0.05 * frame_size
+    assert growth - current < 0.05 * frame_size
@@ -0,0 +1,99 @@
+"""
+Module responsible for testing background frame capture.
+"""
+
+from __future__ import absolute_import, division, print_function
+import numpy as np
+import pytest
+from app.util.grabber import FrameRing, Grabber
+
+
+opencv = pytest.mark.skipif(
+    not pytest.config.getoption("--opencv"),
+    reason="Need --opencv option to run."
+)
+
+class FrameSource(object):
+    """
+    Capture yielding a fixed number of frames filled with their index.
+    """
+
+    def __init__(self, count):
+        self.count = count
+        self.index = -1
+
+    def grab(self):
+        """
+        Advances to the next frame, returning False once all frames were grabbed.
+        """
+        self.index += 1
+        return self.index < self.count
+
+    def retrieve(self, frame=None):
+        """
+        Returns the grabbed frame, written into the provided frame if possible.
+        """
+        if frame is None:
+            frame = np.empty((4, 4, 3), np.uint8)
+        frame[...] = self.index
+        return True, frame
+
+def write_frames(ring, count):
+    """
+    Writes count frames filled with their index into the ring.
+    """
+    for index in range(count):
+        ring.write(np.full((4, 4, 3), index, np.uint8), float(index))
+
+@opencv
+def test_latest_policy_skips_to_freshest_frame():
+    """
+    Checks that the latest policy returns the freshest frame and skips older ones.
+    """
+    ring = FrameRing(4)
+    write_frames(ring, 3)
+    frame, timestamp = ring.read('latest')
+    assert frame[0, 0, 0] == 2 and timestamp == 2.0
+    assert ring.skipped == 2
+    assert not ring.wait(0)
+
+@opencv
+def test_drain_policy_reads_in_order_and_drops_oldest():
+    """
+    Checks that the drain policy reads frames in capture order, and that frames
+    overwritten before they were read are counted as dropped.
+    """
+    ring = FrameRing(4)
+    write_frames(ring, 6)
+    values = []
+    while ring.wait(0):
+        values.append(int(ring.read('drain')[0][0, 0, 0]))
+    assert values == [2, 3, 4, 5]
+    assert ring.dropped == 2
+
+@opencv
+def test_read_frame_is_not_overwritten():
+    """
+    Checks that the frame last read is not written to while it is held.
+    """
+    ring = FrameRing(3)
+    write_frames(ring, 1)
+    frame, _ = ring.read('latest')
+    write_frames(ring, 10)
+    assert frame[0, 0, 0] == 0
+
+@opencv
+def test_grabber_buffers_every_frame_and_closes():
+    """
+    Checks that a grabber buffers frames from its capture until the capture runs out.
+    """
+    grabber = Grabber(FrameSource(5), slots=8)
+    grabber.start()
+    values = []
+    while True:
+        frame, _ = grabber.read('drain', timeout=5)
+        if frame is None:
+            break
+        values.append(int(frame[0, 0, 0]))
+    grabber.stop()
+    assert values == [0, 1, 2, 3, 4]
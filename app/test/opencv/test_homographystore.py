@@ -0,0 +1,61 @@
+"""
+Module responsible for testing persistence of stitcher homographies.
+"""
+
+from __future__ import absolute_import, division, print_function
+import numpy as np
+import pytest
+from app.stitcher.core import stitcher as stitcher_module
+from app.stitcher.core.homographystore import HomographyStore
+from app.stitcher.core.stitcher import HomographyEstimate, Stitcher
+
+
+opencv = pytest.mark.skipif(
+    not pytest.config.getoption("--opencv"),
+    reason="Need --opencv option to run."
+)
+
+@opencv
+def test_stored_homography_skips_matching(tmpdir, monkeypatch):
+    """
+    Checks that a stored homography is reused and that invalidation forces recomputation.
+    """
+    calls = []
+    homography = np.array([[1, 0, 40], [0, 1, 0], [0, 0, 1]], dtype=np.float64)
+
+    def fake_estimate_homography(frame1, frame2, backend=None): # pylint: disable=unused-argument
+        """ Records homography estimations. """
+        calls.append((frame1.shape, frame2.shape))
+        points = np.zeros((0, 2), np.float32)
+        return HomographyEstimate(homography, points, points, np.zeros(0, bool))
+
+    monkeypatch.setattr(stitcher_module, "estimate_homography", fake_estimate_homography)
+    store = HomographyStore(str(tmpdir))
+    frame = np.zeros((120, 160, 3), np.uint8)
+
+    Stitcher("0-1.left", store).stitch(frame, frame)
+    stitcher = Stitcher("0-1.left", store)
+    stitcher.stitch(frame, frame)
+    assert len(calls) == 1
+    assert np.array_equal(stitcher.homography, homography)
+
+    stitcher.invalidate()
+    assert store.load("0-1.left", frame.shape, frame.shape) is None
+    stitcher.stitch(frame, frame)
+    assert len(calls) == 2
+
+@opencv
+def test_invalidating_a_rig_keeps_other_rigs(tmpdir):
+    """
+    Checks that invalidating a rig removes the homographies of its links only.
+    """
+    store = HomographyStore(str(tmpdir))
+    shape = (120, 160, 3)
+    homography = np.eye(3)
+    for key in ("0-1.0-1", "0-1.1-2", "2-3.0-1"):
+        store.save(key, shape, shape, homography)
+
+    store.invalidate("0-1")
+    assert store.load("0-1.0-1", shape, shape) is None
+    assert store.load("0-1.1-2", shape, shape) is None
+    assert store.load("2-3.0-1", shape, shape) is not None
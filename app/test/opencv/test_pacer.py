@@ -0,0 +1,54 @@
+"""
+Module responsible for testing frame pacing on monotonic deadlines.
+"""
+
+from __future__ import absolute_import, division, print_function
+import time
+import pytest
+from app.util.pacer import FramePacer, Histogram, clock
+
+
+opencv = pytest.mark.skipif(
+    not pytest.config.getoption("--opencv"),
+    reason="Need --opencv option to run."
+)
+
+@opencv
+def test_histogram_bins_durations():
+    """
+    Checks that durations land in the bin of their upper edge, or in the overflow bin.
+    """
+    histogram = Histogram((1.0, 10.0))
+    for seconds in (0.0005, 0.001, 0.005, 0.5):
+        histogram.add(seconds)
+    assert histogram.counts == [2, 1, 1]
+    assert histogram.maximum == 500.0
+    assert histogram.get_bins()[-1] == ("> 10 ms", 1)
+
+@opencv
+def test_frames_are_paced_without_drift():
+    """
+    Checks that frames are released on their deadlines, so the loop does not drift.
+    """
+    pacer = FramePacer(100.0)
+    pacer.start()
+    start_time = clock()
+    assert all(pacer.wait() == 1 for _ in range(21))
+    assert abs(clock() - start_time - 0.2) < 0.01
+    assert pacer.frames == 21 and pacer.dropped == 0
+    assert pacer.jitter.count == 21
+
+@opencv
+def test_stale_frames_are_dropped():
+    """
+    Checks that a frame arriving over an interval late is dropped, and that the next
+    frame covers the missed deadlines.
+    """
+    pacer = FramePacer(50.0)
+    pacer.start()
+    assert pacer.wait() == 1
+    time.sleep(0.07)
+    assert pacer.wait() == 0
+    assert pacer.wait() == 3
+    assert pacer.dropped == 1 and pacer.missed == 2
+    assert pacer.lateness.count == 1
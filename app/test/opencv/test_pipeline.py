@@ -0,0 +1,72 @@
+"""
+Module responsible for testing the staged pipeline over shared-memory rings.
+"""
+
+from __future__ import absolute_import, division, print_function
+import functools
+import numpy as np
+import pytest
+from app.stitcher.core.homographystore import HomographyStore
+from app.util.feed import VideoFeed
+from app.test.opencv.scenes import make_videos
+
+pytest.importorskip("multiprocessing.shared_memory")
+pipeline = pytest.importorskip("app.stitcher.core.pipeline")
+
+
+opencv = pytest.mark.skipif(
+    not pytest.config.getoption("--opencv"),
+    reason="Need --opencv option to run."
+)
+
+WIDTH, HEIGHT = 160, 120
+
+@opencv
+def test_ring_passes_frames_in_order():
+    """
+    Checks that frames written to a ring are read back in order with their timestamps,
+    followed by the end of the frames.
+    """
+    stopped = pipeline.multiprocessing.Event()
+    ring = pipeline.SharedRing(8 * 8 * 3, slots=2)
+    try:
+        for index in range(2):
+            assert ring.write(np.full((8, 6, 3), index, np.uint8), index / 10, stopped)
+        for index in range(2):
+            frame, timestamp = ring.read(stopped)
+            assert frame.shape == (8, 6, 3) and (frame == index).all()
+            assert timestamp == index / 10
+        assert ring.write(None, None, stopped)
+        assert ring.read(stopped) == (None, None)
+    finally:
+        ring.unlink()
+
+@opencv
+def test_pipeline_stitches_every_frame(tmpdir):
+    """
+    Checks that the stages stitch every pair of frames of two videos at the output size
+    and count them.
+    """
+    count = 12
+    store = HomographyStore(str(tmpdir.join("homographies")))
+    store.save("rig.0-1", (HEIGHT, WIDTH, 3), (HEIGHT, WIDTH, 3),
+               np.array([[1, 0, -WIDTH // 2], [0, 1, 0], [0, 0, 1]], np.float64))
+    factories = [functools.partial(VideoFeed, path, WIDTH)
+                 for path in make_videos(tmpdir, count, WIDTH, HEIGHT)]
+    stages = pipeline.Pipeline(factories, WIDTH, (240, 120), {'key': "rig", 'store': store})
+    stages.start()
+    try:
+        stitched = 0
+        while True:
+            frame, _ = stages.read()
+            if frame is None:
+                break
+            assert frame.shape == (120, 240, 3)
+            stitched += 1
+        frame = None
+    finally:
+        stages.stop()
+    assert stitched == count
+    stats = dict((stat[0], stat[1:]) for stat in stages.get_stats())
+    assert stats["capture-0"][0] == stats["capture-1"][0] == count
+    assert stats["stitch"][0] == stats["output"][0] == count
@@ -0,0 +1,81 @@
+"""
+Module responsible for testing the decimated preview and the control channel.
+"""
+
+from __future__ import absolute_import, division, print_function
+import io
+import time
+import numpy as np
+import pytest
+from app.util.control import ControlChannel
+from app.util.preview import PreviewSink
+
+
+opencv = pytest.mark.skipif(
+    not pytest.config.getoption("--opencv"),
+    reason="Need --opencv option to run."
+)
+
+class RecordingPreview(PreviewSink):
+    """
+    Preview recording the frames it shows instead of opening a window, pressing the
+    quit key on the provided show. There is no window to close.
+    """
+
+    def __init__(self, control=None, fps=20.0, quit_on=None):
+        PreviewSink.__init__(self, control, fps)
+        self.quit_on = quit_on
+        self.frames = []
+
+    def display(self, frame):
+        self.frames.append(frame.copy())
+        return ord('q') if len(self.frames) == self.quit_on else 255
+
+    def close(self):
+        pass
+
+@opencv
+def test_control_quits_on_command():
+    """
+    Checks that a quit command read from the control stream asks the loop to quit.
+    """
+    control = ControlChannel(io.StringIO(u"status\nquit\n"))
+    control.start()
+    control.thread.join(1.0)
+    assert control.should_quit()
+
+@opencv
+def test_preview_is_decimated():
+    """
+    Checks that frames offered faster than the preview rate are skipped, and that shown
+    frames are copies the loop can overwrite.
+    """
+    preview = RecordingPreview(fps=20.0)
+    preview.start()
+    frame = np.zeros((4, 4, 3), np.uint8)
+    start_time = time.time()
+    while time.time() - start_time < 0.5:
+        frame[:] = preview.offered % 256
+        preview.show(frame)
+        time.sleep(0.001)
+    preview.stop()
+    assert 3 <= preview.shown <= 12
+    assert preview.offered > 5 * preview.shown
+    assert len(set(int(shown[0, 0, 0]) for shown in preview.frames)) == preview.shown
+
+@opencv
+def test_preview_forwards_quit_key():
+    """
+    Checks that the quit key pressed in the preview asks the loop to quit.
+    """
+    control = ControlChannel()
+    preview = RecordingPreview(control, quit_on=2)
+    preview.start()
+    frame = np.zeros((4, 4, 3), np.uint8)
+    start_time = time.time()
+    while not control.should_quit() and time.time() - start_time < 2.0:
+        preview.show(frame)
+        time.sleep(0.005)
+    preview.stop()
+    assert control.should_quit()
+    assert preview.shown == 2
@@ -0,0 +1,96 @@
+"""
+Module responsible for testing cylindrical and equirectangular projections of camera rigs.
+"""
+
+from __future__ import absolute_import, division, print_function
+import numpy as np
+import pytest
+import cv2
+from app.stitcher.core.projection import (Projection, build_projection_plan, estimate_focal,
+                                          get_camera_matrix, is_valid_size)
+
+
+opencv = pytest.mark.skipif(
+    not pytest.config.getoption("--opencv"),
+    reason="Need --opencv option to run."
+)
+
+SHAPE = (300, 400, 3)
+FOCAL = 300.0
+YAWS = (-40, 0, 40)
+
+def make_rig():
+    """
+    Returns the camera matrix, the rotations from the rig frame of cameras turned by YAWS
+    degrees to the right and the homographies between neighbouring cameras.
+    """
+    camera_matrix = get_camera_matrix(SHAPE, FOCAL)
+    rotations = [cv2.Rodrigues(np.array([0, -np.radians(yaw), 0]))[0] for yaw in YAWS]
+    inverse = np.linalg.inv(camera_matrix)
+    homographies = [camera_matrix.dot(rotation2).dot(rotation1.T).dot(inverse)
+                    for rotation1, rotation2 in zip(rotations[:-1], rotations[1:])]
+    return camera_matrix, rotations, homographies
+
+def capture(scene, projection, camera_matrix, rotation):
+    """
+    Returns the frame a camera of the rig sees of an equirectangular scene.
+    """
+    xs, ys = np.meshgrid(np.arange(SHAPE[1], dtype=np.float64),
+                         np.arange(SHAPE[0], dtype=np.float64))
+    points = np.stack([xs.ravel(), ys.ravel(), np.ones(xs.size)])
+    rays = rotation.T.dot(np.linalg.inv(camera_matrix).dot(points))
+    map_x, map_y = projection.get_pixels(*rays)
+    return cv2.remap(scene, np.float32(map_x.reshape(xs.shape)),
+                     np.float32(map_y.reshape(xs.shape)), cv2.INTER_LINEAR,
+                     borderMode=cv2.BORDER_WRAP)
+
+@opencv
+def test_equirectangular_plan_reproduces_scene():
+    """
+    Checks that frames of a rotating rig are projected back onto the scene they see.
+    """
+    state = np.random.RandomState(0)
+    size = (1024, 512)
+    scene = cv2.resize(state.randint(0, 256, (64, 128, 3)).astype(np.uint8), size,
+                       interpolation=cv2.INTER_CUBIC)
+    projection = Projection('equirectangular', size, (size[0] / (2 * np.pi), size[1] / np.pi),
+                            (size[0] / 2 - 0.5, size[1] / 2 - 0.5))
+    camera_matrix, rotations, homographies = make_rig()
+    frames = [capture(scene, projection, camera_matrix, rotation) for rotation in rotations]
+
+    plan = build_projection_plan('equirectangular', [SHAPE] * 3, homographies,
+                                 [camera_matrix] * 3, size)
+    result = plan.render(frames)
+    assert result.shape[:2] == (size[1], size[0])
+    covered = result.any(axis=2)
+    assert 0.1 < covered.mean() < 0.5
+    difference = cv2.absdiff(result, scene)[covered]
+    assert np.median(difference) < 4
+
+@opencv
+def test_cylindrical_plan_covers_rig():
+    """
+    Checks that the focal length is recovered from the homographies, and that a
+    cylindrical panorama spans the longitudes the rig sees.
+    """
+    _, _, homographies = make_rig()
+    focal = estimate_focal(homographies, [SHAPE] * 3)
+    assert abs(focal - FOCAL) < 0.02 * FOCAL
+
+    plan = build_projection_plan('cylindrical', [SHAPE] * 3, homographies)
+    field_of_view = np.radians(80) + 2 * np.arctan(SHAPE[1] / 2 / FOCAL)
+    assert abs(plan.size[0] - field_of_view * FOCAL) < 0.02 * plan.size[0]
+    assert all(tile is not None for tile in plan.tiles)
+
+@opencv
+def test_equirectangular_size_must_be_two_to_one():
+    """
+    Checks that equirectangular panoramas are refused at sizes that would stretch them.
+    """
+    camera_matrix, _, homographies = make_rig()
+    assert is_valid_size('equirectangular', (1024, 512))
+    assert not is_valid_size('equirectangular', (640, 480))
+    assert is_valid_size('cylindrical', (640, 480))
+    with pytest.raises(ValueError):
+        build_projection_plan('equirectangular', [SHAPE] * 3, homographies,
+                              [camera_matrix] * 3, (640, 480))
@@ -0,0 +1,78 @@
+"""
+Module responsible for testing background homography re-estimation.
+"""
+
+from __future__ import absolute_import, division, print_function
+import time
+import numpy as np
+import pytest
+from app.stitcher.core.reestimator import Reestimator
+from app.stitcher.core.stitcher import Stitcher
+from app.test.opencv.scenes import make_scene
+
+
+opencv = pytest.mark.skipif(
+    not pytest.config.getoption("--opencv"),
+    reason="Need --opencv option to run."
+)
+
+@opencv
+def test_better_homography_is_swapped_in():
+    """
+    Checks that a wrong homography is replaced in the background while frames keep coming.
+    """
+    scene = make_scene()
+    frame1, frame2 = scene[:, :640].copy(), scene[:, 400:1040].copy()
+    stitcher = Stitcher()
+    stitcher.set_homography(np.array([[1, 0, -300], [0, 1, 20], [0, 0, 1]], np.float64))
+    stitcher.start_reestimation(0)
+    try:
+        deadline = time.time() + 10
+        while stitcher.reestimator.adoptions == 0 and time.time() < deadline:
+            assert stitcher.stitch(frame1, frame2) is not None
+            time.sleep(0.01)
+    finally:
+        reestimator = stitcher.reestimator
+        stitcher.stop_reestimation()
+
+    assert reestimator.adoptions >= 1
+    assert abs(stitcher.homography[0, 2] + 400) < 5
+    assert stitcher.stitch(frame1, frame2).shape[1] > 1030
+
+class FlakyTarget(object): # pylint: disable=too-few-public-methods
+    """
+    Target of a re-estimator whose first re-estimation raises.
+    """
+
+    def __init__(self):
+        self.calls = 0
+
+    def reestimate(self, *frames): # pylint: disable=unused-argument
+        """
+        Raises on the first call, and adopts the snapshot on later ones.
+        """
+        self.calls += 1
+        if self.calls == 1:
+            raise ValueError("degenerate snapshot")
+        return True
+
+@opencv
+def test_failed_reestimation_keeps_worker_running():
+    """
+    Checks that a re-estimation raising is counted as a failure, and that the worker
+    goes on re-estimating from later snapshots.
+    """
+    frame = np.zeros((8, 8, 3), np.uint8)
+    reestimator = Reestimator(FlakyTarget(), 0)
+    reestimator.start()
+    try:
+        deadline = time.time() + 5
+        while reestimator.adoptions == 0 and time.time() < deadline:
+            reestimator.offer(frame, frame)
+            time.sleep(0.01)
+    finally:
+        reestimator.stop()
+
+    assert reestimator.failures == 1
+    assert reestimator.adoptions >= 1
+    assert reestimator.thread.is_alive() is False
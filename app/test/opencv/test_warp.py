@@ -0,0 +1,104 @@
+"""
+Module responsible for testing precomputed warps of the stitcher.
+"""
+
+from __future__ import absolute_import, division, print_function
+from multiprocessing.pool import ThreadPool
+import numpy as np
+import pytest
+import cv2
+from app.stitcher.core.stitcher import Stitcher
+from app.stitcher.core.warp import build_composite_plan, build_warp_plan
+
+
+opencv = pytest.mark.skipif(
+    not pytest.config.getoption("--opencv"),
+    reason="Need --opencv option to run."
+)
+
+HOMOGRAPHY = np.array([[0.95, 0.02, 150.0], [-0.01, 0.98, 12.0], [-0.0001, 0.0, 1.0]])
+
+def make_frame(seed, width=320, height=240):
+    """
+    Returns a random frame of the provided size.
+    """
+    state = np.random.RandomState(seed)
+    return cv2.GaussianBlur(state.randint(0, 256, (height, width, 3)).astype(np.uint8),
+                            (5, 5), 0)
+
+def warp_reference(img1, img2, homography):
+    """
+    Warps the second image to the plane of the first with warpPerspective.
+    """
+    plan = build_warp_plan(img1.shape, img2.shape, homography)
+    x_offset, y_offset = plan.tiles[1].x, plan.tiles[1].y
+    translation = np.array([[1, 0, x_offset], [0, 1, y_offset], [0, 0, 1]], dtype=np.float64)
+    output_img = cv2.warpPerspective(img2, translation.dot(homography), plan.size)
+    output_img[y_offset:y_offset + img1.shape[0], x_offset:x_offset + img1.shape[1]] = img1
+    return output_img
+
+@opencv
+def test_plan_matches_warp_perspective():
+    """
+    Checks that rendering through a plan matches warpPerspective away from the frame edges.
+    """
+    frame1, frame2 = make_frame(1), make_frame(2)
+    expected = warp_reference(frame2, frame1, HOMOGRAPHY)
+    stitcher = Stitcher()
+    stitcher.set_homography(HOMOGRAPHY)
+    result = stitcher.stitch(frame1, frame2)
+    assert result.shape == expected.shape
+    difference = cv2.absdiff(result, expected)
+    assert np.count_nonzero(difference > 8) < 0.01 * difference.size
+
+@opencv
+def test_canvas_is_reused():
+    """
+    Checks that the stitcher renders every frame into the same canvas.
+    """
+    stitcher = Stitcher()
+    stitcher.set_homography(HOMOGRAPHY)
+    first = stitcher.stitch(make_frame(1), make_frame(2))
+    second = stitcher.stitch(make_frame(3), make_frame(4))
+    assert first is second
+
+@opencv
+def test_composite_plan_renders_each_frame_once():
+    """
+    Checks that a row of translated frames is composited back into the scene they cover.
+    """
+    scene = make_frame(5, width=880)
+    frames = [scene[:, offset:offset + 320].copy() for offset in (0, 280, 560)]
+    translation = np.array([[1, 0, -280], [0, 1, 0], [0, 0, 1]], np.float64)
+    plan = build_composite_plan([frame.shape for frame in frames], [translation, translation])
+    assert plan.order[-1] == 1
+    assert np.array_equal(plan.render(frames), scene)
+
+@opencv
+def test_sized_plan_renders_covered_crop():
+    """
+    Checks that a plan with an output size renders the covered part of the canvas
+    straight at that size, without empty borders.
+    """
+    frame1, frame2 = make_frame(1), make_frame(2)
+    stitcher = Stitcher(size=(400, 200))
+    stitcher.set_homography(HOMOGRAPHY)
+    result = stitcher.stitch(frame1, frame2)
+    assert result.shape == (200, 400, 3)
+    assert np.count_nonzero(result.max(axis=2) == 0) == 0
+
+@opencv
+def test_parallel_render_matches_serial():
+    """
+    Checks that rendering bands of the canvas in a pool of threads matches rendering serially.
+    """
+    frames = [make_frame(seed) for seed in (1, 2, 3)]
+    plan = build_composite_plan([frame.shape for frame in frames], [HOMOGRAPHY, HOMOGRAPHY])
+    expected = plan.render(frames).copy()
+    plan.canvas[...] = 0
+    pool = ThreadPool(4)
+    try:
+        assert np.array_equal(plan.render(frames, pool), expected)
+    finally:
+        pool.close()
+        pool.join()
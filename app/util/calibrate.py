@@ -4,23 +4,46 @@
 camera calibration for distorted images with chess board samples
 reads distorted images, calculates the calibration and write undistorted images
 
+writes a calibration profile for each camera, along with remap tables for its
+image size and for the provided output width.
+
+chessboards are detected in parallel worker processes on a downscaled copy of each
+image, and only refined with cornerSubPix at full resolution when a board is found.
+
 usage:
-    calibrate.py [--debug <output path>] [--square_size] [<image mask>]
+    calibrate.py [--debug <output path>] [--square_size] [--camera <ids>]
+                 [--profile_dir <profile path>] [--width <output width>]
+                 [--jobs <processes>] [--detect_size <pixels>] [<image mask>]
 
 default values:
     --debug:    ./output/
     --square_size: 1.0
-    <image mask> defaults to ../data/left*.jpg
+    --camera: 0 (comma-separated camera indices or serials)
+    --profile_dir: config/calibration
+    --width: 640
+    --jobs: number of cpus (1 detects in the calling process)
+    --detect_size: 1024 (longest image side used for detection)
+    <image mask>: app/storage/calibration_inputs/* for a single camera, and
+    app/storage/calibration_inputs/{camera}/* for several, where {camera} is
+    replaced by each camera id. Several cameras need a mask with {camera}.
 """
 
 from __future__ import print_function
 import os
 import sys
 import getopt
+import time
 from glob import glob
+from multiprocessing import Pool, cpu_count
 import numpy as np
 import cv2
 import imutils
+from app.stitcher.correction.calibration import CalibrationProfile, DEFAULT_CALIBRATION_DIR
+from app.stitcher.correction.corrector import Corrector, get_output_size
+
+# Chessboard images of a single camera, and of each of several cameras.
+DEFAULT_IMG_MASK = 'app/storage/calibration_inputs/*'
+DEFAULT_CAMERA_IMG_MASK = 'app/storage/calibration_inputs/{camera}/*'
 
 # pylint: disable=R0914
 def main():
@@ -33,21 +56,49 @@ def calibrate():
     """
     Calibration routine
     """
-    args, img_mask = getopt.getopt(sys.argv[1:], '', ['debug=', 'square_size='])
+    args, img_mask = getopt.getopt(sys.argv[1:], '', ['debug=', 'square_size=', 'camera=',
+                                                      'profile_dir=', 'width=', 'jobs=',
+                                                      'detect_size='])
     args = dict(args)
     args.setdefault('--debug', './output/')
     args.setdefault('--square_size', 1.0)
+    args.setdefault('--camera', '0')
+    args.setdefault('--profile_dir', DEFAULT_CALIBRATION_DIR)
+    args.setdefault('--width', 640)
+    args.setdefault('--jobs', cpu_count())
+    args.setdefault('--detect_size', 1024)
+    cameras = args.get('--camera').split(',')
     if not img_mask:
-        img_mask = 'app/storage/calibration_inputs/*'
+        img_mask = DEFAULT_IMG_MASK if len(cameras) == 1 else DEFAULT_CAMERA_IMG_MASK
     else:
         img_mask = img_mask[0]
+    if len(cameras) > 1 and '{camera}' not in img_mask:
+        print('The image mask needs a {camera} placeholder to calibrate several cameras.')
+        return
 
-    img_names = glob(img_mask)
     debug_dir = args.get('--debug')
     if not os.path.isdir(debug_dir):
         os.mkdir(debug_dir)
     square_size = float(args.get('--square_size'))
+    jobs = int(args.get('--jobs'))
+    detect_size = int(args.get('--detect_size'))
+
+    for camera in cameras:
+        print('\ncalibrating camera %s' % camera)
+        img_names = sorted(glob(img_mask.format(camera=camera)))
+        profile = calibrate_camera(camera, img_names, square_size, args.get('--profile_dir'),
+                                   jobs, detect_size)
+        if profile is None:
+            continue
+        save_profile(profile, int(args.get('--width')))
+        verify_calibration(profile.camera_matrix, profile.distortion_coefficients, img_names[0])
+    cv2.destroyAllWindows()
 
+def calibrate_camera(camera, img_names, square_size, profile_dir, jobs=1, detect_size=1024):
+    """
+    Calibrates the camera from its chessboard images and returns its calibration profile.
+    Returns None if no chessboard was found.
+    """
     pattern_size = (9, 6)
     pattern_points = np.zeros((np.prod(pattern_size), 3), np.float32)
     pattern_points[:, :2] = np.indices(pattern_size).T.reshape(-1, 2)
@@ -56,20 +107,17 @@ def calibrate():
     obj_points = []
     img_points = []
     height, width = 0, 0
-    for filename in img_names:
+    tasks = [(filename, pattern_size, detect_size) for filename in img_names]
+    start_time = time.time()
+    for filename, size, corners, timings in detect_all_corners(tasks, jobs):
         print('processing %s... ' % filename, end='')
-        img = cv2.imread(filename, 0)
-        if img is None:
+        if size is None:
             print("Failed to load", filename)
             continue
 
-        height, width = img.shape[:2]
-        found, corners = cv2.findChessboardCorners(img, pattern_size)
-        if found:
-            term = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_COUNT, 30, 0.1)
-            cv2.cornerSubPix(img, corners, (5, 5), (-1, -1), term)
-
-        if not found:
+        width, height = size
+        print('(decode %.3fs, detect %.3fs, refine %.3fs) ' % timings, end='')
+        if corners is None:
             print('Chessboard not found.')
             continue
 
@@ -78,6 +126,15 @@ def calibrate():
 
         print('ok')
 
+    elapsed_time = time.time() - start_time
+    print('\nprocessed %d images in %.2fs (%.2f images/s) with %d jobs, found %d chessboards'
+          % (len(img_names), elapsed_time, len(img_names) / max(elapsed_time, 1e-6),
+             jobs, len(img_points)))
+
+    if not img_points:
+        print('No chessboards found for camera %s.' % camera)
+        return None
+
     # calculate camera distortion
     rms, camera_matrix, dist_coefs, _, _ = cv2.calibrateCamera(obj_points,
                                                                img_points,
@@ -92,8 +149,75 @@ def calibrate():
         i = i+2
         dist_coefs[i] = 0
     print(dist_coefs)
-    verify_calibration(camera_matrix, dist_coefs)
-    cv2.destroyAllWindows()
+    return CalibrationProfile(camera, camera_matrix, dist_coefs, (width, height), rms,
+                              profile_dir)
+
+def detect_all_corners(tasks, jobs):
+    """
+    Detects chessboard corners for all tasks, in a process pool if jobs is above one.
+    Results are returned in the order of the tasks.
+    """
+    if jobs <= 1:
+        return [detect_corners(task) for task in tasks]
+
+    pool = Pool(jobs)
+    try:
+        return pool.map(detect_corners, tasks, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+
+def detect_corners(task):
+    """
+    Decodes an image and detects its chessboard corners coarse-to-fine.
+    Corners are found on a copy downscaled to the detect size with the fast check,
+    and refined with cornerSubPix on the full resolution image only if a board is found.
+    Returns the filename, image size, corners (or None) and decode/detect/refine timings.
+    """
+    filename, pattern_size, detect_size = task
+    start_time = time.time()
+    img = cv2.imread(filename, 0)
+    decode_time = time.time() - start_time
+    if img is None:
+        return filename, None, None, (decode_time, 0.0, 0.0)
+
+    height, width = img.shape[:2]
+    scale = min(1.0, detect_size / float(max(height, width)))
+    small_img = img
+    if scale < 1.0:
+        small_img = cv2.resize(img, (int(width * scale), int(height * scale)),
+                               interpolation=cv2.INTER_AREA)
+
+    flags = (cv2.CALIB_CB_ADAPTIVE_THRESH + cv2.CALIB_CB_NORMALIZE_IMAGE +
+             cv2.CALIB_CB_FAST_CHECK)
+    start_time = time.time()
+    found, corners = cv2.findChessboardCorners(small_img, pattern_size, flags=flags)
+    detect_time = time.time() - start_time
+    if not found:
+        return filename, (width, height), None, (decode_time, detect_time, 0.0)
+
+    # Coarse corners are scaled back up, so the refinement window has to cover
+    # the error introduced by detecting at the lower resolution.
+    start_time = time.time()
+    corners = np.float32((corners + 0.5) / scale - 0.5)
+    window = max(5, int(np.ceil(1.0 / scale)) + 1)
+    term = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_COUNT, 30, 0.1)
+    cv2.cornerSubPix(img, corners, (window, window), (-1, -1), term)
+    refine_time = time.time() - start_time
+    return filename, (width, height), corners, (decode_time, detect_time, refine_time)
+
+def save_profile(profile, output_width):
+    """
+    Saves the calibration profile along with its remap tables for the calibrated
+    image size and for the output width, so feeds can map them in at startup.
+    """
+    profile.save()
+    corrector = Corrector(profile_dir=profile.directory)
+    for width in sorted(set([profile.image_size[0], output_width])):
+        corrector.load_maps(profile.camera, profile.image_size,
+                            get_output_size(profile.image_size, width))
+    print("saved calibration profile to", CalibrationProfile.get_path(profile.camera,
+                                                                    profile.directory))
 
 def splitfilename(filename):
     """
@@ -103,7 +227,8 @@ def splitfilename(filename):
     name, ext = os.path.splitext(filename)
     return path, name, ext
 
-def verify_calibration(camera_matrix, distortion_coefficients):
+def verify_calibration(camera_matrix, distortion_coefficients,
+                       filename="app/storage/calibration_inputs/104_0009.JPG"):
     """
     Verifies calibration of a test image
     based on an incoming camera_matrix and a
@@ -111,7 +236,7 @@ def verify_calibration(camera_matrix, distortion_coefficients):
     """
 
     # Read in the image for correction
-    src = cv2.imread("app/storage/calibration_inputs/104_0009.JPG")
+    src = cv2.imread(filename)
     height, width = src.shape[:2]
 
     # Correct the radial distortion
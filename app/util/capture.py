@@ -53,8 +53,9 @@ def capture_single_video(index=0, duration=5, fps=30, output_dir="out/captured_v
     writer = None
 
     start_time = time.time()
-    while time.time() < start_time + duration:
-        frame = camera_feed.get_next(True, False)
+    for frame in camera_feed:
+        if time.time() >= start_time + duration:
+            break
         if writer is None:
             (height, width) = frame.shape[:2]
             writer = cv2.VideoWriter(filepath, cv2.VideoWriter_fourcc(*"MP4V"),
@@ -83,8 +84,7 @@ def capture_camera_frames(output_dir="out/captured_frames", filetype="jpg", *fee
     for camera_feed in camera_feed_list:
         TextFormatter.print_info("Camera feed ramped and read.")
         camera_feed.ramp()
-        if camera_feed.has_next():
-            frame = camera_feed.get_next(True, False)
+        frame = next(iter(camera_feed), None)
         camera_feed.close()
         frame_list.append(frame)
 
@@ -125,7 +125,7 @@ def capture_camera_videos(duration=5, fps=30, output_dir="out/captured_videos",
     start_time = time.time()
     while time.time() < start_time + duration:
         for camera_feed in camera_feed_list:
-            frame = camera_feed.get_next(True, False)
+            frame = camera_feed.get_next()
             writer = writer_list[camera_feed_list.index(camera_feed)]
             filepath = filepath_list[camera_feed_list.index(camera_feed)]
             if writer is None:
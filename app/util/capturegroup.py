@@ -0,0 +1,101 @@
+"""
+Module for capturing frames of several feeds in sync.
+"""
+from __future__ import absolute_import, division, print_function
+
+# Maximum number of frames a lagging feed skips per read to catch up with the first feed.
+MAX_SKIPPED_FRAMES = 5
+
+class CaptureGroup(object):
+    """
+    Captures a frame of each of several feeds at nearly the same instant.
+    Every feed grabs its next frame back to back, and frames are only decoded once all
+    of them are grabbed, so decoding does not spread the instants they are captured at.
+
+    If a tolerance in seconds is provided, frames are paired on their capture timestamps
+    with the frame of the first feed, which sets the pace. Feeds lagging further behind
+    skip frames to catch up, and feeds further ahead repeat their previous frame, keeping
+    the one they grabbed for a later read.
+
+    The skew of every read, the spread of the capture timestamps of its frames,
+    is measured along with the number of skipped and repeated frames.
+    """
+
+    def __init__(self, feeds, tolerance=None, max_skips=MAX_SKIPPED_FRAMES):
+        self.feeds = feeds
+        self.tolerance = tolerance
+        self.max_skips = max_skips
+        self.frames = [None] * len(feeds)
+        self.timestamps = [None] * len(feeds)
+        self.pending = [False] * len(feeds)
+        self.count = 0
+        self.skipped = 0
+        self.repeated = 0
+        self.skew = 0.0
+        self.max_skew = 0.0
+        self.total_skew = 0.0
+
+    def read(self):
+        """
+        Returns the next frames of the feeds, or None once any feed runs out of frames.
+        Frames are only valid until the next read.
+        """
+        for index, feed in enumerate(self.feeds):
+            if not self.pending[index]:
+                if not feed.grab():
+                    return None
+                self.pending[index] = True
+
+        retrieved = list(self.pending)
+        if self.tolerance is not None:
+            reference = self.feeds[0].timestamp
+            for index, feed in enumerate(self.feeds[1:], 1):
+                skips = 0
+                while feed.timestamp < reference - self.tolerance and skips < self.max_skips:
+                    if not feed.grab():
+                        return None
+                    skips += 1
+                self.skipped += skips
+                if feed.timestamp > reference + self.tolerance and \
+                        self.frames[index] is not None:
+                    retrieved[index] = False
+                    self.repeated += 1
+
+        for index, feed in enumerate(self.feeds):
+            if retrieved[index]:
+                self.frames[index] = feed.retrieve()
+                self.timestamps[index] = feed.timestamp
+                self.pending[index] = False
+        if any(frame is None for frame in self.frames):
+            return None
+
+        self.update_skew()
+        return list(self.frames)
+
+    def update_skew(self):
+        """
+        Records the skew of the frames of the last read.
+        """
+        self.count += 1
+        self.skew = max(self.timestamps) - min(self.timestamps)
+        self.max_skew = max(self.max_skew, self.skew)
+        self.total_skew += self.skew
+
+    def get_mean_skew(self):
+        """
+        Returns the mean skew of the reads in seconds.
+        """
+        return self.total_skew / self.count if self.count else 0.0
+
+    def get_stats(self):
+        """
+        Returns the skew statistics of the reads.
+        """
+        return {
+            'reads': self.count,
+            'skew': self.skew,
+            'mean-skew': self.get_mean_skew(),
+            'max-skew': self.max_skew,
+            'skipped': self.skipped,
+            'repeated': self.repeated,
+        }
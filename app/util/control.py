@@ -0,0 +1,54 @@
+"""
+Module for controlling a running stitch loop from outside of it.
+"""
+from __future__ import absolute_import, division, print_function
+
+import threading
+
+# Commands read from a control stream that stop the stitch loop.
+QUIT_COMMANDS = ('q', 'quit')
+
+class ControlChannel(object):
+    """
+    Channel through which the stitch loop is asked to quit, so quitting does not depend
+    on polling the keyboard of a preview window in the loop.
+    Commands are read line by line from the provided stream, such as the standard input of
+    the driver when it is run by the electron app, on a background thread.
+    Quitting can also be requested directly, for instance by the preview.
+    """
+
+    def __init__(self, stream=None):
+        self.stream = stream
+        self.quit = threading.Event()
+        self.thread = None
+
+    def start(self):
+        """
+        Starts reading commands from the stream, if any.
+        """
+        if self.stream is None:
+            return
+        self.thread = threading.Thread(target=self.run, name="control")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def run(self):
+        """
+        Worker loop reading commands until the stream is closed or quitting is requested.
+        """
+        for line in iter(self.stream.readline, ''):
+            if line.strip().lower() in QUIT_COMMANDS:
+                self.request_quit()
+                return
+
+    def request_quit(self):
+        """
+        Asks the stitch loop to quit after its current frame.
+        """
+        self.quit.set()
+
+    def should_quit(self):
+        """
+        Declares whether the stitch loop was asked to quit.
+        """
+        return self.quit.is_set()
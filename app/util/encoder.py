@@ -0,0 +1,148 @@
+"""
+Module for feeding frames to an encoder process on a background thread.
+"""
+from __future__ import absolute_import, division, print_function
+
+import threading
+import time
+
+from .grabber import FrameRing
+
+# Number of frames queued for the encoder. A ring slot is held by the frame being written.
+ENCODER_SLOTS = 8
+
+# Seconds to wait for the encoder to take the queued frames, and then to exit, on stopping.
+STOP_TIMEOUT = 5.0
+
+# Seconds between checks of whether the encoder process exited.
+POLL_INTERVAL = 0.05
+
+class EncoderSink(object):
+    """
+    Writes frames to the standard input of an encoder process, such as ffmpeg, on its own
+    thread, so the stitch loop never blocks on the encoder or the network behind it.
+    Frames are copied once into a bounded queue of preallocated slots, and written to the
+    pipe straight from their slots through memoryviews.
+
+    When the encoder falls behind and the queue is full, frames are handled with the
+    provided overflow policy (see grabber.OVERFLOW_POLICIES): the oldest queued frame is
+    dropped, the new frame is dropped, or the loop blocks until a slot is free.
+    The depth of the queue and the time spent stalled on writes are measured.
+    If the encoder fails, the sink stops taking frames. If it stalls on stopping,
+    the frames still queued are abandoned and the encoder is terminated.
+    """
+
+    def __init__(self, process, slots=ENCODER_SLOTS, policy='oldest'):
+        self.process = process
+        self.ring = FrameRing(slots + 1, policy)
+        self.offered = 0
+        self.encoded = 0
+        self.depth_total = 0
+        self.max_depth = 0
+        self.stall = 0.0
+        self.max_stall = 0.0
+        self.abandoned = 0
+        self.error = None
+        self.thread = threading.Thread(target=self.run, name="encoder")
+        self.thread.daemon = True
+
+    def start(self):
+        """
+        Starts the writer thread.
+        """
+        self.thread.start()
+
+    def write(self, frame):
+        """
+        Queues a copy of the frame for the encoder. Returns False if it was dropped.
+        The frame can be reused by the caller as soon as this returns.
+        """
+        if self.ring.closed:
+            return False
+        depth = self.ring.get_depth()
+        self.offered += 1
+        self.depth_total += depth
+        self.max_depth = max(self.max_depth, depth)
+        return self.ring.write(frame)
+
+    def run(self):
+        """
+        Worker loop writing queued frames in order until the sink is stopped
+        and the queue is drained.
+        """
+        try:
+            while True:
+                frame, _ = self.ring.read('drain')
+                if frame is None:
+                    break
+                start_time = time.time()
+                # Unbuffered pipes may take part of a frame, so the rest is written
+                # until the encoder has the whole frame.
+                view = memoryview(frame).cast('B')
+                while view:
+                    view = view[self.process.stdin.write(view):]
+                stall = time.time() - start_time
+                self.stall += stall
+                self.max_stall = max(self.max_stall, stall)
+                self.encoded += 1
+        except (IOError, OSError, ValueError) as error:
+            self.error = error
+        finally:
+            self.ring.close()
+
+    def stop(self, timeout=STOP_TIMEOUT):
+        """
+        Writes the queued frames, then closes the pipe and waits for the encoder to finish.
+        If the encoder does not take the queued frames or exit within the timeout, as when
+        the network behind it stalls, it is terminated, or killed if it still runs,
+        and the frames it did not take are counted as abandoned.
+        """
+        self.ring.close()
+        if self.thread.is_alive():
+            self.thread.join(timeout)
+        if self.thread.is_alive():
+            # Stopping the encoder fails the blocked write, so the writer thread exits.
+            self.halt(timeout)
+            self.thread.join(timeout)
+        try:
+            self.process.stdin.close()
+        except (IOError, OSError):
+            pass
+        if wait_process(self.process, timeout) is None:
+            self.halt(timeout)
+        self.abandoned = self.offered - self.ring.dropped - self.encoded
+
+    def halt(self, timeout=STOP_TIMEOUT):
+        """
+        Terminates the encoder process, killing it if it does not exit within the timeout.
+        """
+        self.process.terminate()
+        if wait_process(self.process, timeout) is None:
+            self.process.kill()
+            self.process.wait()
+
+    def get_stats(self):
+        """
+        Returns the counters of the sink: frames encoded and dropped, mean and maximum
+        queue depth, seconds stalled on writes in total and at most, and frames abandoned
+        in the queue of a stalled encoder.
+        """
+        return {
+            'encoded': self.encoded,
+            'dropped': self.ring.dropped,
+            'mean-depth': self.depth_total / self.offered if self.offered else 0.0,
+            'max-depth': self.max_depth,
+            'stall': self.stall,
+            'max-stall': self.max_stall,
+            'abandoned': self.abandoned,
+        }
+
+def wait_process(process, timeout):
+    """
+    Waits up to timeout seconds for a process to exit.
+    Returns its exit code, or None if it is still running.
+    """
+    deadline = time.time() + timeout
+    while process.poll() is None and time.time() < deadline:
+        time.sleep(POLL_INTERVAL)
+    return process.poll()
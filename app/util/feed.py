@@ -4,28 +4,67 @@ Module for defining wrappers to OpenCV incoming feeds.
 from __future__ import absolute_import, division, print_function
 from abc import ABCMeta, abstractmethod
 import sys
-import imutils
+import time
 import cv2
-from app.stitcher.correction.corrector import correct_distortion
+from app.stitcher.correction.corrector import DEFAULT_CORRECTOR, get_output_size
+from .framepool import DEFAULT_FRAME_POOL
+from .grabber import RING_SLOTS, Grabber
 from .textformatter import TextFormatter
 
+# Capture property of the position of a video in milliseconds, which older OpenCV versions
+# only expose in their cv namespace.
+CAP_PROP_POS_MSEC = getattr(cv2, 'CAP_PROP_POS_MSEC', 0)
+
+# Capture property of the index of the next frame of a video, as CAP_PROP_POS_MSEC.
+CAP_PROP_POS_FRAMES = getattr(cv2, 'CAP_PROP_POS_FRAMES', 1)
+
+# Capture property of the frame rate of a video, as CAP_PROP_POS_MSEC.
+CAP_PROP_FPS = getattr(cv2, 'CAP_PROP_FPS', 5)
+
+# Number of frames before the target that seeks land at, to be decoded up to the target.
+# Seeks still landing past the target back off further, up to the start of the video.
+SEEK_PREROLL_FRAMES = 16
+
 class Feed(object):
     """
     Abstract feed class for representing a feed.
+    Iterating over a feed yields its frames, each grabbed and decoded exactly once.
     """
     __metaclass__ = ABCMeta
 
+    def __iter__(self):
+        """
+        Yields the remaining frames of the feed until it runs out.
+        """
+        while self.grab():
+            yield self.retrieve()
+
     @abstractmethod
     def has_next(self):
         """
-        Returns True if feed has remaining frames.
+        Returns True if feed has remaining frames, grabbing the next one.
         """
         pass
 
     @abstractmethod
     def get_next(self):
         """
-        Returns the next frame from feed.
+        Returns the next frame from feed, or the frame grabbed by has_next.
+        """
+        pass
+
+    @abstractmethod
+    def grab(self):
+        """
+        Grabs the next frame without decoding it, and records its capture time in seconds
+        in the timestamp attribute. Returns True if a frame was grabbed.
+        """
+        pass
+
+    @abstractmethod
+    def retrieve(self):
+        """
+        Returns the last grabbed frame, decoded and corrected.
         """
         pass
 
@@ -50,17 +89,79 @@ class Feed(object):
         """
         pass
 
-class CameraFeed(Feed):
+def correct_frame(feed, frame, camera):
+    """
+    Corrects a frame read from the provided feed and resizes it to the feed width.
+    Single-pass feeds undistort and downscale in one remap at the output resolution,
+    otherwise the full frame is undistorted and then resized.
+    Frames are corrected into buffers of the frame pool of the feed, and the previous frame
+    of the feed is released to the pool, so a corrected frame is only valid until the next.
+    """
+    output_size = get_output_size((frame.shape[1], frame.shape[0]), feed.width)
+    corrected = feed.pool.acquire((output_size[1], output_size[0]) + frame.shape[2:],
+                                  frame.dtype)
+    if feed.single_pass:
+        feed.corrector.correct(frame, camera, feed.width, corrected)
+    else:
+        undistorted = feed.corrector.correct(frame, camera,
+                                             dst=feed.pool.acquire(frame.shape, frame.dtype))
+        cv2.resize(undistorted, output_size, dst=corrected, interpolation=cv2.INTER_AREA)
+        feed.pool.release(undistorted)
+    feed.pool.release(feed.frame)
+    feed.frame = corrected
+    return corrected
+
+class CameraFeed(Feed): # pylint: disable=too-many-instance-attributes
     """
     Wrapper class for incoming camera feed.
+    Frames are corrected with the calibration profile of camera_id (a serial, for example),
+    which defaults to the feed index.
+
+    Frames can be captured and corrected on a background thread (see start_capture),
+    in which case get_next takes buffered frames without waiting on the camera, and the
+    capture time of the last frame it returned is kept in timestamp.
+    Frames are read and corrected into buffers of the provided frame pool, which defaults
+    to the shared one.
     """
-    def __init__(self, feed_index, width=640, height=480, fps=30):
+    def __init__(self, feed_index, width=640, height=480, fps=30,
+                 corrector=None, single_pass=True, camera_id=None, pool=None):
         self.feed_index = feed_index
+        self.camera_id = camera_id if camera_id is not None else feed_index
         self.camera_feed = cv2.VideoCapture(feed_index)
         self.width = width
         self.height = height
         self.fps = fps
         self.frame_duration = 1.0 / fps
+        self.corrector = corrector if corrector is not None else DEFAULT_CORRECTOR
+        self.single_pass = single_pass
+        self.pool = pool if pool is not None else DEFAULT_FRAME_POOL
+        self.frame = None
+        self.raw = None
+        self.grabber = None
+        self.capture_policy = None
+        self.timestamp = None
+        self.grabbed = False
+
+    def start_capture(self, policy='latest', slots=RING_SLOTS):
+        """
+        Starts capturing and correcting frames on a background thread into a ring buffer
+        of the provided number of slots. Frames are then taken with the provided policy
+        (see grabber.CAPTURE_POLICIES): the latest frame only, or every frame in order.
+        """
+        if self.grabber is None:
+            self.capture_policy = policy
+            self.grabber = Grabber(self.camera_feed,
+                                   lambda frame: correct_frame(self, frame, self.camera_id),
+                                   slots, "capture-%s" % self.feed_index)
+            self.grabber.start()
+
+    def stop_capture(self):
+        """
+        Stops capturing frames on a background thread.
+        """
+        if self.grabber is not None:
+            self.grabber.stop()
+            self.grabber = None
 
     def is_valid(self):
         """
@@ -91,9 +192,10 @@ class CameraFeed(Feed):
 
     def has_next(self):
         """
-        Declares if the CameraFeed has a next frame.
+        Declares if the CameraFeed has a next frame, grabbing it for get_next.
+        When capturing in the background, waits for a frame to be buffered.
         """
-        return self.camera_feed.grab()
+        return self.grab()
 
     def retrieve_next(self):
         """
@@ -102,16 +204,47 @@ class CameraFeed(Feed):
         """
         return self.camera_feed.retrieve()
 
+    def grab(self):
+        """
+        Grabs the next frame, timestamped with the time it was grabbed at.
+        When capturing in the background, the frame is left buffered until it is retrieved,
+        and grabbing again before retrieving skips it.
+        """
+        if self.grabber is None:
+            self.grabbed = self.camera_feed.grab()
+            self.timestamp = time.time()
+            return self.grabbed
+
+        if self.grabbed:
+            self.grabber.ring.skip(self.capture_policy)
+        self.timestamp = self.grabber.ring.peek(self.capture_policy)
+        self.grabbed = self.timestamp is not None
+        return self.grabbed
+
+    def retrieve(self):
+        """
+        Returns the last grabbed frame, corrected.
+        """
+        self.grabbed = False
+        if self.grabber is None:
+            found, raw = self.camera_feed.retrieve(self.raw)
+            if not found:
+                return None
+            self.raw = raw
+            return correct_frame(self, raw, self.camera_id)
+        frame, self.timestamp = self.grabber.read(self.capture_policy)
+        return frame
 
     def get_next(self):
         """
-        Gets the next frame in the CameraFeed. If resize is True, resizes frame.
-        If correct is True, corrects distortion.
+        Gets the next frame in the CameraFeed, corrected and resized to the feed width.
+        If has_next grabbed a frame, that frame is returned instead of grabbing another.
+        Returns None if the camera delivers no frame.
+        When capturing in the background, the frame is only valid until the next call.
         """
-        frame = self.camera_feed.read()[1]
-        frame = correct_distortion(frame)
-        frame = imutils.resize(frame, width=self.width)
-        return frame
+        if not self.grabbed and not self.grab():
+            return None
+        return self.retrieve()
 
     def ramp(self, num_frames=30):
         """ Ramps the camera feed to prepare for capture and data relay. """
@@ -127,8 +260,7 @@ class CameraFeed(Feed):
         Shows a resized version of the CameraFeed.
         """
         if self.is_valid():
-            while self.has_next():
-                frame = self.get_next()
+            for frame in self:
                 title = "Camera Feed %s" % self.feed_index
                 cv2.imshow(title, frame)
                 key = cv2.waitKey(1) & 0xFF
@@ -141,20 +273,35 @@ class CameraFeed(Feed):
 
     def close(self):
         """
-        Closes the CameraFeed.
+        Closes the CameraFeed, stopping the background capture first if it is running.
         """
+        self.stop_capture()
         self.camera_feed.release()
 
     def show_corrected(self):
         raise Exception('Not implemented!')
 
 class VideoFeed(Feed):
-    """ Wrapper class for video feed. """
-    def __init__(self, path, width=640, height=480):
+    """
+    Wrapper class for video feed.
+    Frames are corrected with the calibration profile of the camera_id that recorded the video,
+    into buffers of the provided frame pool, which defaults to the shared one.
+    """
+    def __init__(self, path, width=640, height=480, corrector=None, single_pass=True,
+                 camera_id=None, pool=None):
         self.path = path
+        self.camera_id = camera_id
         self.video_feed = cv2.VideoCapture(path)
         self.width = width
         self.height = height
+        self.corrector = corrector if corrector is not None else DEFAULT_CORRECTOR
+        self.single_pass = single_pass
+        self.pool = pool if pool is not None else DEFAULT_FRAME_POOL
+        self.frame = None
+        self.raw = None
+        self.timestamp = None
+        self.grabbed = False
+        self.held = False
 
     def is_valid(self):
         """
@@ -182,27 +329,80 @@ class VideoFeed(Feed):
 
     def has_next(self):
         """
-        Declares if the VideoFeed has a next frame.
+        Declares if the VideoFeed has a next frame, grabbing it for get_next.
         """
-        return self.video_feed.grab()
+        return self.grab()
+
+    def seek(self, index):
+        """
+        Moves to the frame of the provided index, so it is the next one grabbed.
+        Seeking by frame index is only approximate on long-GOP videos, so the seek lands
+        a few frames early and frames are decoded forward up to the one whose timestamp
+        matches the index. That frame is held for the next grab.
+        """
+        self.grabbed = False
+        self.held = False
+        fps = self.video_feed.get(CAP_PROP_FPS)
+        if index <= 0 or not fps:
+            self.video_feed.set(CAP_PROP_POS_FRAMES, max(0, index))
+            return
+
+        preroll = SEEK_PREROLL_FRAMES
+        while True:
+            start = max(0, index - preroll)
+            self.video_feed.set(CAP_PROP_POS_FRAMES, start)
+            position = None
+            while self.grab():
+                position = int(round(self.timestamp * fps))
+                if position >= index:
+                    break
+            if position is None or position < index:
+                # The video ran out of frames before the index.
+                return
+            if position == index or start == 0:
+                self.held = True
+                return
+            preroll *= 4
+
+    def grab(self):
+        """
+        Grabs the next frame, timestamped with its position in the video.
+        """
+        if self.held:
+            self.held = False
+            return self.grabbed
+        self.grabbed = self.video_feed.grab()
+        if self.grabbed:
+            self.timestamp = self.video_feed.get(CAP_PROP_POS_MSEC) / 1000.0
+        return self.grabbed
+
+    def retrieve(self):
+        """
+        Returns the last grabbed frame, corrected.
+        """
+        self.grabbed = False
+        found, raw = self.video_feed.retrieve(self.raw)
+        if not found:
+            return None
+        self.raw = raw
+        return correct_frame(self, raw, self.camera_id)
 
     def get_next(self):
         """
-        Gets the next frame in the CameraFeed. If resize is True, resizes frame.
-        If correct is True, corrects distortion.
+        Gets the next frame in the VideoFeed, corrected and resized to the feed width.
+        If has_next grabbed a frame, that frame is returned instead of grabbing another.
+        Returns None once the video runs out of frames.
         """
-        frame = self.video_feed.read()[1]
-        frame = correct_distortion(frame)
-        frame = imutils.resize(frame, width=self.width)
-        return frame
+        if not self.grabbed and not self.grab():
+            return None
+        return self.retrieve()
 
     def show(self):
         """
         Shows a resized version of the CameraFeed.
         """
         if self.is_valid():
-            while self.has_next():
-                frame = self.get_next()
+            for frame in self:
                 title = "Video Feed"
                 cv2.imshow(title, frame)
                 key = cv2.waitKey(1) & 0xFF
@@ -4,15 +4,21 @@ Module responsible for checking the effectiveness and accuracy of enforced fps.
 
 from __future__ import absolute_import, division, print_function
 
+import argparse
 import time
 
+from app.util.pacer import FramePacer, Histogram
 from app.util.textformatter import TextFormatter
 
 def main():
     """
     Responsible for printing information about accuracy of enforced fps.
     """
-    compare_sleep_to_fps()
+    args = parse_args()
+    if args.check_pacer:
+        compare_pacer_to_sleep(args.fps, args.loops)
+    else:
+        compare_sleep_to_fps(args.fps)
 
 def compare_sleep_to_fps(fps=30, accuracy=0.1):
     """
@@ -37,5 +43,47 @@ def compare_sleep_to_fps(fps=30, accuracy=0.1):
         TextFormatter.print_info("Residual Average for those Loops: %f" % residual_average)
         total_loops += 1
 
+def compare_pacer_to_sleep(fps=30, loops=300):
+    """
+    Compares the jitter of frames paced by sleeping an interval per frame to that of
+    frames paced on the deadlines of a FramePacer, and the drift of both after the loops.
+    """
+    duration = 1.0 / fps
+    jitter = Histogram()
+    start_time = time.time()
+    for index in range(loops):
+        time.sleep(duration)
+        jitter.add(abs(time.time() - (start_time + (index + 1) * duration)))
+    print_jitter("sleep", jitter, time.time() - start_time - loops * duration)
+
+    pacer = FramePacer(fps)
+    pacer.start()
+    start_time = time.time()
+    for _ in range(loops):
+        pacer.wait()
+    print_jitter("pacer", pacer.jitter, time.time() - start_time - (loops - 1) * duration)
+
+def print_jitter(name, jitter, drift):
+    """
+    Prints a jitter histogram and the drift of the loops from their expected duration.
+    """
+    TextFormatter.print_heading("%s: %.2f ms mean jitter, %.2f ms max, %.1f ms drift" % (
+        name, jitter.get_mean(), jitter.maximum, 1000 * drift))
+    for label, count in jitter.get_bins():
+        TextFormatter.print_pair(label, count)
+
+def parse_args():
+    """
+    Returns parsed arguments
+    """
+    parser = argparse.ArgumentParser(description="Enforced fps checker")
+    parser.add_argument('--fps', dest='fps', type=float, default=30,
+                        help='Objective frames per second.')
+    parser.add_argument('--pacer', dest='check_pacer', action='store_true', default=False,
+                        help='Compare sleeping per frame to pacing on deadlines.')
+    parser.add_argument('--loops', dest='loops', type=int, default=300,
+                        help='Number of paced frames compared.')
+    return parser.parse_args()
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,60 @@
+"""
+Module for recycling frame buffers across the stages of the pipeline.
+"""
+from __future__ import absolute_import, division, print_function
+
+import threading
+import numpy as np
+
+# Maximum number of released buffers kept per shape and type. Buffers released beyond it
+# are left to the garbage collector.
+MAX_FREE_BUFFERS = 8
+
+class FramePool(object):
+    """
+    Pool of frame buffers, keyed by shape and type. Stages acquire buffers to write frames
+    into with the dst forms of OpenCV functions, and release them once the frames are
+    consumed, so frames of a running pipeline reuse the same memory instead of allocating
+    new arrays. Buffers can be acquired and released from any thread.
+    """
+
+    def __init__(self, max_free=MAX_FREE_BUFFERS):
+        self.max_free = max_free
+        self.free = {}
+        self.allocated = 0
+        self.reused = 0
+        self.lock = threading.Lock()
+
+    def acquire(self, shape, dtype=np.uint8):
+        """
+        Returns a buffer of the provided shape and type, with undefined content.
+        """
+        key = (tuple(shape), np.dtype(dtype).str)
+        with self.lock:
+            buffers = self.free.get(key)
+            if buffers:
+                self.reused += 1
+                return buffers.pop()
+            self.allocated += 1
+        return np.empty(shape, dtype)
+
+    def release(self, frame):
+        """
+        Returns a buffer to the pool. The buffer must not be used after it is released.
+        """
+        if frame is None or frame.base is not None or not frame.flags.c_contiguous:
+            return
+        key = (frame.shape, frame.dtype.str)
+        with self.lock:
+            buffers = self.free.setdefault(key, [])
+            if len(buffers) < self.max_free and not any(buf is frame for buf in buffers):
+                buffers.append(frame)
+
+    def clear(self):
+        """
+        Drops all released buffers.
+        """
+        with self.lock:
+            self.free.clear()
+
+DEFAULT_FRAME_POOL = FramePool()
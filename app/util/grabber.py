@@ -0,0 +1,224 @@
+"""
+Module for capturing frames of a feed on a background thread into a ring buffer.
+"""
+from __future__ import absolute_import, division, print_function
+
+from collections import deque
+import threading
+import time
+import numpy as np
+
+# Policies of taking frames from a ring buffer. Latest takes the freshest frame and skips
+# older ones, drain takes frames in capture order.
+CAPTURE_POLICIES = ('latest', 'drain')
+
+# Policies of writing to a full ring buffer. Oldest overwrites the oldest unread frame,
+# newest drops the written frame, and block waits for the reader to free a slot.
+OVERFLOW_POLICIES = ('oldest', 'newest', 'block')
+
+# Number of slots of a ring buffer. A slot is held by the reader and another one may be
+# written to, so at least three slots are needed to always keep a frame ready.
+RING_SLOTS = 4
+
+# Seconds to wait for a grabber thread to finish its current frame when stopping.
+STOP_TIMEOUT = 2.0
+
+class FrameRing(object):
+    """
+    Preallocated ring of frame slots, written by a capture thread and read by the frame loop.
+    Frames are copied into slots allocated once and reused, and read frames are returned
+    without copying, so a read frame is only valid until the next read.
+    When the reader falls behind, the oldest unread frame is overwritten and counted as dropped,
+    or the written frame is dropped or waits for a free slot, with the provided overflow
+    policy (see OVERFLOW_POLICIES).
+    """
+
+    def __init__(self, slots=RING_SLOTS, overflow='oldest'):
+        if slots < 3:
+            raise ValueError("A ring buffer needs at least 3 slots, got %d." % slots)
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError("Unknown overflow policy %s. Choose one of %s."
+                             % (overflow, ", ".join(OVERFLOW_POLICIES)))
+        self.overflow = overflow
+        self.buffers = [None] * slots
+        self.timestamps = [0.0] * slots
+        self.free = deque(range(slots))
+        self.ready = deque()
+        self.held = None
+        self.closed = False
+        self.written = 0
+        self.dropped = 0
+        self.skipped = 0
+        self.condition = threading.Condition()
+
+    def write(self, frame, timestamp=None):
+        """
+        Copies the frame into a slot and publishes it with its capture timestamp,
+        which defaults to now. Returns False if the frame was dropped instead.
+        """
+        with self.condition:
+            while not self.free and self.overflow == 'block' and not self.closed:
+                self.condition.wait()
+            if self.free:
+                slot = self.free.popleft()
+            elif self.overflow == 'oldest' and self.ready:
+                slot = self.ready.popleft()
+                self.dropped += 1
+            else:
+                self.dropped += 1
+                return False
+
+        buf = self.buffers[slot]
+        if buf is None or buf.shape != frame.shape or buf.dtype != frame.dtype:
+            buf = self.buffers[slot] = np.empty_like(frame)
+        np.copyto(buf, frame)
+
+        with self.condition:
+            self.timestamps[slot] = time.time() if timestamp is None else timestamp
+            self.ready.append(slot)
+            self.written += 1
+            self.condition.notify_all()
+        return True
+
+    def wait(self, timeout=None):
+        """
+        Waits until a frame is ready to be read or the ring is closed.
+        Returns True if a frame is ready.
+        """
+        with self.condition:
+            if timeout is None:
+                while not self.ready and not self.closed:
+                    self.condition.wait()
+            elif not self.ready and not self.closed:
+                self.condition.wait(timeout)
+            return bool(self.ready)
+
+    def peek(self, policy='latest', timeout=None):
+        """
+        Returns the timestamp of the frame the next read with the provided policy would
+        return, waiting for one if none is ready, without taking it. Returns None if the
+        ring is closed or no frame arrived in time.
+        """
+        check_policy(policy)
+        if not self.wait(timeout):
+            return None
+        with self.condition:
+            if not self.ready:
+                return None
+            return self.timestamps[self.ready[-1] if policy == 'latest' else self.ready[0]]
+
+    def skip(self, policy='latest'):
+        """
+        Drops the frames the next read with the provided policy would return or skip.
+        """
+        check_policy(policy)
+        with self.condition:
+            count = len(self.ready) if policy == 'latest' else min(len(self.ready), 1)
+            for _ in range(count):
+                self.free.append(self.ready.popleft())
+            self.skipped += count
+            self.condition.notify_all()
+
+    def read(self, policy='latest', timeout=None):
+        """
+        Returns the next frame and its timestamp with the provided policy
+        (see CAPTURE_POLICIES), waiting for one if none is ready.
+        Returns (None, None) if the ring is closed or no frame arrived in time.
+        """
+        check_policy(policy)
+        if not self.wait(timeout):
+            return None, None
+
+        with self.condition:
+            if policy == 'latest':
+                slot = self.ready.pop()
+                self.skipped += len(self.ready)
+                self.free.extend(self.ready)
+                self.ready.clear()
+            else:
+                slot = self.ready.popleft()
+            if self.held is not None:
+                self.free.append(self.held)
+            self.held = slot
+            self.condition.notify_all()
+            return self.buffers[slot], self.timestamps[slot]
+
+    def get_depth(self):
+        """
+        Returns the number of frames waiting to be read.
+        """
+        with self.condition:
+            return len(self.ready)
+
+    def close(self):
+        """
+        Closes the ring, waking up readers waiting for frames and writers waiting for slots.
+        Frames still waiting can be read.
+        """
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+def check_policy(policy):
+    """
+    Raises a ValueError if the capture policy is unknown.
+    """
+    if policy not in CAPTURE_POLICIES:
+        raise ValueError("Unknown capture policy %s. Choose one of %s."
+                         % (policy, ", ".join(CAPTURE_POLICIES)))
+
+class Grabber(object):
+    """
+    Reads frames from a capture on a worker thread into a ring buffer, so the frame loop
+    does not wait on frame delivery. Frames are timestamped as soon as they are grabbed,
+    and processed with the provided function, if any, before they are buffered.
+    The worker stops when the capture runs out of frames or when the grabber is stopped.
+    """
+
+    def __init__(self, capture, process=None, slots=RING_SLOTS, name="grabber"):
+        self.capture = capture
+        self.process = process
+        self.ring = FrameRing(slots)
+        self.stopped = False
+        self.thread = threading.Thread(target=self.run, name=name)
+        self.thread.daemon = True
+
+    def start(self):
+        """
+        Starts the worker thread.
+        """
+        self.thread.start()
+
+    def run(self):
+        """
+        Worker loop grabbing, timestamping and buffering frames.
+        """
+        frame = None
+        try:
+            while not self.stopped:
+                if not self.capture.grab():
+                    break
+                timestamp = time.time()
+                found, frame = self.capture.retrieve(frame)
+                if not found:
+                    break
+                self.ring.write(frame if self.process is None else self.process(frame),
+                                timestamp)
+        finally:
+            self.ring.close()
+
+    def read(self, policy='latest', timeout=None):
+        """
+        Returns the next frame and its capture timestamp with the provided policy,
+        or (None, None) once the capture has run out of frames.
+        """
+        return self.ring.read(policy, timeout)
+
+    def stop(self):
+        """
+        Stops the worker thread, waiting for it to finish its current frame.
+        """
+        self.stopped = True
+        if self.thread.is_alive() and self.thread is not threading.current_thread():
+            self.thread.join(STOP_TIMEOUT)
+        self.ring.close()
@@ -0,0 +1,134 @@
+"""
+Module for pacing the frame loop on absolute deadlines of a monotonic clock.
+"""
+from __future__ import absolute_import, division, print_function
+
+import bisect
+import time
+
+# Monotonic clock of the deadlines, falling back to the wall clock where it is missing.
+clock = getattr(time, 'monotonic', time.time)
+
+# Seconds before a deadline at which the pacer stops sleeping and spins, as sleeps
+# overshoot by about a millisecond (see fpschecker).
+SPIN_MARGIN = 0.002
+
+# Upper bin edges, in milliseconds, of the jitter and lateness histograms.
+HISTOGRAM_EDGES = (0.1, 0.5, 1.0, 2.0, 5.0, 10.0, 20.0, 50.0, 100.0)
+
+class Histogram(object):
+    """
+    Histogram of durations in milliseconds, binned on the provided upper edges,
+    with an overflow bin past the last edge.
+    """
+
+    def __init__(self, edges=HISTOGRAM_EDGES):
+        self.edges = edges
+        self.counts = [0] * (len(edges) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.maximum = 0.0
+
+    def add(self, seconds):
+        """
+        Adds a duration in seconds.
+        """
+        value = 1000 * seconds
+        self.counts[bisect.bisect_left(self.edges, value)] += 1
+        self.count += 1
+        self.total += value
+        self.maximum = max(self.maximum, value)
+
+    def get_mean(self):
+        """
+        Returns the mean of the durations in milliseconds.
+        """
+        return self.total / self.count if self.count else 0.0
+
+    def get_bins(self):
+        """
+        Returns the label and count of every bin.
+        """
+        labels = ["<= %g ms" % edge for edge in self.edges] + ["> %g ms" % self.edges[-1]]
+        return list(zip(labels, self.counts))
+
+class FramePacer(object):
+    """
+    Paces frames at the provided rate on absolute deadlines, start + n / fps, so sleep
+    errors never accumulate. The pacer sleeps until just before each deadline and spins
+    for the rest of the way.
+
+    When the loop falls a full interval or more behind, the frame in hand is stale.
+    It is dropped instead of being queued, and the deadlines that passed are skipped.
+    The next frame then covers them, so encoders repeat it to keep the timeline of
+    the output true to the wall clock.
+
+    Jitter, how late frames are released after their deadline, and lateness of
+    dropped frames are kept in histograms.
+    """
+
+    def __init__(self, fps, spin_margin=SPIN_MARGIN):
+        self.fps = fps
+        self.interval = 1.0 / fps
+        self.spin_margin = spin_margin
+        self.start_time = None
+        self.tick = 0
+        self.pending = 0
+        self.frames = 0
+        self.dropped = 0
+        self.missed = 0
+        self.jitter = Histogram()
+        self.lateness = Histogram()
+
+    def start(self):
+        """
+        Starts the deadlines from now.
+        """
+        self.start_time = clock()
+        self.tick = 0
+        self.pending = 0
+
+    def wait(self):
+        """
+        Waits for the deadline of the next frame. Returns the number of frame intervals
+        the frame covers: 1 when it is on time, more when it follows dropped frames,
+        or 0 if it is stale and should be dropped.
+        """
+        if self.start_time is None:
+            self.start()
+        deadline = self.start_time + self.tick * self.interval
+        now = clock()
+        if now - deadline >= self.interval:
+            missed = int((now - deadline) / self.interval)
+            self.lateness.add(now - deadline)
+            self.tick += missed
+            self.pending += missed
+            self.missed += missed
+            self.dropped += 1
+            return 0
+
+        if deadline - now > self.spin_margin:
+            time.sleep(deadline - now - self.spin_margin)
+        while clock() < deadline:
+            pass
+        self.jitter.add(clock() - deadline)
+        self.tick += 1
+        self.frames += 1
+        covered = 1 + self.pending
+        self.pending = 0
+        return covered
+
+    def get_stats(self):
+        """
+        Returns the pacing counters and histograms.
+        """
+        return {
+            'fps': self.fps,
+            'frames': self.frames,
+            'dropped': self.dropped,
+            'missed': self.missed,
+            'mean-jitter': self.jitter.get_mean(),
+            'max-jitter': self.jitter.maximum,
+            'jitter': self.jitter.get_bins(),
+            'lateness': self.lateness.get_bins(),
+        }
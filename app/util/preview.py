@@ -0,0 +1,111 @@
+"""
+Module for previewing stitched frames on a background thread at a decimated rate.
+"""
+from __future__ import absolute_import, division, print_function
+
+import threading
+import time
+import cv2
+import numpy as np
+
+from .textformatter import TextFormatter
+
+# Frames per second shown by the preview, whatever the rate of the stitch loop.
+PREVIEW_FPS = 10.0
+
+# Keys of the preview window that ask the stitch loop to quit.
+QUIT_KEYS = (ord('q'),)
+
+class PreviewSink(object):
+    """
+    Shows the latest stitched frame in a window at the provided rate, on its own thread,
+    so the stitch loop never waits on imshow or waitKey. The loop offers every frame, and
+    a frame is only copied when the preview is due for one, so skipped frames cost nothing.
+    Quit keys pressed in the window are forwarded to the provided control channel.
+    If no window can be shown, as on headless servers, the preview stops and the loop
+    carries on without it.
+    """
+
+    def __init__(self, control=None, fps=PREVIEW_FPS, name="Result"):
+        self.control = control
+        self.fps = fps
+        self.name = name
+        self.frame = None
+        self.offered = 0
+        self.shown = 0
+        self.wanted = threading.Event()
+        self.ready = threading.Event()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="preview")
+        self.thread.daemon = True
+
+    def start(self):
+        """
+        Starts the preview thread.
+        """
+        self.wanted.set()
+        self.thread.start()
+
+    def show(self, frame):
+        """
+        Offers a stitched frame to the preview, copying it if the preview is due for one.
+        The frame can be reused by the caller as soon as this returns.
+        """
+        self.offered += 1
+        if not self.wanted.is_set():
+            return
+        self.wanted.clear()
+        if self.frame is None or self.frame.shape != frame.shape:
+            self.frame = np.empty_like(frame)
+        np.copyto(self.frame, frame)
+        self.ready.set()
+
+    def run(self):
+        """
+        Worker loop showing offered frames, at most at the preview rate.
+        """
+        interval = 1.0 / self.fps
+        try:
+            while not self.stopped.is_set():
+                if not self.ready.wait(interval):
+                    continue
+                self.ready.clear()
+                start_time = time.time()
+                key = self.display(self.frame)
+                self.shown += 1
+                if key in QUIT_KEYS and self.control is not None:
+                    self.control.request_quit()
+                self.stopped.wait(interval - (time.time() - start_time))
+                self.wanted.set()
+        except cv2.error as error:
+            TextFormatter.print_error("Preview stopped: %s" % error)
+        finally:
+            self.close()
+
+    def display(self, frame):
+        """
+        Shows a frame in the preview window and returns the key pressed, if any.
+        """
+        cv2.imshow(self.name, frame)
+        return cv2.waitKey(1) & 0xFF
+
+    def close(self):
+        """
+        Closes the preview window. Called on the preview thread when it stops.
+        Headless OpenCV builds have no window to close.
+        """
+        if not self.shown:
+            return
+        try:
+            cv2.destroyWindow(self.name)
+            cv2.waitKey(1)
+        except cv2.error:
+            pass
+
+    def stop(self):
+        """
+        Stops the preview thread, closing its window.
+        """
+        self.stopped.set()
+        if self.thread.is_alive():
+            self.thread.join()